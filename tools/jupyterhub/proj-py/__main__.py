@@ -1,10 +1,27 @@
 import pulumi
-from infra import lab_cluster, lab_cluster_oidc, lab_s3_access_role, ecr_repo, jupyter_img, lab_svc_account, jupyter_fqdn
+from tracing import export_traces, program_span
+
+# Opened before the imports below, which resolve secrets and build the graph
+lab_program = program_span()
+
+from lookups import lookup_report
+from utils import data
+from infra import lab_cluster, lab_kubeconfig, lab_cluster_oidc, lab_s3_access_role, ecr_repo, jupyter_img_names, lab_tenant_svc_account, lab_tenants, values_hash, lab_sizing_report, jupyter_fqdn, lab_fleet_report, lab_learner_hubs, lab_hubs_ready
 
 pulumi.export("eks_arn", lab_cluster.arn)
 pulumi.export("eks_oidc", lab_cluster_oidc)
-pulumi.export("iam_irsa", lab_s3_access_role.arn)
+pulumi.export("iam_irsa", lab_s3_access_role.arn if lab_s3_access_role else None)
 pulumi.export("lab_repo", ecr_repo.repository_url)
-pulumi.export("image_name", jupyter_img.base_image_name)
-pulumi.export("k8s_irsa", lab_svc_account.metadata["name"])
-pulumi.export("lab_fqdn", jupyter_fqdn.fqdn)
\ No newline at end of file
+pulumi.export("image_names", jupyter_img_names)
+pulumi.export("k8s_irsa", lab_tenant_svc_account)
+pulumi.export("lab_namespaces", [tenant.namespace_name for tenant in lab_tenants])
+pulumi.export("values_hash", values_hash)
+pulumi.export("sizing_report", lab_sizing_report)
+pulumi.export("lab_fqdn", jupyter_fqdn.fqdn)
+pulumi.export("lab_fleet", lab_fleet_report)
+pulumi.export("learner_hubs", lab_learner_hubs)
+pulumi.export("hubs_ready", lab_hubs_ready)
+# Used by reaper.py and other out-of-band tooling
+pulumi.export("kubeconfig", pulumi.Output.secret(lab_kubeconfig))
+pulumi.export("lookup_timings", lookup_report())
+pulumi.export("trace_spans", export_traces(data.get("trace-file", ".lab-state/trace.json"), lab_program))
@@ -0,0 +1,360 @@
+# Graph-build benchmark: runs the Pulumi program against the mock runtime
+# (no AWS, Kubernetes or 1Password calls) with synthetic rosters and reports
+# how long building and resolving the resource graph takes per roster size.
+#
+#   python bench.py --tenants 1 50 500 --max-seconds 120 --output /tmp/bench.json
+#
+# With --clusters it deploys a fleet of that many clusters, one hub each and
+# one per region, against a stub AWS Load Balancer Controller per cluster
+# that takes --alb-seconds to provision an ALB (at most
+# CONTROLLER_RECONCILES at a time), hub releases that take
+# --release-seconds to install and hubs that take --ready-seconds to answer
+# health checks:
+#
+#   python bench.py --clusters 1 2 4 8 --alb-seconds 3 --ready-seconds 2 --release-seconds 3
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import runpy
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import yaml
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+STACK_FILE = os.path.join(HERE, "Pulumi.aws2023-jupyterhub.yaml")
+
+# Counts its calls in $OP_CALLS_FILE and takes $OP_SECONDS per call
+FAKE_OP = """#!/bin/sh
+[ -n "$OP_CALLS_FILE" ] && echo "$*" >> "$OP_CALLS_FILE"
+[ "$1" = "signin" ] && exit 0
+sleep "${OP_SECONDS:-0}"
+printf '{"fields": [{"id": "username", "value": "bench-client-id-%s"}, {"id": "password", "value": "bench-client-secret"}]}\\n' "$5"
+"""
+
+# The AWS Load Balancer Controller's default --max-concurrent-reconciles
+CONTROLLER_RECONCILES = 3
+
+GROUP_ANNOTATION = "alb.ingress.kubernetes.io/group.name"
+
+# Fleet clusters are spread over these, the stack's own region first
+FLEET_REGIONS = ["us-west-2", "us-east-1", "eu-west-1", "ap-southeast-1", "eu-central-1", "ap-northeast-1",
+                 "us-east-2", "ca-central-1"]
+
+
+def bench_config(tenants, workdir, ingress=None, overrides=None, clusters=None):
+    with open(STACK_FILE) as stack_file:
+        config = yaml.safe_load(stack_file)["config"]
+    details = dict(config["jupyterhub:details"])
+    op_bin = os.path.join(workdir, "op")
+    with open(op_bin, "w") as op_file:
+        op_file.write(FAKE_OP)
+    os.chmod(op_bin, 0o755)
+    details.update({
+        "deploy": True,
+        "roster": [f"learner{index:04d}" for index in range(tenants)],
+        "op-bin": op_bin,
+        "op-cache-ttl": 0,
+        "trace-file": os.path.join(workdir, "trace.json"),
+    })
+    details.pop("values-file", None)
+    if clusters:
+        regions = [str(config["aws:region"])] + [region for region in FLEET_REGIONS if region != config["aws:region"]]
+        details["clusters"] = [
+            {"name": f"{details['eks-cluster']}-{index}" if index else details["eks-cluster"], "key": f"c{index}",
+             "region": regions[index % len(regions)], "item": f"bench-oauth-c{index}"}
+            for index in range(clusters)
+        ]
+    if ingress:
+        details["ingress"] = {**(details.get("ingress") or {}), **ingress}
+    details.update(overrides or {})
+    return {"aws:region": str(config["aws:region"]), "jupyterhub:details": json.dumps(details)}
+
+
+# Local stand-ins for the catalog's GitHub notebooks repos, with "commits"
+# commits (the same ones on every run) on each branch a course uses, and the
+# git settings that send the program's ls-remote to them
+def notebook_remotes(workdir, catalog_path, commits=1):
+    from catalog import COMMIT, load_catalog
+
+    remotes = os.path.join(workdir, "remotes")
+    env = {**os.environ, "GIT_AUTHOR_DATE": "2023-01-01T00:00:00Z", "GIT_COMMITTER_DATE": "2023-01-01T00:00:00Z",
+           "GIT_AUTHOR_NAME": "bench", "GIT_AUTHOR_EMAIL": "bench@localhost",
+           "GIT_COMMITTER_NAME": "bench", "GIT_COMMITTER_EMAIL": "bench@localhost"}
+    for notebooks in load_catalog(catalog_path).notebooks.values():
+        ref = notebooks.get("ref", "main")
+        repo = os.path.join(remotes, notebooks["repo"].removeprefix("https://github.com/"))
+        if COMMIT.fullmatch(ref) or os.path.exists(repo):
+            continue
+        subprocess.run(["git", "init", "-q", "-b", ref, repo], check=True, env=env)
+        for commit in range(commits):
+            subprocess.run(["git", "-C", repo, "commit", "-q", "--allow-empty", "-m", f"notebooks {commit}"],
+                           check=True, env=env)
+    return {"GIT_CONFIG_COUNT": "1", "GIT_CONFIG_KEY_0": f"url.file://{remotes}/.insteadOf",
+            "GIT_CONFIG_VALUE_0": "https://github.com/"}
+
+
+def run_once(scenario):
+    import pulumi
+    import ingress
+
+    tenants = scenario["tenants"]
+    os.environ.update(scenario.get("env") or {})
+    os.environ["OP_SECONDS"] = str(scenario.get("op_seconds", 0))
+
+    # Hubs answer their health check after ready-seconds, polled by the program
+    def stub_hub_ready(host, settings):
+        time.sleep(scenario.get("ready_seconds", 0))
+        return scenario.get("ready_seconds", 0)
+
+    ingress.hub_ready = stub_hub_ready
+
+    # Canned answers for the program's invokes, resources echo their inputs
+    class LabMocks(pulumi.runtime.Mocks):
+
+        def __init__(self):
+            self.resources = 0
+            self.invokes = {}
+            self.albs = {}
+            # k8s provider id -> API server of its cluster, and one controller per cluster
+            self.clusters = {}
+            self._controllers = {}
+            self._lock = threading.Lock()
+
+        # An ingress group (or an ungrouped ingress) gets one ALB per cluster,
+        # the first ingress waits for it to be provisioned, later ones only for
+        # it to exist. Each cluster's controller reconciles a few at a time.
+        def provision_alb(self, args):
+            annotations = (args.inputs.get("metadata") or {}).get("annotations") or {}
+            group = annotations.get(GROUP_ANNOTATION) or args.name
+            cluster = self.clusters.get((args.provider or "").rpartition("::")[2])
+            with self._lock:
+                alb = self.albs.get((cluster, group))
+                first = alb is None
+                if first:
+                    alb = self.albs[cluster, group] = threading.Event()
+                controller = self._controllers.setdefault(cluster, threading.Semaphore(CONTROLLER_RECONCILES))
+            if first:
+                with controller:
+                    time.sleep(scenario.get("alb_seconds", 0))
+                alb.set()
+            alb.wait()
+            return f"k8s-{group}.us-west-2.elb.amazonaws.com"
+
+        def new_resource(self, args):
+            self.resources += 1
+            state = dict(args.inputs)
+            if args.typ == "pulumi:providers:kubernetes":
+                self.clusters[f"{args.name}-id"] = json.loads(args.inputs["kubeconfig"])["clusters"][0]["cluster"]["server"]
+            elif args.typ == "kubernetes:helm.sh/v3:Release":
+                # helm install, waiting for the hub to come up
+                time.sleep(scenario.get("release_seconds", 0))
+            elif args.typ == "kubernetes:networking.k8s.io/v1:Ingress":
+                state["status"] = {"loadBalancer": {"ingress": [{"hostname": self.provision_alb(args)}]}}
+            elif args.typ == "aws:ecr/repository:Repository":
+                state["repositoryUrl"] = f"012345678910.dkr.ecr.us-west-2.amazonaws.com/{args.inputs.get('name')}"
+            elif args.typ == "aws:iam/role:Role":
+                state["arn"] = f"arn:aws:iam::012345678910:role/{args.name}"
+            elif args.typ == "aws:route53/record:Record":
+                state["fqdn"] = args.inputs.get("name")
+            elif args.typ == "docker:index/image:Image":
+                state["repoDigest"] = f"{args.inputs.get('imageName')}@sha256:{'0' * 64}"
+            return [f"{args.name}-id", state]
+
+        # AWS lookups take invoke_seconds each, as a slow API would
+        def call(self, args):
+            with self._lock:
+                self.invokes[args.token] = self.invokes.get(args.token, 0) + 1
+            if args.token.startswith("aws:"):
+                time.sleep(scenario.get("invoke_seconds", 0))
+            if args.token == "aws:eks/getCluster:getCluster":
+                return {
+                    "name": args.args.get("name"),
+                    "arn": f"arn:aws:eks:us-west-2:012345678910:cluster/{args.args.get('name')}",
+                    "endpoint": f"https://{args.args.get('name')}.bench.eks.amazonaws.com",
+                    "certificateAuthorities": [{"data": "YmVuY2g="}],
+                    "identities": [{"oidcs": [{"issuer": "https://oidc.eks.us-west-2.amazonaws.com/id/BENCH"}]}],
+                    "vpcConfig": {"subnetIds": ["subnet-bench-a", "subnet-bench-b"]},
+                }
+            if args.token == "aws:eks/getClusterAuth:getClusterAuth":
+                return {"name": args.args.get("name"), "token": "bench-token"}
+            if args.token == "aws:ecr/getAuthorizationToken:getAuthorizationToken":
+                return {"authorizationToken": base64.b64encode(b"AWS:bench-password").decode("utf-8")}
+            if args.token == "aws:ecr/getImage:getImage":
+                # Provider errors come back as invoke failures
+                if scenario.get("image_error"):
+                    return {}, [("", scenario["image_error"])]
+                if not scenario.get("pushed", True):
+                    return {}, [("", "ImageNotFoundException: The image requested does not exist in the repository")]
+                return {"imageDigest": f"sha256:{'1' * 64}"}
+            if args.token == "aws:acm/getCertificate:getCertificate":
+                return {"arn": "arn:aws:acm:us-west-2:012345678910:certificate/bench"}
+            if args.token == "aws:elb/getHostedZoneId:getHostedZoneId":
+                return {"id": "Z1H1FL5HABSF5"}
+            if args.token == "aws:route53/getZone:getZone":
+                return {"zoneId": "ZBENCH", "name": args.args.get("name")}
+            if args.token == "kubernetes:helm:template":
+                return {"result": []}
+            return {}
+
+    with tempfile.TemporaryDirectory() as workdir:
+        os.environ["OP_CALLS_FILE"] = os.path.join(workdir, "op-calls")
+        config = bench_config(tenants, workdir, scenario.get("ingress"), scenario.get("details"), scenario.get("clusters"))
+        os.environ.update(notebook_remotes(workdir, json.loads(config["jupyterhub:details"]).get("catalog", "./catalog.yaml"),
+                                           scenario.get("notebook_commits", 1)))
+        pulumi.runtime.set_all_config(config)
+        mocks = LabMocks()
+        pulumi.runtime.set_mocks(mocks, project="jupyterhub", stack="bench", preview=False)
+        registrations = record_registrations(pulumi.runtime.settings.get_monitor(), scenario.get("inputs_of", [])) \
+                        if scenario.get("record") else None
+
+        # As "pulumi up --parallel": resource registrations in flight at once
+        if scenario.get("parallel"):
+            asyncio.get_event_loop().set_default_executor(ThreadPoolExecutor(max_workers=scenario["parallel"]))
+
+        started = time.perf_counter()
+        program = runpy.run_path(os.path.join(HERE, "__main__.py"), run_name="bench")
+        built = time.perf_counter()
+
+        @pulumi.runtime.test
+        def resolve():
+            return pulumi.Output.all(
+                       program["values_hash"],
+                       program["jupyter_fqdn"].fqdn,
+                       program["lab_hubs_ready"],
+                       *[tenant.ready for tenant in program["lab_tenants"]]
+                   )
+
+        resolve()
+        resolved = time.perf_counter()
+
+        from tracing import span_summary
+        op_calls = 0
+        if os.path.exists(os.environ["OP_CALLS_FILE"]):
+            with open(os.environ["OP_CALLS_FILE"]) as calls_file:
+                op_calls = sum(1 for line in calls_file if line.split()[-1:] != ["signin"])
+        return {
+            "tenants": tenants,
+            "clusters": scenario.get("clusters") or 1,
+            "albs": len(mocks.albs),
+            "resources": mocks.resources,
+            "build_seconds": round(built - started, 3),
+            "resolve_seconds": round(resolved - built, 3),
+            "total_seconds": round(resolved - started, 3),
+            "op_calls": op_calls,
+            "learner_hubs": program["lab_learner_hubs"],
+            "invokes": dict(sorted(mocks.invokes.items())),
+            "spans": span_summary(),
+            **({"registrations": registrations} if registrations is not None else {}),
+        }
+
+
+# What the engine would be asked to do per resource: its inputs (hashed, and
+# in full for the types in inputs_of), whether it is read or imported rather
+# than created, its aliases, dependencies and provider
+def record_registrations(monitor, inputs_of=()):
+    from google.protobuf.json_format import MessageToDict
+
+    registrations = {}
+    register_resource, read_resource = monitor.RegisterResource, monitor.ReadResource
+
+    def record(request, response, read):
+        inputs = MessageToDict(request.properties if read else request.object)
+        registrations[response.urn] = {
+            "type": request.type,
+            "inputs": hashlib.sha256(json.dumps(inputs, sort_keys=True, default=str).encode("utf-8")).hexdigest(),
+            "read": read,
+            "import": "" if read else request.importId,
+            "aliases": [] if read else [alias.spec.name for alias in request.aliases
+                                        if alias.HasField("spec") and alias.spec.name],
+            "dependencies": [] if read else sorted(request.dependencies),
+            "provider": request.provider,
+            **({"state": inputs} if request.type in inputs_of else {}),
+        }
+        return response
+
+    monitor.RegisterResource = lambda request: record(request, register_resource(request), False)
+    monitor.ReadResource = lambda request: record(request, read_resource(request), True)
+    return registrations
+
+
+def run_scenarios(scenarios, expect_failure=False):
+    # One interpreter per scenario, the program keeps module-level state. With
+    # expect_failure a failed run yields {"error": <its stderr>} instead of raising.
+    results = []
+    for scenario in scenarios:
+        completed = subprocess.run([sys.executable, __file__, "--run", json.dumps(scenario)], stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE if expect_failure else None, text=True)
+        if completed.returncode and expect_failure:
+            results.append({"error": completed.stderr})
+            continue
+        completed.check_returncode()
+        results.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+    return results
+
+
+def print_tenants(results):
+    print(f"{'tenants':>8} {'resources':>10} {'build':>8} {'resolve':>8} {'total':>8} {'ms/tenant':>10}")
+    for result in results:
+        print(f"{result['tenants']:>8} {result['resources']:>10} {result['build_seconds']:>7.2f}s "
+              f"{result['resolve_seconds']:>7.2f}s {result['total_seconds']:>7.2f}s "
+              f"{1000 * result['total_seconds'] / max(result['tenants'], 1):>10.1f}")
+
+
+def print_clusters(results):
+    print(f"{'clusters':>9} {'resources':>10} {'total':>8} {'s/cluster':>10}")
+    for result in results:
+        print(f"{result['clusters']:>9} {result['resources']:>10} {result['total_seconds']:>7.2f}s "
+              f"{result['total_seconds'] / result['clusters']:>9.2f}s")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark graph construction against mocked providers")
+    parser.add_argument("--tenants", type=int, nargs="+", default=[1, 50, 500])
+    parser.add_argument("--clusters", type=int, nargs="+", help="deploy a fleet of this many clusters, one per region")
+    parser.add_argument("--alb-seconds", type=float, default=3, help="stub ALB provisioning time (with --clusters)")
+    parser.add_argument("--ready-seconds", type=float, default=2,
+                        help="stub hub health check delay (with --clusters)")
+    parser.add_argument("--release-seconds", type=float, default=3, help="stub hub release install time (with --clusters)")
+    parser.add_argument("--parallel", type=int, default=32, help="resource operations in flight (with --clusters)")
+    parser.add_argument("--max-seconds", type=float, help="fail when any run takes longer than this")
+    parser.add_argument("--output", help="write the results as JSON, e.g. to compare commits")
+    parser.add_argument("--run", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    os.chdir(HERE)
+    if args.run is not None:
+        print(json.dumps(run_once(json.loads(args.run))))
+        return 0
+
+    if args.clusters:
+        timings = {"alb_seconds": args.alb_seconds, "ready_seconds": args.ready_seconds,
+                   "release_seconds": args.release_seconds, "parallel": args.parallel}
+        results = run_scenarios([{"tenants": 100, "clusters": clusters, **timings} for clusters in args.clusters])
+        print_clusters(results)
+    else:
+        results = run_scenarios([{"tenants": tenants} for tenants in args.tenants])
+        print_tenants(results)
+        slowest = max(results, key=lambda result: result["total_seconds"])
+        print("Slowest spans ({} tenants): {}".format(
+            slowest["tenants"],
+            ", ".join(f"{name} {span['max']}s (x{span['count']})" for name, span in list(slowest["spans"].items())[:6])))
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=1)
+    slowest = max(results, key=lambda result: result["total_seconds"])
+    if args.max_seconds and slowest["total_seconds"] > args.max_seconds:
+        print(f"{slowest['tenants']} tenants took {slowest['total_seconds']}s, over {args.max_seconds}s", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
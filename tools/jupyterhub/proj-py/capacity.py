@@ -0,0 +1,26 @@
+import math
+
+DEFAULT_WARM_CAPACITY = {
+    # Share of the roster expected to spawn at the same time
+    "concurrency": 0.5,
+    # Placeholder pods kept outside the class window
+    "idle-replicas": 0,
+    # Cron schedules (UTC) bracketing a class, e.g. "45 7 * * 1-5" / "0 10 * * 1-5"
+    "class-start": None,
+    "class-end": None,
+}
+
+
+# Placeholder pods to hold during a class window and outside it. Without a
+# schedule there is no window, idle-replicas are held all the time.
+def warm_capacity(details, roster_size):
+    settings = {**DEFAULT_WARM_CAPACITY, **(details.get("warm-capacity") or {})}
+    peak = math.ceil(roster_size * float(settings["concurrency"]))
+    scheduled = bool(settings["class-start"] and settings["class-end"])
+    return {
+        "peak_replicas": peak,
+        "baseline_replicas": int(settings["idle-replicas"]),
+        "class_start": settings["class-start"],
+        "class_end": settings["class-end"],
+        "scheduled": scheduled,
+    }
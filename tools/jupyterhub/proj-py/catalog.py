@@ -0,0 +1,97 @@
+import re
+import subprocess
+from dataclasses import dataclass, field
+from functools import lru_cache
+import yaml
+from chart_values import ModuleChoice, Profile
+
+COMMIT = re.compile(r"[0-9a-f]{40}")
+
+
+# Commit a notebooks ref points at, looked up once per run with git ls-remote
+# so that a moved branch or tag changes the image tag. Commits are kept as
+# they are; a peeled annotated tag wins over the tag object.
+@lru_cache(maxsize=None)
+def resolve_ref(repo, ref):
+    if COMMIT.fullmatch(ref):
+        return ref
+    listed = subprocess.run(["git", "ls-remote", repo, ref], check=True, text=True, stdout=subprocess.PIPE,
+                            timeout=60).stdout
+    commits = {name: commit for commit, name in (line.split("\t") for line in listed.splitlines())}
+    for name in (f"refs/tags/{ref}^{{}}", f"refs/tags/{ref}", f"refs/heads/{ref}", ref):
+        if name in commits:
+            return commits[name]
+    raise ValueError(f"Notebooks ref {ref} not found in {repo}")
+
+
+@dataclass
+class LabCatalog:
+    profiles: list
+    images: dict
+    default_image: str
+    quota: dict = field(default_factory=dict)
+    # (course slug, module slug) -> image variant
+    module_images: dict = field(default_factory=dict)
+    # course slug -> notebooks repo, ref and target directory
+    notebooks: dict = field(default_factory=dict)
+    # course slug -> node capacity ("spot", "on-demand", "any") and extra tolerations
+    scheduling: dict = field(default_factory=dict)
+
+    # "dir=repo@commit" specs baked into a variant, passed as NOTEBOOK_REPOS
+    def variant_notebooks(self, variant, resolve=resolve_ref):
+        courses = {course for (course, _), image in self.module_images.items() if image == variant}
+        return " ".join(sorted(
+            f"{self.notebooks[course]['dir']}={self.notebooks[course]['repo']}@"
+            f"{resolve(self.notebooks[course]['repo'], self.notebooks[course].get('ref', 'main'))}"
+            for course in courses if course in self.notebooks
+        ))
+
+    # Profiles with every module pinned to its variant's image reference
+    def resolve_images(self, image_refs):
+        profiles = []
+        for profile in self.profiles:
+            modules = [
+                ModuleChoice(
+                    module.slug,
+                    module.display_name,
+                    {**module.kubespawner_override, "image": image_refs[self.module_images[(profile.slug, module.slug)]]}
+                )
+                for module in profile.modules
+            ]
+            profiles.append(Profile(profile.slug, profile.display_name, profile.description, modules, profile.default))
+        return profiles
+
+
+def compile_catalog(source):
+    images = source.get("images", {})
+    default_image = source.get("default-image", next(iter(images), None))
+    profiles = []
+    module_images = {}
+    notebooks = {}
+    scheduling = {}
+    for course in source.get("courses", []):
+        if course.get("notebooks"):
+            notebooks[course["slug"]] = {"dir": course["slug"], **course["notebooks"]}
+        scheduling[course["slug"]] = {key: course[key] for key in ("capacity", "tolerations") if key in course}
+        modules = []
+        for module in course.get("modules", []):
+            variant = module.get("image", default_image)
+            if variant not in images:
+                raise ValueError(f"Module {course['slug']}/{module['slug']} uses unknown image {variant}")
+            module_images[(course["slug"], module["slug"])] = variant
+            modules.append(ModuleChoice(module["slug"], module["display-name"], dict(module.get("resources", {}))))
+        profiles.append(Profile(
+            slug=course["slug"],
+            display_name=course["display-name"],
+            description=course.get("description", ""),
+            modules=modules,
+            default=bool(course.get("default", False)),
+        ))
+    return LabCatalog(profiles, images, default_image, dict(source.get("quota", {})), module_images, notebooks,
+                      scheduling)
+
+
+# Parsing is most of the work, libyaml's loader does it where it is installed
+def load_catalog(path):
+    with open(path) as catalog_file:
+        return compile_catalog(yaml.load(catalog_file, Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader)))
@@ -0,0 +1,256 @@
+import hashlib
+import os
+from dataclasses import dataclass, field
+import yaml
+
+
+# Multi-line strings (hub.extraConfig code) are dumped as literal blocks
+class ValuesDumper(yaml.SafeDumper):
+    pass
+
+
+def _str_representer(dumper, value):
+    if "\n" in value:
+        return dumper.represent_scalar("tag:yaml.org,2002:str", value, style="|")
+    return dumper.represent_scalar("tag:yaml.org,2002:str", value)
+
+
+ValuesDumper.add_representer(str, _str_representer)
+
+
+@dataclass
+class ModuleChoice:
+    slug: str
+    display_name: str
+    kubespawner_override: dict = field(default_factory=dict)
+
+    def to_dict(self):
+        return {
+            "display_name": self.display_name,
+            "kubespawner_override": dict(self.kubespawner_override),
+        }
+
+
+@dataclass
+class Profile:
+    slug: str
+    display_name: str
+    description: str
+    modules: list = field(default_factory=list)
+    default: bool = False
+
+    def to_dict(self):
+        profile = {
+            "display_name": self.display_name,
+            "description": self.description,
+            "slug": self.slug,
+            "profile_options": {
+                "module": {
+                    "display_name": "Module(s)",
+                    "choices": {module.slug: module.to_dict() for module in self.modules},
+                }
+            },
+        }
+        if self.default:
+            profile["default"] = True
+        return profile
+
+
+@dataclass
+class HubSettings:
+    service_account: str
+    config: dict = field(default_factory=dict)
+    extra_env: list = field(default_factory=list)
+    extra_config: dict = field(default_factory=dict)
+
+    def to_dict(self):
+        return {
+            "config": self.config,
+            "extraEnv": self.extra_env,
+            "extraConfig": self.extra_config,
+            "serviceAccount": {
+                "create": False,
+                "name": self.service_account,
+            },
+        }
+
+
+@dataclass
+class SingleUserSettings:
+    image_name: str
+    image_tag: str
+    service_account: str
+    pull_secrets: list = field(default_factory=lambda: ["regcred"])
+    lifecycle_hooks: dict = field(default_factory=dict)
+    extra: dict = field(default_factory=dict)
+
+    def to_dict(self, profiles):
+        return {
+            "image": {
+                "name": self.image_name,
+                "tag": self.image_tag,
+                "pullPolicy": "IfNotPresent",
+                "pullSecrets": list(self.pull_secrets),
+            },
+            "serviceAccountName": self.service_account,
+            "cloudMetadata": {
+                "blockWithIptables": False,
+            },
+            "allowPrivilegeEscalation": True,
+            "lifecycleHooks": self.lifecycle_hooks,
+            "profileList": [profile.to_dict() for profile in profiles],
+            **self.extra,
+        }
+
+
+# Complete JupyterHub chart configuration, rendered deterministically
+@dataclass
+class ChartValues:
+    hub: HubSettings
+    singleuser: SingleUserSettings
+    profiles: list = field(default_factory=list)
+    sections: dict = field(default_factory=dict)
+
+    def to_dict(self):
+        return {
+            "hub": self.hub.to_dict(),
+            "singleuser": self.singleuser.to_dict(self.profiles),
+            **self.sections,
+        }
+
+    def render(self):
+        return yaml.dump(self.to_dict(), Dumper=ValuesDumper, sort_keys=True, default_flow_style=False, width=4096)
+
+    def checksum(self):
+        return hashlib.sha256(self.render().encode("utf-8")).hexdigest()
+
+    # Rewrites the file only when its content changes, returns whether it did
+    def write(self, path):
+        rendered = self.render()
+        if os.path.exists(path):
+            with open(path) as current:
+                if current.read() == rendered:
+                    return False
+        with open(path, "w") as config_file:
+            config_file.write(rendered)
+        return True
+
+
+GITHUB_OAUTH_CONFIG = """\
+c.GitHubOAuthenticator.client_id = os.environ['GITHUB_CLIENT_ID']
+c.GitHubOAuthenticator.client_secret = os.environ['GITHUB_CLIENT_SECRET']
+c.GitHubOAuthenticator.oauth_callback_url = os.environ['OAUTH_CALLBACK_URL']
+"""
+
+
+# The lab's hub configuration assembled from the stack details. extensions maps
+# a hub/<name>.py extension to (code, settings), settings land in custom.<name>.
+# With allowed_users (a fleet hub's learners) the hub admits those users and
+# the admins instead of the whole organization.
+def lab_chart_values(details, hub_host, image_name, image_tag, placeholder_replicas, spawn_limit, extensions, cull,
+                     profiles, singleuser_extra=None, post_start=(), pull_secrets=("regcred",), hub_extra_env=(),
+                     dedicated_user_nodes=False, start_timeout=300, allowed_users=None):
+    hub = HubSettings(
+        service_account=f"{details.get('chart-name')}-svc-account",
+        config={
+            "JupyterHub": {
+                "admin_access": True,
+                "allow_named_servers": True,
+                "authenticator_class": "github",
+                "cleanup_servers": True,
+                "cleanup_proxy": True,
+                "concurrent_spawn_limit": spawn_limit,
+                "shutdown_on_logout": True,
+            },
+            "Spawner": {
+                "start_timeout": start_timeout,
+            },
+            "GitHubOAuthenticator": {
+                "allowed_organizations": [details.get("org-allow")],
+                "scope": ["read:org"],
+            },
+            "Authenticator": {
+                "admin_users": list(details.get("admin-users", ["jpperdon"])),
+            },
+            "KubeSpawner": {
+                "enable_user_namespaces": True,
+                "user_namespace_template": "lab-{username}",
+                "environment": {
+                    "JUPYTERHUB_API_URL": f"http://hub.{details.get('namespace')}.svc.cluster.local:8081/hub/api",
+                },
+            },
+        },
+        extra_env=[
+            {
+                "name": "OAUTH_CALLBACK_URL",
+                "value": f"https://{hub_host}/hub/oauth_callback",
+            },
+            {
+                "name": "GITHUB_CLIENT_ID",
+                "valueFrom": {"secretKeyRef": {"name": details.get("gh-secret"), "key": "id"}},
+            },
+            {
+                "name": "GITHUB_CLIENT_SECRET",
+                "valueFrom": {"secretKeyRef": {"name": details.get("gh-secret"), "key": "secret"}},
+            },
+            *hub_extra_env,
+        ],
+        extra_config={
+            **{f"{name}.py": code for name, (code, _) in extensions.items()},
+            "extra_config.py": GITHUB_OAUTH_CONFIG,
+        },
+    )
+
+    if allowed_users is not None:
+        del hub.config["GitHubOAuthenticator"]["allowed_organizations"]
+        hub.config["Authenticator"]["allowed_users"] = sorted(allowed_users)
+
+    singleuser = SingleUserSettings(
+        image_name=image_name,
+        image_tag=image_tag,
+        service_account=f"{details.get('user-svc-account')}-svc-account",
+        pull_secrets=list(pull_secrets),
+        lifecycle_hooks={
+            "postStart": {
+                "exec": {
+                    # Notebooks are baked into the image, no network access on the spawn path
+                    "command": [
+                        "sh",
+                        "-c",
+                        "; ".join(['cp -rn /opt/notebooks/. "$HOME"/ || true', *post_start]),
+                    ]
+                }
+            }
+        },
+        extra=dict(singleuser_extra or {}),
+    )
+
+    scheduling = {
+        "podPriority": {"enabled": True},
+        "userScheduler": {"enabled": True},
+        "userPlaceholder": {"enabled": True, "replicas": placeholder_replicas},
+    }
+    if dedicated_user_nodes:
+        # Learner and placeholder pods only on the lab node pools, hub and proxy stay off them
+        scheduling["userPods"] = {"nodeAffinity": {"matchNodePurpose": "require"}}
+
+    return ChartValues(
+        hub=hub,
+        singleuser=singleuser,
+        profiles=list(profiles),
+        sections={
+            "custom": {name: settings for name, (_, settings) in extensions.items()},
+            "scheduling": scheduling,
+            "prePuller": {
+                "hook": {"enabled": False},
+                "continuous": {"enabled": True},
+            },
+            "proxy": {
+                "service": {"type": "NodePort"},
+            },
+            "cull": cull,
+            "debug": {
+                "enabled": True,
+            },
+        },
+    )
@@ -0,0 +1,865 @@
+# Stub checks for the lab's performance work. Each check runs the Pulumi
+# program (through bench.py's mock runtime) or a hub extension against
+# stand-ins with artificial latency, prints what it measured and fails when
+# the behaviour it guards regresses. Nothing here talks to AWS, Kubernetes
+# or 1Password.
+#
+#   python checks.py              # every check
+#   python checks.py op lookups   # only these
+import argparse
+import asyncio
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+import yaml
+from cryptography.fernet import Fernet
+from kubernetes import client as k8s_client, config as k8s_config
+from kubernetes.config import kube_config
+from bench import STACK_FILE, run_scenarios
+from capacity import warm_capacity
+from catalog import load_catalog
+from fake_apiserver import FakeApiServer
+from fake_hub import FakeHub, load_extensions, now
+from fake_registry import FakeRegistry, pull
+from fleet import ecr_registry
+from image_report import DOCKERFILE, leftovers
+from node_pools import autoscaler_settings, node_pool_settings
+from pull_report import percentile, summarize
+from registry import dockerconfigjson, lifecycle_policy, mirrored, pull_through_rules, regcred_refresh_script
+from reaper import ADOPTED_LABEL, EXPIRES_ANNOTATION, TENANT_LABEL, find_expired, reap
+from rightsizing import module_requests, right_size, tenant_quota
+from shared_cache import CACHE_MOUNT, POST_START_LINK_DATA
+from simulate import DEFAULT_TIMINGS, EXAMPLE_POOLS, Simulation, module_demands, stack_details, warm_settings
+from tenants import TRUST_POLICY_LIMIT, tenant_namespace, trust_groups, trust_policy
+
+# Stand-in for "aws eks get-token": a token valid for $FAKE_TOKEN_SECONDS,
+# its expiry in the token itself; calls are counted in $FAKE_AWS_CALLS
+FAKE_AWS = """#!{python}
+import json, os, sys, time
+from datetime import datetime, timezone
+expires = time.time() + float(os.environ["FAKE_TOKEN_SECONDS"])
+with open(os.environ["FAKE_AWS_CALLS"], "a") as calls_file:
+    calls_file.write(" ".join(sys.argv[1:]) + "\\n")
+print(json.dumps({{"kind": "ExecCredential", "apiVersion": "client.authentication.k8s.io/v1beta1", "status": {{
+    "token": f"k8s-aws-v1.{{expires}}",
+    "expirationTimestamp": datetime.fromtimestamp(expires, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")}}}}))
+"""
+
+CHECKS = {}
+
+
+def check(name):
+    def register(func):
+        CHECKS[name] = func
+        return func
+    return register
+
+
+# 1Password: items are fetched concurrently, a keyed cache skips the CLI
+# entirely, and without a key nothing is written to disk
+@check("op")
+def op_timing():
+    op_seconds = 0.5
+    items = [f"item{index}" for index in range(4)]
+    cached = {"item": items, "op-cache-ttl": 3600}
+    with tempfile.TemporaryDirectory() as cache_dir, tempfile.TemporaryDirectory() as keyless_dir:
+        keyed_env = {"OP_CACHE_DIR": cache_dir, "OP_CACHE_KEY": Fernet.generate_key().decode("utf-8")}
+        keyless_env = {"OP_CACHE_DIR": keyless_dir, "PYTHON_KEYRING_BACKEND": "keyring.backends.fail.Keyring"}
+        cold, first, second, keyless = run_scenarios([
+            {"tenants": 1, "op_seconds": op_seconds, "details": {"item": items}},
+            {"tenants": 1, "op_seconds": op_seconds, "details": cached, "env": keyed_env},
+            {"tenants": 1, "op_seconds": op_seconds, "details": cached, "env": keyed_env},
+            {"tenants": 1, "op_seconds": op_seconds, "details": cached, "env": keyless_env},
+        ])
+        keyless_files = os.listdir(keyless_dir)
+    resolve = cold["spans"]["secrets.resolve"]["max"]
+    print(f"op: {len(items)} items x {op_seconds}s resolved in {resolve}s cold, "
+          f"{second['spans']['secrets.resolve']['max']}s cached ({second['op_calls']} op calls)")
+    return [
+        ("items are fetched concurrently", resolve < op_seconds * len(items) / 2),
+        ("one op call per item when cold", cold["op_calls"] == len(items) and first["op_calls"] == len(items)),
+        ("a keyed cache skips op", second["op_calls"] == 0),
+        ("no cache is written without a key", not keyless_files and keyless["op_calls"] == len(items)),
+    ]
+
+
+# AWS lookups: each one starts only when something uses it, and with every
+# invoke taking a second they overlap instead of adding up
+@check("lookups")
+def lookup_timing():
+    invoke_seconds = 1.0
+    default, token_secret = run_scenarios([
+        {"tenants": 1, "invoke_seconds": invoke_seconds},
+        {"tenants": 1, "details": {"kubeconfig-auth": "token", "image-pull-auth": "secret"}},
+    ])
+    lookups = {name: span["max"] for name, span in default["spans"].items() if name.startswith("lookup.")}
+    print(f"lookups: {len(lookups)} lookups x {invoke_seconds}s, slowest resolved after {max(lookups.values())}s")
+    cluster_auth = "aws:eks/getClusterAuth:getClusterAuth"
+    return [
+        ("lookups resolve concurrently", len(lookups) >= 4 and max(lookups.values()) < invoke_seconds * len(lookups) / 2),
+        ("exec auth skips the cluster token lookup", not default["invokes"].get(cluster_auth)),
+        ("token auth makes it", token_secret["invokes"].get(cluster_auth)),
+    ]
+
+
+# Tenants: the single-tenant setup's resources move into the legacy tenant's
+# component by alias, its namespace is read instead of created, and a roster
+# too large for one trust policy is spread over roles rather than a wildcard
+@check("tenants")
+def tenant_adoption():
+    roster = ["jpperdon"] + [f"learner{index:04d}" for index in range(99)]
+    result, = run_scenarios([{"tenants": len(roster), "details": {"roster": roster}, "record": True}])
+    # One learner over two clusters leaves one without tenants or IRSA roles
+    lone, = run_scenarios([{"tenants": 1, "clusters": 2}])
+    registrations = {urn.rsplit("::", 1)[-1]: registration for urn, registration in result["registrations"].items()}
+    legacy = {name: registration for name, registration in registrations.items() if name.startswith("jpperdon-")}
+    namespaces = {name: registration for name, registration in registrations.items() if name.endswith("-namespace")}
+    roles = [name for name in registrations if name.startswith("lab-s3-access-role")]
+    moved = sorted(alias for registration in legacy.values() for alias in registration["aliases"])
+    issuer = "https://oidc.eks.us-west-2.amazonaws.com/id/BENCH"
+    policies = [trust_policy("012345678910", issuer, "aws2023", group) for group in
+                trust_groups("012345678910", "us-west-2", "aws2023", [tenant_namespace(u) for u in roster]).values()]
+    print(f"tenants: {len(roster)} tenants over {len(roles)} IRSA roles, legacy aliases {moved}")
+    return [
+        ("the legacy namespace is read, not created", legacy["jpperdon-namespace"]["read"]),
+        ("other namespaces are created", sum(registration["read"] for registration in namespaces.values()) == 1),
+        ("the legacy resources keep their state by alias",
+         moved == sorted(["aws2023-service-account", "aws2023-role", "aws2023-role-binding", "lab-quota"])),
+        ("a roster over the policy limit is spread over roles", len(roles) == len(policies) > 1),
+        ("a cluster without learners deploys", lone["clusters"] == 2),
+        ("no trust policy uses a wildcard or exceeds the limit",
+         all("StringLike" not in policy and len(policy) <= TRUST_POLICY_LIMIT for policy in policies)),
+    ]
+
+
+# Incremental rollouts: with the same roster nothing changes, and adding a
+# learner to a cohort, also one sorting before everyone else, touches that
+# learner's tenant, the trust policy of its IRSA role and the resources that
+# depend on the roster as a whole, not other tenants or roles
+@check("touched")
+def touched_resources():
+    tenants = 50
+    roster = [f"learner{index:04d}" for index in range(tenants)]
+    before, again, after, first = run_scenarios([
+        {"tenants": tenants, "record": True},
+        {"tenants": tenants, "record": True},
+        {"tenants": tenants + 1, "record": True},
+        {"tenants": tenants, "details": {"roster": ["aaron"] + roster}, "record": True},
+    ])
+
+    def touched(previous, current):
+        return sorted(urn.rsplit("::", 1)[-1] for urn, registration in current["registrations"].items()
+                      if previous["registrations"].get(urn, {}).get("inputs") != registration["inputs"])
+
+    def outside(current, added):
+        return [name for name in touched(before, current) if name.partition("-")[0] != added]
+
+    def roles(names):
+        return [name for name in names if name.startswith("lab-s3-access-role")]
+
+    added = f"learner{tenants:04d}"
+    print(f"touched: {len(touched(before, after))}/{len(after['registrations'])} resources for one added tenant, "
+          f"outside it: {outside(after, added)}; for one sorting first: {outside(first, 'aaron')}")
+    return [
+        ("an unchanged roster touches nothing", not touched(before, again)),
+        ("an added tenant touches its own resources",
+         len([name for name in touched(before, after) if name.partition("-")[0] == added]) == 7),
+        *((f"adding {name} touches one IRSA role besides, and no other tenant",
+           len(roles(outside(result, name))) == 1 and not any(other.startswith("learner")
+                                                               for other in outside(result, name)))
+          for name, result in ((added, after), ("aaron", first))),
+        ("and only roster-wide resources otherwise",
+         all(set(outside(result, name)) - set(roles(outside(result, name))) <= {"warm-capacity-class-start", "warm-capacity-restore"}
+             for name, result in ((added, after), ("aaron", first)))),
+    ]
+
+
+# Lab images: the ECR lookups do not hold up building the graph, every
+# variant keeps its Image (pushing only a tag ECR lacks, building one it has
+# from its own layers), only "not found" reads as not pushed, and the hub
+# release waits for the images
+@check("images")
+def image_lookups():
+    invoke_seconds = 3.0
+    pushed, missing = run_scenarios([
+        {"tenants": 1, "invoke_seconds": invoke_seconds, "record": True, "inputs_of": ["docker:index/image:Image"]},
+        {"tenants": 1, "pushed": False, "record": True, "inputs_of": ["docker:index/image:Image"]},
+    ])
+    throttled, = run_scenarios([{"tenants": 1, "image_error": "ThrottlingException: Rate exceeded"}], expect_failure=True)
+
+    def images(result):
+        return {urn: registration for urn, registration in result["registrations"].items()
+                if registration["type"] == "docker:index/image:Image"}
+
+    release = next(registration for registration in missing["registrations"].values()
+                   if registration["type"] == "kubernetes:helm.sh/v3:Release")
+    print(f"images: graph built in {pushed['build_seconds']}s with {invoke_seconds}s lookups, "
+          f"{len(images(pushed))} Image resources pushed or not")
+    return [
+        ("lookups do not block building the graph", pushed["build_seconds"] < invoke_seconds),
+        ("every variant keeps its Image resource", images(pushed).keys() == images(missing).keys() != set()),
+        ("a pushed tag is not pushed again and builds from its own layers",
+         all(image["state"]["skipPush"] and image["state"]["build"]["cacheFrom"]["images"][0].endswith(f"@sha256:{'1' * 64}")
+             for image in images(pushed).values())),
+        ("a missing tag is pushed", not any(image["state"]["skipPush"] for image in images(missing).values())),
+        ("other lookup errors fail the update", "ThrottlingException" in throttled.get("error", "")),
+        ("the hub release depends on the images", set(images(missing)) <= set(release["dependencies"])),
+    ]
+
+
+# Lab image: no variant's layers keep build tools, installer archives or apt
+# lists (image_report.py measures the resulting size and cold-pull time
+# against a local registry, which needs Docker)
+@check("image")
+def image_layers():
+    with open(DOCKERFILE) as dockerfile:
+        text = dockerfile.read()
+    targets = sorted({build["target"] for build in load_catalog("./catalog.yaml").images.values()})
+    found = {target: leftovers(text, target) for target in targets}
+    single_stage = ("FROM jupyterhub/k8s-singleuser-sample:2.0.0\n"
+                    "RUN apt-get update -y && apt-get install -y build-essential unzip\n"
+                    "RUN curl https://awscli.amazonaws.com/awscli-exe-linux-x86_64.zip -o awscliv2.zip\n")
+    print(f"image: variants {targets}, leftovers {found}")
+    return [
+        ("no variant keeps build tools, installers or apt lists", not any(found.values())),
+        ("a single-stage install is flagged", len(leftovers(single_stage)) == 4),
+    ]
+
+
+# Registry access against a local registry stand-in: a regcred built by
+# dockerconfigjson authenticates kubelet's pulls (and pull_report counts the
+# pulls and auth failures they record), mirrored images resolve through
+# their pull-through prefix, the lifecycle policy keeps the newest images,
+# and in "secret" mode every tenant namespace gets regcred on deploy
+@check("registry")
+def registry_access():
+    registry = FakeRegistry().start()
+    host = registry.host
+    rules = pull_through_rules({"ecr-pull-through": {"k8s": "registry.k8s.io", "quay": "quay.io",
+                                                     "docker-hub": "registry-1.docker.io"}})
+    upstream = ["registry.k8s.io/pause:3.9", "quay.io/jupyterhub/k8s-network-tools:2.0.0", "busybox:1.36"]
+    for image in upstream:
+        path, _, tag = mirrored(image, host, rules).removeprefix(f"{host}/").rpartition(":")
+        registry.push(path, tag)
+    lab_image = f"{host}/ephemeral-labs:{'a' * 16}"
+    registry.push("ephemeral-labs", "a" * 16)
+    regcred = dockerconfigjson(host, registry.username, registry.password)
+    events = [pull(mirrored(image, host, rules), regcred) for image in upstream] + [
+        pull(lab_image, regcred),
+        pull(lab_image, dockerconfigjson(host, registry.username, "expired-token")),
+        pull(lab_image, dockerconfigjson("other.example.com", registry.username, registry.password)),
+    ]
+
+    # 40 daily builds, untagged layers left by builds three days ago and today
+    day, today = timedelta(days=1), datetime.now(timezone.utc)
+    for build in range(40):
+        registry.push("ephemeral-labs", f"{build:016x}", pushed=today - (40 - build) * day)
+    stale = [registry.push("ephemeral-labs", pushed=today - 3 * day) for _ in range(5)]
+    registry.push("ephemeral-labs", pushed=today)
+    latest = registry.most_recent("ephemeral-labs")
+    expired = registry.expire("ephemeral-labs", lifecycle_policy({"ecr-lifecycle": {"keep-images": 30}}))
+    kept = registry.repositories["ephemeral-labs"]
+    registry.stop()
+    pulls = summarize(events)
+
+    deployed, grown = run_scenarios([
+        {"tenants": 20, "details": {"image-pull-auth": "secret"}, "record": True, "inputs_of": ["kubernetes:batch/v1:Job"]},
+        {"tenants": 21, "details": {"image-pull-auth": "secret"}, "record": True, "inputs_of": ["kubernetes:batch/v1:Job"]},
+    ])
+
+    def seed(result):
+        return next(registration for urn, registration in result["registrations"].items()
+                    if urn.endswith("::regcred-seed"))
+
+    details = stack_details(STACK_FILE)
+    namespaces = {urn for urn, registration in deployed["registrations"].items()
+                  if registration["type"] == "kubernetes:core/v1:Namespace" and "LabTenant$" in urn}
+    seed_script = seed(deployed)["state"]["spec"]["template"]["spec"]["containers"][0]["command"][-1]
+    print(f"registry: {len(events)} pulls, {sum(stats['auth_failed'] for stats in pulls.values())} auth failures "
+          f"reported, {len(expired)} of {len(expired) + len(kept)} images expired, regcred seeded by "
+          f"{seed(deployed)['state']['metadata']['name']}")
+    return [
+        ("regcred authenticates pulls from its registry", pulls[lab_image]["seconds"] != []),
+        ("a stale or missing regcred is reported as an auth failure",
+         pulls[lab_image]["failed"] == pulls[lab_image]["auth_failed"] == 2),
+        ("mirrored images resolve through their pull-through prefix",
+         all(pulls[mirrored(image, host, rules)]["seconds"] and not pulls[mirrored(image, host, rules)]["failed"]
+             for image in upstream)),
+        ("registries without a rule are left alone", mirrored("ghcr.io/org/tool:1", host, rules) == "ghcr.io/org/tool:1"),
+        ("the lifecycle policy keeps the newest images",
+         len(kept) <= 30 and set(stale) <= expired and latest not in expired
+         and f"{39:016x}" in {tag for image in kept for tag in image["tags"]}),
+        ("every tenant namespace gets regcred on deploy",
+         len(namespaces) == 20 and namespaces <= set(seed(deployed)["dependencies"])
+         and seed_script == regcred_refresh_script(ecr_registry(details.get("account"), "us-west-2"),
+                                                   details.get("namespace"))),
+        ("and again when the roster grows",
+         seed(deployed)["state"]["metadata"]["name"] != seed(grown)["state"]["metadata"]["name"]),
+    ]
+
+
+# Warm capacity: a class of 60 logging in over five minutes waits for new
+# nodes and image pulls without placeholders and pre-pulling, and mostly
+# only for its servers to start with them. Without a schedule only the
+# idle placeholders are held, and after a release upgrade a Job restores the
+# class-window count the upgrade reset
+@check("warm")
+def warm_start():
+    details = stack_details(STACK_FILE)
+    lab_catalog = load_catalog("./catalog.yaml")
+    demands = module_demands(lab_catalog)
+    profile, module = next(iter(demands))
+    logins = [{"at": index * 5, "user": f"learner{index:04d}", "profile": profile, "module": module, "duration": 3600}
+              for index in range(60)]
+    pools = node_pool_settings({"node-pools": EXAMPLE_POOLS})
+    autoscaler = autoscaler_settings(details)
+    cold = Simulation(pools, autoscaler, demands).run(logins)
+    warm = Simulation(pools, autoscaler, demands, warm=warm_settings(details, logins, demands, 900)).run(logins)
+    deployed, = run_scenarios([{"tenants": 60, "record": True, "inputs_of": ["kubernetes:batch/v1:Job"]}])
+    release = next(urn for urn, registration in deployed["registrations"].items()
+                   if registration["type"] == "kubernetes:helm.sh/v3:Release")
+    restore = next(registration for urn, registration in deployed["registrations"].items()
+                   if urn.endswith("::warm-capacity-restore"))
+    restore_command = restore["state"]["spec"]["template"]["spec"]["containers"][0]["command"][-1]
+    print(f"warm: time to first notebook p50/p95 {cold['spawn_p50_seconds']}/{cold['spawn_p95_seconds']}s cold, "
+          f"{warm['spawn_p50_seconds']}/{warm['spawn_p95_seconds']}s warm")
+    return [
+        ("warm capacity cuts the p95 by at least a node boot",
+         warm["spawn_p95_seconds"] <= cold["spawn_p95_seconds"] - DEFAULT_TIMINGS["node-boot"]),
+        ("most warm spawns only wait for the server", warm["spawn_p50_seconds"] == DEFAULT_TIMINGS["server-start"]),
+        ("every login is placed", not cold["unschedulable"] and not warm["unschedulable"]),
+        ("without a schedule only idle placeholders are held",
+         warm_capacity({"warm-capacity": {"idle-replicas": 2}}, 60)["baseline_replicas"] == 2),
+        ("the class-window count is restored after the release",
+         release in restore["dependencies"]
+         and f"--replicas={warm_capacity(details, 60)['peak_replicas']}" in restore_command),
+    ]
+
+
+# Hub release: a first-class Helm release, upgraded only when its values
+# change and uninstalled (not declared) with deploy: False
+@check("helm")
+def helm_release():
+    release_type = "kubernetes:helm.sh/v3:Release"
+    first, again, changed, removed = run_scenarios([
+        {"tenants": 1, "record": True, "inputs_of": [release_type]},
+        {"tenants": 1, "record": True, "inputs_of": [release_type]},
+        {"tenants": 1, "record": True, "inputs_of": [release_type], "details": {"culling": {"default-idle-timeout": 1800}}},
+        {"tenants": 1, "record": True, "details": {"deploy": False}},
+    ])
+
+    def release(result):
+        return next((registration for registration in result["registrations"].values()
+                     if registration["type"] == release_type), None)
+
+    state = release(first)["state"]
+    print(f"helm: release {state['name']} in {state['namespace']}, values "
+          f"{'unchanged' if release(first)['inputs'] == release(again)['inputs'] else 'changed'} on a rerun")
+    return [
+        ("unchanged values leave the release as it is", release(first)["inputs"] == release(again)["inputs"]),
+        ("changed values upgrade it", release(first)["inputs"] != release(changed)["inputs"]),
+        ("deploy: False removes it", release(removed) is None),
+        ("the release is atomic and waits for its jobs",
+         state.get("atomic") and state.get("cleanupOnFail") and state.get("waitForJobs")),
+        ("it carries no values checksum of its own", "description" not in state),
+    ]
+
+
+# Spawn admission: a burst of 100 logins against servers that take 30s to
+# start (scaled down 100x), with the default min of 5 slots. Everyone deep in
+# the queue still gets a server, and spawns that run out of queue budget or
+# that the hub gives up on leave no waiter, slot or pod behind.
+@check("admission")
+def admission_burst():
+    scale = 0.01
+    settings = {"min": 5, "max": 40, "target-latency": 90 * scale, "hub-namespace": "aws2023",
+                "queue-timeout": 600 * scale, "start-timeout": 300 * scale}
+
+    async def burst(settings, hub_timeout, logins=100):
+        spawner_class, namespaces, _ = load_extensions([("admission", settings)])
+        hub = FakeHub(pod_seconds=30 * scale)
+        loop = asyncio.get_running_loop()
+
+        async def login(index):
+            started = loop.time()
+            spawner = hub.spawner(spawner_class, f"learner{index:04d}")
+            outcome = await hub.spawn(spawner, hub_timeout)
+            return {**outcome, "seconds": (loop.time() - started) / scale}
+
+        outcomes = await asyncio.gather(*[login(index) for index in range(logins)])
+        await asyncio.sleep(60 * scale)
+        admission = namespaces["admission"]["admission"]
+        return outcomes, hub, admission
+
+    # Spawner.start_timeout as spawn_admission() renders it
+    hub_timeout = settings["queue-timeout"] + settings["start-timeout"]
+    outcomes, hub, admission = asyncio.run(burst(settings, hub_timeout))
+    seconds = [outcome["seconds"] for outcome in outcomes if "url" in outcome]
+    short_queue, short_hub, short_admission = asyncio.run(burst({**settings, "queue-timeout": 60 * scale}, hub_timeout))
+    gave_up, gave_up_hub, gave_up_admission = asyncio.run(burst(settings, 90 * scale))
+    print(f"admission: {len(seconds)}/{len(outcomes)} servers, time to server p50 {percentile(seconds, 0.5):.0f}s, "
+          f"p99 {percentile(seconds, 0.99):.0f}s ({sum(value > 300 for value in seconds)} past a 300s start timeout "
+          f"that included the queue); {sum('error' in o for o in short_queue)} queue timeouts with a "
+          f"60s queue budget, {sum('error' in o for o in gave_up)} hub timeouts at 90s")
+
+    def settled(hub, admission):
+        return not hub.orphans() and not admission.waiters and not sum(admission.active.values())
+
+    return [
+        ("every login in the burst gets a server", len(seconds) == len(outcomes)),
+        ("the burst leaves no waiter, slot or orphaned pod", settled(hub, admission)),
+        ("queue timeouts leave nothing behind", any("error" in o for o in short_queue) and settled(short_hub, short_admission)),
+        ("spawns the hub gave up on leave nothing behind",
+         any("error" in o for o in gave_up) and settled(gave_up_hub, gave_up_admission)),
+    ]
+
+
+# Idle culling: over a day of learners who work for a while and walk away,
+# servers are stopped within their profile's timeout (plus one poll), servers
+# in use never are, and nothing unsaved is lost as long as the lab's
+# autosave interval is shorter than every timeout
+@check("culling")
+def idle_culling():
+    culling = {**stack_details(STACK_FILE).get("culling", {}), "node-memory": 8 * 2 ** 30}
+    culling["backstop-timeout"] = max(map(int, [culling["default-idle-timeout"], *culling["profiles"].values()]))
+    profiles = sorted(culling["profiles"])
+    poll, activity, day = 120, 300, 12 * 3600
+    memory = 2 * 2 ** 30
+
+    # (login, last activity) in seconds from the start of the day; every fifth learner works all day
+    def session(index):
+        login = index * 180
+        return login, day if index % 5 == 0 else login + 1800 + (index % 7) * 1800
+
+    async def run_day(learners=40):
+        spawner_class, namespaces, _ = load_extensions([("culling", culling)])
+        hub = FakeHub()
+        spawners, culled_at = {}, {}
+        for tick in range(0, day + 1, poll):
+            for index in range(learners):
+                login, leaves = session(index)
+                if tick < login or index in culled_at:
+                    continue
+                if index not in spawners:
+                    spawners[index] = hub.spawner(spawner_class, f"learner{index:04d}",
+                                                  user_options={"profile": profiles[index % len(profiles)]},
+                                                  mem_limit=memory)
+                    await hub.spawn(spawners[index], 1)
+                spawner = spawners[index]
+                # Activity is reported every few minutes while the learner works
+                last = login + (min(tick, leaves) - login) // activity * activity
+                spawner.orm_spawner.last_activity = now() - timedelta(seconds=tick - last)
+                spawner.orm_spawner.started = now() - timedelta(seconds=tick - login)
+                await spawner.poll()
+            for _ in range(5):
+                await asyncio.sleep(0)
+            for index, spawner in spawners.items():
+                if index not in culled_at and spawner.pod_name not in hub.pods:
+                    culled_at[index] = tick
+        counters = namespaces["culling"]
+        culled = sum(sample.value for metric in counters["CULLED_SERVERS"].collect()
+                     for sample in metric.samples if sample.name.endswith("_total"))
+        node_hours = sum(sample.value for metric in counters["CULLED_NODE_HOURS"].collect()
+                         for sample in metric.samples if sample.name.endswith("_total"))
+        return spawners, culled_at, culled, node_hours
+
+    spawners, culled_at, culled, node_hours = asyncio.run(run_day())
+    timeouts = {index: int(culling["profiles"][spawner.user_options["profile"]]) for index, spawner in spawners.items()}
+    late = [index for index, at in culled_at.items() if at - session(index)[1] > timeouts[index] + poll]
+    early = [index for index, at in culled_at.items() if at - session(index)[1] <= timeouts[index] - activity]
+    idle = [index for index in spawners if session(index)[1] < day]
+    held = sum(culled_at.get(index, day) - session(index)[0] for index in spawners) * memory / 2 ** 30 / 3600
+    uncull = sum(day - session(index)[0] for index in spawners) * memory / 2 ** 30 / 3600
+    with open(DOCKERFILE) as dockerfile:
+        autosave = int(re.search(r'"autosaveInterval": (\d+)', dockerfile.read()).group(1))
+    print(f"culling: {len(culled_at)}/{len(idle)} idle servers stopped, {held:.0f} GiB-hours held over the day "
+          f"against {uncull:.0f} without culling, {node_hours:.1f} node-hours released before the backstop culler")
+    return [
+        ("every idle server is stopped within its timeout and a poll", sorted(culled_at) == idle and not late),
+        ("no server is stopped while in use", not early and all(index not in culled_at for index in spawners
+                                                                  if session(index)[1] >= day)),
+        ("the culled-server metric counts every stop", culled == len(culled_at)),
+        ("released node-hours stay within the memory culling actually freed",
+         0 < node_hours * culling["node-memory"] / 2 ** 30 <= uncull - held),
+        ("autosave writes edits to disk well before any idle timeout",
+         autosave * 10 <= min(map(int, [culling["default-idle-timeout"], *culling["profiles"].values()]))),
+    ]
+
+
+# Lab catalog: a catalog of hundreds of modules loads in milliseconds with
+# no compiled copy kept on disk
+@check("catalog")
+def catalog_load(courses=25, modules=20):
+    source = {
+        "images": {"net": {"target": "net"}, "full": {"target": "full"}},
+        "courses": [{"slug": f"course{course}", "display-name": f"Course {course}",
+                     "modules": [{"slug": f"module{module}", "display-name": f"Module {module}",
+                                  "image": ("net", "full")[module % 2], "resources": {"mem_limit": "1G"}}
+                                 for module in range(modules)]}
+                    for course in range(courses)],
+    }
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "catalog.yaml")
+        with open(path, "w") as catalog_file:
+            yaml.safe_dump(source, catalog_file)
+        # Best of a few loads, the earlier checks leave the interpreter busy collecting garbage
+        seconds = []
+        for _ in range(5):
+            started = time.perf_counter()
+            lab_catalog = load_catalog(path)
+            seconds.append(time.perf_counter() - started)
+        seconds = min(seconds)
+        written = os.listdir(workdir)
+    print(f"catalog: {len(lab_catalog.module_images)} modules loaded in {1000 * seconds:.1f}ms")
+    return [
+        ("every module compiles", len(lab_catalog.module_images) == courses * modules),
+        ("hundreds of modules load in milliseconds", seconds < 0.1),
+        ("nothing is cached next to the catalog", written == ["catalog.yaml"]),
+    ]
+
+
+# Course notebooks: images are tagged by the commit each notebooks ref points
+# at, so a moved branch gives a new tag and an unmoved one keeps it
+@check("notebooks")
+def notebook_refs():
+    image = "docker:index/image:Image"
+    first, rerun, moved = run_scenarios([
+        {"tenants": 1, "record": True, "inputs_of": [image]},
+        {"tenants": 1, "record": True, "inputs_of": [image]},
+        {"tenants": 1, "record": True, "inputs_of": [image], "notebook_commits": 2},
+    ])
+
+    def images(result):
+        return {urn.rsplit("::", 1)[-1]: registration["state"] for urn, registration in result["registrations"].items()
+                if registration["type"] == image}
+
+    def tags(result):
+        return {name: state["imageName"].rsplit(":", 1)[-1] for name, state in images(result).items()}
+
+    repos = [spec for state in images(first).values() for spec in state["build"]["args"]["NOTEBOOK_REPOS"].split()]
+    print(f"notebooks: tags {tags(first)}, after the branch moved {tags(moved)}")
+    return [
+        ("notebooks are built at a commit", repos != [] and all(re.search(r"@[0-9a-f]{40}$", spec) for spec in repos)),
+        ("an unmoved branch keeps the image tags", tags(first) == tags(rerun)),
+        ("a moved branch changes every image tag", all(tags(first)[name] != tags(moved)[name] for name in tags(first))),
+    ]
+
+
+# Shared cache: what a cohort stores and downloads with every learner's
+# ~/data linked into one cache per node (hostPath) or per cluster (nfs),
+# against a copy per learner. The links are made by the real postStart
+# command; files a learner already has in ~/data are kept.
+@check("cache")
+def cache_savings(learners=100, servers_per_node=4):
+    datasets = {"flows.csv": 8 * 2 ** 20, "certs/ca-bundle.pem": 2 ** 18, "captures/handshake.pcap": 3 * 2 ** 20}
+    with tempfile.TemporaryDirectory() as workdir:
+        cache = os.path.join(workdir, "cache")
+        for name, size in datasets.items():
+            os.makedirs(os.path.dirname(os.path.join(cache, "data", name)), exist_ok=True)
+            with open(os.path.join(cache, "data", name), "wb") as data_file:
+                data_file.write(os.urandom(size))
+        link_data = POST_START_LINK_DATA.replace(CACHE_MOUNT, cache)
+        homes = [os.path.join(workdir, "home", f"learner{index:04d}") for index in range(learners)]
+        own = os.path.join(homes[0], "data", "flows.csv")
+        os.makedirs(os.path.dirname(own))
+        with open(own, "w") as own_file:
+            own_file.write("edited")
+        for home in homes:
+            subprocess.run(["sh", "-c", link_data], env={**os.environ, "HOME": home}, check=True)
+
+        linked = all(os.path.realpath(os.path.join(home, "data", name)) == os.path.join(cache, "data", name)
+                     for home in homes[1:] for name in datasets)
+        home_bytes = sum(os.lstat(os.path.join(root, name)).st_size
+                         for home in homes for root, dirs, files in os.walk(home) for name in files)
+        kept = not os.path.islink(own) and open(own).read() == "edited"
+
+    data_bytes = sum(datasets.values())
+    nodes = -(-learners // servers_per_node)
+    copies = learners * data_bytes
+    stored = {"hostPath": nodes * data_bytes + home_bytes, "nfs": data_bytes + home_bytes}
+    print(f"cache: {learners} learners, {data_bytes / 2 ** 20:.1f}MiB of data: per-learner copies store and download "
+          f"{copies / 2 ** 20:.0f}MiB, the cache {stored['hostPath'] / 2 ** 20:.0f}MiB on {nodes} nodes (hostPath) or "
+          f"{stored['nfs'] / 2 ** 20:.0f}MiB (nfs); ~/data holds {home_bytes / 2 ** 10:.0f}KiB of links for the cohort")
+    return [
+        ("every learner's ~/data links into the cache", linked),
+        ("a learner's own file in ~/data is kept", kept),
+        ("links cost under 1% of a copy per learner", home_bytes < copies / 100),
+    ]
+
+
+# Namespace reaper against a fake API server: exactly the expired lab-*
+# namespaces without a running server are deleted (a 404 counts as deleted,
+# other errors are reported), the stack's tenants and adopted namespaces are
+# kept, lists are paged, and workers stay within the concurrency and request
+# rate they are given
+@check("reaper")
+def namespace_reaper(qps=100.0, concurrency=8, page_size=50):
+    def cluster():
+        server = FakeApiServer(delete_seconds=0.02)
+        old, day = now() - timedelta(days=30), timedelta(days=1)
+        groups = {
+            "expired": [f"lab-old{index:03d}" for index in range(150)],
+            "expires": [f"lab-done{index:03d}" for index in range(30)],
+            "running": [f"lab-busy{index:03d}" for index in range(10)],
+            "gone": ["lab-gone"],
+            "failing": ["lab-stuck"],
+        }
+        for name in groups["expired"] + groups["running"] + groups["gone"] + groups["failing"]:
+            server.add_namespace(name, created=old)
+        for name in groups["expires"]:
+            server.add_namespace(name, annotations={EXPIRES_ANNOTATION: (now() - day).isoformat()})
+        for name in groups["running"]:
+            server.add_pod(name, "jupyter", labels={"component": "singleuser-server"})
+        for index in range(20):
+            server.add_namespace(f"lab-learner{index:03d}", labels={TENANT_LABEL: f"learner{index:03d}"}, created=old)
+            server.add_namespace(f"lab-new{index:03d}", created=now() - day)
+            server.add_namespace(f"lab-later{index:03d}", created=old,
+                                 annotations={EXPIRES_ANNOTATION: (now() + day).isoformat()})
+        server.add_namespace("lab-jpperdon", created=old)
+        server.create_config_map("jupyterhub", {"metadata": {"name": "lab-adopted-namespaces", "namespace": "jupyterhub",
+                                                             "labels": {ADOPTED_LABEL: "true"}},
+                                                "data": {"namespaces": "lab-jpperdon"}})
+        server.add_namespace("lab-leaving", created=old, phase="Terminating")
+        server.add_namespace("monitoring", created=old)
+        server.delete_errors = {"lab-gone": (404, "NotFound"), "lab-stuck": (500, "InternalError")}
+        return server.start(), groups
+
+    def run(concurrency):
+        server, groups = cluster()
+        started = time.monotonic()
+        candidates = find_expired(server.core_api(), timedelta(days=14), page_size=page_size)
+        results = reap(server.core_api(), candidates, concurrency=concurrency, qps=qps)
+        elapsed = time.monotonic() - started
+        server.stop()
+        return server, groups, results, elapsed
+
+    server, groups, results, elapsed = run(concurrency)
+    serial_server, _, serial_results, serial_elapsed = run(1)
+    reapable = sorted(groups["expired"] + groups["expires"] + groups["gone"])
+    lists = sum(path == "/api/v1/namespaces" and method == "GET" for _, method, path, _ in server.requests)
+    print(f"reaper: {len(results['deleted'])} namespaces deleted in {elapsed:.2f}s "
+          f"({len(results['deleted']) / elapsed:.0f}/s, {len(serial_results['deleted']) / serial_elapsed:.0f}/s "
+          f"with one worker), {len(server.requests)} requests, peak {server.peak_requests()}/s, "
+          f"{server.max_in_flight} in flight, {lists} list pages")
+    return [
+        ("exactly the expired namespaces are deleted", sorted(results["deleted"]) == reapable
+         and server.deleted() == sorted(groups["expired"] + groups["expires"])),
+        ("namespaces with a running server are skipped", sorted(results["skipped"]) == groups["running"]),
+        ("the stack's tenants and adopted namespaces are kept",
+         not any(name.startswith("lab-learner") or name == "lab-jpperdon" for name in server.deleted())),
+        ("delete errors other than 404 are reported", [failure.split(":")[0] for failure in results["failed"]] == groups["failing"]),
+        ("namespace lists are paged", lists == -(-len(server.namespaces) // page_size)),
+        ("workers stay within the concurrency", server.max_in_flight <= concurrency),
+        ("requests stay within the rate limit", server.peak_requests() <= 2 * qps
+         and len(server.requests) - lists <= qps * elapsed + qps),
+        ("parallel workers are faster than one", elapsed < serial_elapsed / 2),
+    ]
+
+
+# Kubeconfig credentials: the provider's kubeconfig (as the program renders
+# it) applies 1,000 resources against a fake API server whose tokens live a
+# few seconds, refreshing its credential instead of failing once the first
+# one lapses, over a handful of connections. Every k8s resource goes through
+# the one provider. client-go execs again at the token's expirationTimestamp,
+# the Python client used here EXPIRY_SKEW_PREVENTION_DELAY before it, scaled
+# down with the token lifetime.
+@check("kubeconfig")
+def kubeconfig_refresh(resources=1000, workers=8, token_seconds=3.0):
+    result, = run_scenarios([{"tenants": 1, "record": True, "inputs_of": ["pulumi:providers:kubernetes"]}])
+    providers = {urn: registration for urn, registration in result["registrations"].items()
+                 if registration["type"] == "pulumi:providers:kubernetes"}
+    # Chart is a component, its templated children take the provider
+    used = {registration["provider"].rpartition("::")[0] for registration in result["registrations"].values()
+            if registration["type"].startswith("kubernetes:") and registration["type"] != "kubernetes:helm.sh/v3:Chart"}
+    kubeconfig = json.loads(next(iter(providers.values()))["state"]["kubeconfig"])
+
+    def apply(user):
+        server = FakeApiServer(create_seconds=0.04,
+                               authenticate=lambda token: float(token.partition(".")[2] or 0) > time.time()).start()
+        path = os.path.join(workdir, "kubeconfig")
+        with open(path, "w") as kubeconfig_file:
+            json.dump({**kubeconfig, "clusters": [{"name": "kubernetes", "cluster": {"server": server.url}}],
+                       "users": [{"name": kubeconfig["users"][0]["name"], "user": user}]}, kubeconfig_file)
+        configuration = k8s_client.Configuration()
+        configuration.connection_pool_maxsize = workers
+        k8s_config.load_kube_config(config_file=path, client_configuration=configuration)
+        api = k8s_client.CoreV1Api(k8s_client.ApiClient(configuration))
+
+        def create(index):
+            body = k8s_client.V1ConfigMap(metadata=k8s_client.V1ObjectMeta(name=f"resource{index:04d}"))
+            try:
+                api.create_namespaced_config_map("lab-learner0000", body)
+                return True
+            except k8s_client.ApiException:
+                return False
+
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            created = sum(pool.map(create, range(resources)))
+        elapsed = time.monotonic() - started
+        server.stop()
+        return server, created, elapsed
+
+    skew = kube_config.EXPIRY_SKEW_PREVENTION_DELAY
+    with tempfile.TemporaryDirectory() as workdir:
+        aws = os.path.join(workdir, "aws")
+        with open(aws, "w") as aws_file:
+            aws_file.write(FAKE_AWS.format(python=sys.executable))
+        os.chmod(aws, 0o755)
+        calls = os.path.join(workdir, "aws-calls")
+        environ = dict(os.environ)
+        os.environ.update({"PATH": f"{workdir}:{os.environ['PATH']}", "FAKE_AWS_CALLS": calls,
+                           "FAKE_TOKEN_SECONDS": str(token_seconds)})
+        kube_config.EXPIRY_SKEW_PREVENTION_DELAY = timedelta(seconds=token_seconds / 6)
+        try:
+            exec_server, exec_created, exec_elapsed = apply(kubeconfig["users"][0]["user"])
+            with open(calls) as calls_file:
+                refreshes = len(calls_file.readlines())
+            token = json.loads(subprocess.run([aws], check=True, text=True, stdout=subprocess.PIPE).stdout)
+            static_server, static_created, static_elapsed = apply({"token": token["status"]["token"]})
+        finally:
+            kube_config.EXPIRY_SKEW_PREVENTION_DELAY = skew
+            os.environ.clear()
+            os.environ.update(environ)
+
+    rejected = sum(code == 401 for _, _, _, code in exec_server.requests)
+    print(f"kubeconfig: {exec_created}/{resources} resources applied in {exec_elapsed:.1f}s with {token_seconds:.0f}s "
+          f"tokens, {refreshes} token fetches, {exec_server.connections} connections, {rejected} rejected; "
+          f"a static token applied {static_created} before expiring; {len(providers)} k8s provider for "
+          f"{sum(registration['type'].startswith('kubernetes:') for registration in result['registrations'].values())} "
+          f"resources")
+    return [
+        ("the kubeconfig refreshes its credential by exec", "exec" in kubeconfig["users"][0]["user"]),
+        ("the apply outlives several tokens", exec_elapsed > 2 * token_seconds),
+        ("every resource applies with refreshed tokens", exec_created == resources and not rejected),
+        # The Python client does not serialize refreshes, each worker may fetch once per token
+        ("tokens are cached, not fetched per request",
+         refreshes <= workers * (exec_elapsed / (token_seconds / 2) + 1) < resources / 4),
+        ("a static token fails partway", static_created < resources),
+        ("requests reuse a pool of connections", exec_server.connections <= workers),
+        ("every k8s resource uses the one provider", len(providers) == 1 and used == set(providers)),
+    ]
+
+
+# Fleet: clusters in their own regions, each with its own ALB controller, a
+# hub release that takes seconds to install and AWS lookups that take
+# seconds, deploy together, so wall-clock time stays flat as clusters are
+# added instead of growing by one cluster's deploy time each. Every hub has
+# its own GitHub OAuth app and admits exactly the learners assigned to it.
+@check("fleet")
+def fleet_scaling(sizes=(1, 4, 8)):
+    timings = {"alb_seconds": 2, "ready_seconds": 1, "release_seconds": 2, "invoke_seconds": 0.5, "parallel": 32}
+    results = run_scenarios([{"tenants": 100, "clusters": clusters, **timings} for clusters in sizes])
+    one, largest = results[0], results[-1]
+    recorded, = run_scenarios([{"tenants": 100, "clusters": 3, "record": True,
+                                "inputs_of": ["kubernetes:core/v1:Secret", "kubernetes:helm.sh/v3:Release"]}])
+    unpaired, = run_scenarios([{"tenants": 1, "details": {"clusters": [{"name": "primary"}, {"name": "second"}]}}],
+                              expect_failure=True)
+    client_ids = {registration["state"]["data"]["value"]["id"] for urn, registration in recorded["registrations"].items()
+                  if urn.rsplit("::", 1)[-1].startswith("gh-credentials")}
+    allowed = [registration["state"]["values"]["hub"]["config"]["Authenticator"]["allowed_users"]
+               for registration in recorded["registrations"].values()
+               if registration["type"] == "kubernetes:helm.sh/v3:Release"]
+    hubs = {}
+    for username, host in recorded["learner_hubs"].items():
+        hubs.setdefault(host, []).append(username)
+    per_cluster = timings["alb_seconds"] + timings["ready_seconds"] + timings["release_seconds"]
+    timed = ", ".join(f"{result['clusters']} clusters in {result['total_seconds']}s" for result in results)
+    print(f"fleet: {timed} ({per_cluster}s of ALB, release and health check waits per cluster)")
+    return [
+        ("every cluster gets its own ALB", all(result["albs"] == result["clusters"] for result in results)),
+        ("clusters deploy concurrently", largest["total_seconds"] < one["total_seconds"] + per_cluster),
+        ("wall-clock time stays flat as clusters are added", largest["total_seconds"] <= 1.25 * one["total_seconds"]),
+        ("every hub has its own GitHub OAuth app", len(client_ids) == 3),
+        ("a second cluster without its own app is refused", "GitHub OAuth app" in unpaired.get("error", "")),
+        ("each hub admits exactly the learners exported for it",
+         len(hubs) == 3 and sorted(map(sorted, allowed)) == sorted(map(sorted, hubs.values()))
+         and sorted(recorded["learner_hubs"]) == [f"learner{index:04d}" for index in range(100)]),
+    ]
+
+
+# Spawn failure metrics with the hub extensions stacked as the chart loads
+# them: every spawn that never gets a server is counted once by reason,
+# including those the hub gives up on (cancelled, not raised, in start())
+@check("metrics")
+def spawn_failure_metrics(logins=60):
+    scale = 0.01
+    settings = {"min": 5, "max": 40, "target-latency": 90 * scale, "hub-namespace": "aws2023",
+                "queue-timeout": 600 * scale, "start-timeout": 300 * scale}
+
+    async def burst(settings, hub_timeout):
+        spawner_class, namespaces, _ = load_extensions([("admission", settings), ("culling", {}),
+                                                        ("metrics", {"enabled": True})])
+        hub = FakeHub(pod_seconds=30 * scale)
+        outcomes = await asyncio.gather(*[hub.spawn(hub.spawner(spawner_class, f"learner{index:04d}"), hub_timeout)
+                                          for index in range(logins)])
+        await asyncio.sleep(60 * scale)
+        failures = {}
+        for metric in namespaces["metrics"]["SPAWN_FAILURES"].collect():
+            for sample in metric.samples:
+                if sample.name.endswith("_total"):
+                    failures[sample.labels["reason"]] = failures.get(sample.labels["reason"], 0) + sample.value
+        active = sum(sample.value for metric in namespaces["metrics"]["ACTIVE_SERVERS"].collect()
+                     for sample in metric.samples)
+        return sum("error" in outcome for outcome in outcomes), failures, active, len(hub.servers)
+
+    hub_timeout = settings["queue-timeout"] + settings["start-timeout"]
+    abandoned, abandoned_failures, _, _ = asyncio.run(burst(settings, 90 * scale))
+    queued, queued_failures, active, servers = asyncio.run(burst({**settings, "queue-timeout": 60 * scale}, hub_timeout))
+    print(f"metrics: {abandoned} spawns the hub gave up on counted as {abandoned_failures}, "
+          f"{queued} queue timeouts as {queued_failures}, {active:.0f} active servers for {servers} running")
+    return [
+        ("spawns the hub gives up on are counted as cancelled",
+         abandoned > 0 and abandoned_failures == {"cancelled": abandoned}),
+        ("queue timeouts are counted as timeouts", queued > 0 and queued_failures == {"timeout": queued}),
+        ("running servers are counted as active", active == servers > 0),
+    ]
+
+
+# Tenant quota: requests.cpu only when every module requests cpu, as the
+# quota would otherwise reject the servers of the modules that do not
+@check("quota")
+def tenant_quotas():
+    lab_catalog = load_catalog("./catalog.yaml")
+    profiles = lab_catalog.resolve_images({variant: variant for variant in lab_catalog.images})
+    measured = {(profile.slug, module.slug): {"cpu": [0.2, 0.4], "memory": [2 ** 30, 2 ** 31]}
+                for profile in profiles for module in profile.modules}
+    partly = dict(list(measured.items())[:1])
+    quotas = {name: tenant_quota(right_size(profiles, usage)) for name, usage in
+              [("unmeasured", {}), ("partly measured", partly), ("measured", measured)]}
+
+    def admitted(name, usage):
+        return all(cpu or "requests.cpu" not in quotas[name] for cpu, _ in module_requests(right_size(profiles, usage)))
+
+    print(f"quota: {', '.join(f'{name} {quota}' for name, quota in quotas.items())}")
+    return [
+        ("no cpu quota unless every module requests cpu", "requests.cpu" not in quotas["partly measured"]
+         and admitted("unmeasured", {}) and admitted("partly measured", partly)),
+        ("a cpu quota once every module requests cpu", "requests.cpu" in quotas["measured"]),
+    ]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the lab's stub performance checks")
+    parser.add_argument("checks", nargs="*", help=f"defaults to every check: {', '.join(CHECKS)}")
+    args = parser.parse_args(argv)
+    unknown = [name for name in args.checks if name not in CHECKS]
+    if unknown:
+        parser.error(f"unknown checks: {', '.join(unknown)}")
+
+    failed = 0
+    for name in args.checks or CHECKS:
+        for description, passed in CHECKS[name]():
+            print(f"  {'ok  ' if passed else 'FAIL'} {name}: {description}")
+            failed += not passed
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,199 @@
+# Stand-in for the Kubernetes API server, served over HTTP on localhost so
+# that the real kubernetes client talks to it: namespaces (paged, label
+# selected lists, deletes that take delete_seconds and leave the namespace
+# Terminating), the pods in them and ConfigMaps (created in create_seconds,
+# label selected lists across namespaces).
+# With authenticate, a request whose bearer token it rejects gets a 401.
+# Every request is logged with its time and status, and the connections
+# opened and requests in flight are counted. Used by checks.py.
+import json
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from kubernetes import client
+
+
+def _matches(labels, selector):
+    for term in filter(None, (selector or "").split(",")):
+        key, _, value = term.partition("=")
+        if key not in labels or (value and labels[key] != value):
+            return False
+    return True
+
+
+def _status(code, reason):
+    return {"kind": "Status", "apiVersion": "v1", "status": "Failure", "code": code, "reason": reason,
+            "message": reason}
+
+
+class FakeApiServer:
+
+    def __init__(self, delete_seconds=0.0, create_seconds=0.0, authenticate=None):
+        self.delete_seconds = delete_seconds
+        self.create_seconds = create_seconds
+        self.authenticate = authenticate
+        self.namespaces = {}
+        self.pods = {}
+        self.config_maps = {}
+        # Namespaces whose delete answers with this status instead
+        self.delete_errors = {}
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.connections = 0
+        self._lock = threading.Lock()
+        self._server = None
+
+    def add_namespace(self, name, labels=None, annotations=None, created=None, phase="Active"):
+        self.namespaces[name] = {
+            "apiVersion": "v1",
+            "kind": "Namespace",
+            "metadata": {"name": name, "labels": labels or {}, "annotations": annotations or {},
+                         "creationTimestamp": (created or datetime.now(timezone.utc)).strftime("%Y-%m-%dT%H:%M:%SZ")},
+            "status": {"phase": phase},
+        }
+
+    def add_pod(self, namespace, name, labels=None):
+        self.pods.setdefault(namespace, []).append(
+            {"apiVersion": "v1", "kind": "Pod", "metadata": {"name": name, "namespace": namespace, "labels": labels or {}}}
+        )
+
+    # Names of the namespaces a delete was accepted for
+    def deleted(self):
+        return sorted(name for name, namespace in self.namespaces.items()
+                      if namespace["status"]["phase"] == "Terminating" and namespace.get("deleted"))
+
+    def list_namespaces(self, query):
+        names = sorted(name for name, namespace in self.namespaces.items()
+                       if _matches(namespace["metadata"]["labels"], query.get("labelSelector")))
+        start = int(query.get("continue") or 0)
+        limit = int(query.get("limit") or len(names) or 1)
+        page = names[start:start + limit]
+        more = start + limit < len(names)
+        return 200, {"apiVersion": "v1", "kind": "NamespaceList",
+                     "metadata": {"continue": str(start + limit) if more else None},
+                     "items": [self.namespaces[name] for name in page]}
+
+    def list_pods(self, namespace, query):
+        pods = [pod for pod in self.pods.get(namespace, [])
+                if _matches(pod["metadata"]["labels"], query.get("labelSelector"))]
+        return 200, {"apiVersion": "v1", "kind": "PodList", "metadata": {},
+                     "items": pods[:int(query["limit"])] if query.get("limit") else pods}
+
+    def delete_namespace(self, name):
+        time.sleep(self.delete_seconds)
+        if name in self.delete_errors:
+            code, reason = self.delete_errors[name]
+            return code, _status(code, reason)
+        with self._lock:
+            namespace = self.namespaces.get(name)
+            if namespace is None:
+                return 404, _status(404, "NotFound")
+            namespace["status"]["phase"] = "Terminating"
+            namespace["deleted"] = True
+        return 200, namespace
+
+    def create_config_map(self, namespace, body):
+        time.sleep(self.create_seconds)
+        name = body["metadata"]["name"]
+        with self._lock:
+            if (namespace, name) in self.config_maps:
+                return 409, _status(409, "AlreadyExists")
+            self.config_maps[namespace, name] = body
+        return 201, body
+
+    def list_config_maps(self, query):
+        return 200, {"apiVersion": "v1", "kind": "ConfigMapList", "metadata": {},
+                     "items": [body for body in self.config_maps.values()
+                               if _matches(body["metadata"].get("labels") or {}, query.get("labelSelector"))]}
+
+    def route(self, method, path, query, body):
+        if method == "GET" and path == "/api/v1/namespaces":
+            return self.list_namespaces(query)
+        if method == "GET" and path == "/api/v1/configmaps":
+            return self.list_config_maps(query)
+        match = re.fullmatch(r"/api/v1/namespaces/([^/]+)/pods", path)
+        if method == "GET" and match:
+            return self.list_pods(match.group(1), query)
+        match = re.fullmatch(r"/api/v1/namespaces/([^/]+)", path)
+        if method == "DELETE" and match:
+            return self.delete_namespace(match.group(1))
+        match = re.fullmatch(r"/api/v1/namespaces/([^/]+)/configmaps", path)
+        if method == "POST" and match:
+            return self.create_config_map(match.group(1), body)
+        return 404, _status(404, "NotFound")
+
+    def handle(self, method, url, authorization=None, body=None):
+        parsed = urlparse(url)
+        query = {key: values[-1] for key, values in parse_qs(parsed.query).items()}
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            if self.authenticate and not self.authenticate((authorization or "").removeprefix("Bearer ")):
+                code, body = 401, _status(401, "Unauthorized")
+            else:
+                code, body = self.route(method, parsed.path, query, body)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+                self.requests.append((time.monotonic(), method, parsed.path, code))
+        return code, body
+
+    def start(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                with server._lock:
+                    server.connections += 1
+
+            def respond(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                request = json.loads(self.rfile.read(length)) if length else None
+                code, body = server.handle(self.command, self.path, self.headers.get("Authorization"), request)
+                payload = json.dumps(body).encode("utf-8")
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            do_GET = do_POST = do_DELETE = respond
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def core_api(self):
+        configuration = client.Configuration()
+        configuration.host = self.url
+        return client.CoreV1Api(client.ApiClient(configuration))
+
+    # Requests in the busiest window of the given length
+    def peak_requests(self, window=1.0, method=None):
+        times = sorted(at for at, request_method, _, _ in self.requests if method in (None, request_method))
+        peak, first = 0, 0
+        for last, at in enumerate(times):
+            while times[first] < at - window:
+                first += 1
+            peak = max(peak, last - first + 1)
+        return peak
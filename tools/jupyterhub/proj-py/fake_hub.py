@@ -0,0 +1,151 @@
+# Stand-ins for running the hub/ extensions outside a hub: a KubeSpawner
+# whose pods are entries in a dict and take pod_seconds to start, z2jh's
+# get_config, the traitlets config object the extensions receive as "c",
+# and a hub that spawns and stops servers the way JupyterHub does (its start
+# timeout does not cancel start(), it stops the spawner instead). Used by
+# checks.py; nothing here talks to Kubernetes.
+import asyncio
+import logging
+import os
+import runpy
+import sys
+import types
+from datetime import datetime, timezone
+import prometheus_client
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+log = logging.getLogger("fake-hub")
+
+
+class Section(dict):
+
+    def __getattr__(self, name):
+        return self[name]
+
+    def __setattr__(self, name, value):
+        self[name] = value
+
+
+class Config(dict):
+
+    def __getattr__(self, name):
+        return self.setdefault(name, Section())
+
+
+class FakeApi:
+
+    def __init__(self, hub):
+        self.hub = hub
+
+    async def list_namespaced_pod(self, namespace, label_selector=None):
+        return types.SimpleNamespace(items=[])
+
+    # A pod without conditions or container states, so no phase can be timed
+    async def read_namespaced_pod(self, name, namespace):
+        return types.SimpleNamespace(metadata=types.SimpleNamespace(creation_timestamp=now()),
+                                     status=types.SimpleNamespace(conditions=[], container_statuses=[]))
+
+    async def list_namespaced_event(self, namespace, field_selector=None):
+        return types.SimpleNamespace(items=[])
+
+
+class FakeUser:
+
+    def __init__(self, hub, name):
+        self.hub = hub
+        self.name = name
+        self.spawner = None
+
+    async def stop(self, server_name=""):
+        await self.hub.stop(self.spawner)
+
+
+class FakeKubeSpawner:
+
+    def __init__(self, hub, user, user_options=None, last_activity=None, started=None, mem_limit=None):
+        self.hub = hub
+        self.user = user
+        self.name = ""
+        self.user_options = user_options or {}
+        self.mem_limit = mem_limit
+        self.start_timeout = 300
+        self.orm_spawner = types.SimpleNamespace(last_activity=last_activity, started=started)
+        self.log = log
+        self._log_name = f"{user.name}/"
+        self.api = FakeApi(hub)
+        self.pod_name = f"jupyter-{user.name}"
+        self.namespace = f"lab-{user.name}"
+        self.server = None
+
+    # The pod exists from the start of start(), as KubeSpawner creates it
+    # first and then waits for it to run
+    async def start(self):
+        self.hub.pods[self.pod_name] = {"ready": False}
+        await asyncio.sleep(self.hub.pod_seconds)
+        self.hub.pods[self.pod_name]["ready"] = True
+        return f"http://{self.pod_name}:8888"
+
+    async def stop(self, now=False):
+        self.hub.pods.pop(self.pod_name, None)
+
+    async def poll(self):
+        return None if self.pod_name in self.hub.pods else 0
+
+    def clear_state(self):
+        pass
+
+
+class FakeHub:
+
+    def __init__(self, pod_seconds=0.0):
+        self.pod_seconds = pod_seconds
+        self.pods = {}
+        self.servers = {}
+        self.stopped = []
+
+    def spawner(self, spawner_class, username, **kwargs):
+        user = FakeUser(self, username)
+        user.spawner = spawner_class(self, user, **kwargs)
+        return user.spawner
+
+    # JupyterHub's User.spawn: start() runs as its own task and the timeout
+    # (gen.with_timeout) leaves it running; the hub then stops the spawner
+    async def spawn(self, spawner, start_timeout):
+        start = asyncio.ensure_future(spawner.start())
+        try:
+            url = await asyncio.wait_for(asyncio.shield(start), start_timeout)
+        except Exception as e:
+            await self.stop(spawner)
+            return {"user": spawner.user.name, "error": f"{type(e).__name__}: {e}"}
+        self.servers[spawner.user.name] = url
+        return {"user": spawner.user.name, "url": url}
+
+    async def stop(self, spawner):
+        self.servers.pop(spawner.user.name, None)
+        self.stopped.append(spawner.user.name)
+        await spawner.stop()
+
+    # Pods left without a server the hub knows about
+    def orphans(self):
+        return sorted(set(self.pods) - {f"jupyter-{user}" for user in self.servers})
+
+
+def now():
+    return datetime.now(timezone.utc)
+
+
+# Runs hub/<name>.py for each (name, settings) in order, as the chart loads
+# hub.extraConfig, and returns the resulting spawner class. Metrics are
+# registered afresh each time.
+def load_extensions(extensions):
+    for collector in list(prometheus_client.REGISTRY._collector_to_names):
+        prometheus_client.REGISTRY.unregister(collector)
+    settings = {f"custom.{name}": config for name, config in extensions}
+    sys.modules["kubespawner"] = types.SimpleNamespace(KubeSpawner=FakeKubeSpawner)
+    sys.modules["z2jh"] = types.SimpleNamespace(get_config=lambda key, default=None: settings.get(key, default))
+    c = Config()
+    namespaces = {}
+    for name, _ in extensions:
+        namespaces[name] = runpy.run_path(os.path.join(HERE, "hub", f"{name}.py"), init_globals={"c": c})
+    return c.JupyterHub.get("spawner_class", FakeKubeSpawner), namespaces, c
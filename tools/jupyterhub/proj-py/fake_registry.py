@@ -0,0 +1,149 @@
+# Stand-in for an ECR registry, served over HTTP on localhost: the Docker
+# Registry v2 manifest endpoints behind basic auth (ECR's AWS:<token> pair),
+# images pushed with a tag or untagged at a given time, ECR lifecycle rules
+# applied to a repository, and the "most recent image" lookup. pull() fetches
+# a manifest the way kubelet does with a dockerconfigjson pull secret and
+# returns the kubelet event it would record. Used by checks.py.
+import base64
+import hashlib
+import json
+import re
+import threading
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+
+def _error(code, message):
+    return {"errors": [{"code": code, "message": message}]}
+
+
+class FakeRegistry:
+
+    def __init__(self, username="AWS", password="registry-token"):
+        self.username = username
+        self.password = password
+        self.repositories = {}
+        self.requests = []
+        self._pushed = 0
+        self._lock = threading.Lock()
+        self._server = None
+
+    def push(self, repository, tag=None, pushed=None):
+        self._pushed += 1
+        digest = f"sha256:{hashlib.sha256(f'{repository}/{self._pushed}'.encode('utf-8')).hexdigest()}"
+        images = self.repositories.setdefault(repository, [])
+        for image in images:
+            image["tags"].discard(tag)
+        images.append({"digest": digest, "tags": {tag} - {None}, "pushed": pushed or datetime.now(timezone.utc)})
+        return digest
+
+    def most_recent(self, repository):
+        images = self.repositories.get(repository) or []
+        return max(images, key=lambda image: image["pushed"])["digest"] if images else None
+
+    # Applies an ECR lifecycle policy (JSON text): rules in priority order,
+    # each image expired by at most one rule. Returns the expired digests.
+    def expire(self, repository, policy, now=None):
+        now = now or datetime.now(timezone.utc)
+        images = self.repositories.get(repository) or []
+        expired = set()
+        for rule in sorted(json.loads(policy)["rules"], key=lambda rule: rule["rulePriority"]):
+            selection = rule["selection"]
+            candidates = [image for image in images if image["digest"] not in expired
+                          and (selection["tagStatus"] == "any"
+                               or (selection["tagStatus"] == "untagged") == (not image["tags"]))]
+            if selection["countType"] == "sinceImagePushed":
+                age = timedelta(days=selection["countNumber"])
+                expired |= {image["digest"] for image in candidates if now - image["pushed"] > age}
+            elif selection["countType"] == "imageCountMoreThan":
+                newest = sorted(candidates, key=lambda image: image["pushed"], reverse=True)
+                expired |= {image["digest"] for image in newest[selection["countNumber"]:]}
+        self.repositories[repository] = [image for image in images if image["digest"] not in expired]
+        return expired
+
+    def authorized(self, authorization):
+        expected = base64.b64encode(f"{self.username}:{self.password}".encode("utf-8")).decode("utf-8")
+        return authorization == f"Basic {expected}"
+
+    def manifest(self, repository, reference):
+        for image in self.repositories.get(repository) or []:
+            if reference == image["digest"] or reference in image["tags"]:
+                return 200, {"schemaVersion": 2}, image["digest"]
+        return 404, _error("MANIFEST_UNKNOWN", f"manifest unknown: {repository}:{reference}"), None
+
+    def handle(self, method, path, authorization=None):
+        with self._lock:
+            self.requests.append((time.monotonic(), method, path))
+        if not self.authorized(authorization):
+            return 401, _error("UNAUTHORIZED", "authentication required"), None
+        if path == "/v2/":
+            return 200, {}, None
+        match = re.fullmatch(r"/v2/(.+)/manifests/([^/]+)", path)
+        if match and method in ("GET", "HEAD"):
+            return self.manifest(match.group(1), match.group(2))
+        return 404, _error("NAME_UNKNOWN", path), None
+
+    def start(self):
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def respond(self):
+                code, body, digest = registry.handle(self.command, self.path, self.headers.get("Authorization"))
+                payload = json.dumps(body).encode("utf-8")
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                if code == 401:
+                    self.send_header("WWW-Authenticate", 'Basic realm="fake-registry"')
+                if digest:
+                    self.send_header("Docker-Content-Digest", digest)
+                self.end_headers()
+                if self.command != "HEAD":
+                    self.wfile.write(payload)
+
+            do_GET = do_HEAD = respond
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    @property
+    def host(self):
+        return f"127.0.0.1:{self._server.server_address[1]}"
+
+
+# Resolves image (host/repository:tag) with the credentials a .dockerconfigjson
+# holds for its host and returns the event kubelet records for the pull
+def pull(image, dockerconfig):
+    host, _, rest = image.partition("/")
+    repository, _, tag = rest.rpartition(":")
+    auth = json.loads(dockerconfig)["auths"].get(host, {}).get("auth")
+    request = urllib.request.Request(f"http://{host}/v2/{repository}/manifests/{tag}", method="HEAD",
+                                     headers={"Authorization": f"Basic {auth}"} if auth else {})
+    started = time.perf_counter()
+    try:
+        urllib.request.urlopen(request, timeout=5).close()
+    except urllib.error.HTTPError as e:
+        if e.code == 401:
+            detail = "401 Unauthorized" if auth else "no basic auth credentials"
+        else:
+            detail = f"{e.code} {e.reason}: {image} not found"
+        return SimpleNamespace(reason="Failed", count=1,
+                               message=f'Failed to pull image "{image}": rpc error: code = Unknown desc = {detail}')
+    elapsed = time.perf_counter() - started
+    took = f"{elapsed * 1000:.0f}ms" if elapsed < 1 else f"{elapsed:.3f}s"
+    return SimpleNamespace(reason="Pulled", count=1, message=f'Successfully pulled image "{image}" in {took}')
@@ -0,0 +1,96 @@
+import hashlib
+import math
+from dataclasses import dataclass
+from functools import lru_cache
+import pulumi
+import pulumi_aws as aws
+
+
+def home_region():
+    return pulumi.Config("aws").require("region")
+
+
+# details.clusters lists the fleet as {name, region, capacity, node-role,
+# item} entries, the single "eks-cluster" is used without it. The first
+# cluster keeps the original resource names, the others get a "-<key>"
+# suffix. A GitHub OAuth app has one callback URL, so every hub but the
+# first needs its own app's 1Password item.
+def fleet_clusters(details):
+    clusters = details.get("clusters") or [{"name": details.get("eks-cluster")}]
+    fleet = []
+    for index, cluster in enumerate(clusters):
+        key = cluster.get("key", cluster["name"])
+        if index and not cluster.get("item"):
+            raise ValueError(f"Cluster {key} needs an item with its own GitHub OAuth app, "
+                             f"the primary hub's app only accepts its callback URL")
+        fleet.append({
+            "name": cluster["name"],
+            "region": cluster.get("region", home_region()),
+            "capacity": cluster.get("capacity"),
+            "node_role": cluster.get("node-role", details.get("node-role")),
+            "key": key,
+            "suffix": f"-{key}" if index else "",
+            "item": cluster.get("item"),
+        })
+    return fleet
+
+
+# Explicit provider for regions other than the stack's own
+@lru_cache(maxsize=None)
+def region_provider(region):
+    if region == home_region():
+        return None
+    return aws.Provider(f"aws-{region}", region=region)
+
+
+def invoke_opts(region):
+    provider = region_provider(region)
+    return pulumi.InvokeOptions(provider=provider) if provider else None
+
+
+def ecr_registry(account, region):
+    return f"{account}.dkr.ecr.{region}.amazonaws.com"
+
+
+def hub_host(details, cluster):
+    return f"{details.get('tags')['purpose']}-{details.get('chart-name')}{cluster['suffix']}.{details.get('user-domain')}"
+
+
+def _rendezvous(username, cluster):
+    digest = int(hashlib.sha256(f"{cluster['key']}/{username}".encode("utf-8")).hexdigest()[:15], 16)
+    return -float(cluster["capacity"] or 1) / math.log((digest + 1) / (16 ** 15 + 1))
+
+
+# Learners spread over clusters in proportion to capacity (weighted rendezvous
+# hashing), so adding a learner or a cluster only moves a proportional share.
+# A cluster at capacity passes learners on to their next-ranked cluster.
+def assign_learners(usernames, clusters):
+    assignments = {cluster["key"]: [] for cluster in clusters}
+    for username in sorted(usernames):
+        ranked = sorted(clusters, key=lambda cluster: _rendezvous(username, cluster), reverse=True)
+        target = next(
+            (cluster for cluster in ranked
+             if cluster["capacity"] is None or len(assignments[cluster["key"]]) < cluster["capacity"]),
+            None
+        )
+        if target is None:
+            target = ranked[0]
+            pulumi.log.warn(f"Fleet is over capacity, {username} assigned to {target['key']} anyway")
+        assignments[target["key"]].append(username)
+    return assignments
+
+
+# Resources and outputs of one cluster's lab deployment
+@dataclass
+class LabClusterDeployment:
+    cluster: dict
+    learners: list
+    eks: object
+    kubeconfig: object
+    k8s_provider: object
+    oidc: object
+    s3_access_role: object
+    tenants: list
+    values_hash: str
+    fqdn: object
+    endpoint: object
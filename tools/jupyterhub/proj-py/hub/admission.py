@@ -0,0 +1,164 @@
+# Spawn admission control, loaded into the hub through hub.extraConfig.
+# Spawns wait in a fair queue for a slot. The number of slots follows an
+# AIMD limit driven by observed spawn latency, and is raised while warm
+# user-placeholder pods show there is node headroom. The queue wait and the
+# server start each have their own timeout.
+import asyncio
+import itertools
+import os
+import time
+from collections import Counter
+
+from kubespawner import KubeSpawner
+from prometheus_client import Gauge, Histogram
+from z2jh import get_config
+
+admission_config = get_config("custom.admission", {})
+
+SPAWN_BUCKETS = (1, 5, 10, 20, 30, 45, 60, 90, 120, 180, 300, float("inf"))
+
+QUEUE_DEPTH_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, float("inf"))
+
+SPAWN_QUEUE_DEPTH = Gauge("lab_spawn_queue_depth", "Spawns waiting for an admission slot")
+SPAWN_QUEUE_DEPTH_SEEN = Histogram("lab_spawn_queue_depth_seen", "Queue depth each spawn found on arrival",
+                                   buckets=QUEUE_DEPTH_BUCKETS)
+SPAWN_QUEUE_WAIT = Histogram("lab_spawn_queue_wait_seconds", "Time spawns waited for an admission slot",
+                             buckets=SPAWN_BUCKETS)
+SPAWN_DURATION = Histogram("lab_spawn_duration_seconds", "Time from admission to a ready server",
+                           buckets=SPAWN_BUCKETS)
+SPAWN_LIMIT = Gauge("lab_spawn_concurrency_limit", "Current adaptive spawn concurrency limit")
+SPAWN_ACTIVE = Gauge("lab_spawn_active", "Spawns currently holding an admission slot")
+
+
+class SpawnAdmission:
+
+    def __init__(self, minimum, maximum, target_latency, headroom_ttl=15):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_latency = target_latency
+        self.headroom_ttl = headroom_ttl
+        self.limit = float(minimum)
+        self.headroom = 0
+        self.headroom_checked = 0
+        self.active = Counter()
+        self.waiters = []
+        self.sequence = itertools.count()
+        SPAWN_LIMIT.set(self.limit)
+
+    def capacity(self):
+        return max(int(self.limit), min(self.maximum, self.headroom))
+
+    async def acquire(self, username):
+        SPAWN_QUEUE_DEPTH_SEEN.observe(len(self.waiters))
+        if not self.waiters and sum(self.active.values()) < self.capacity():
+            self._grant(username)
+            return
+        waiter = (next(self.sequence), username, asyncio.get_running_loop().create_future())
+        self.waiters.append(waiter)
+        SPAWN_QUEUE_DEPTH.set(len(self.waiters))
+        try:
+            await waiter[2]
+        except asyncio.CancelledError:
+            if waiter in self.waiters:
+                self.waiters.remove(waiter)
+                SPAWN_QUEUE_DEPTH.set(len(self.waiters))
+            elif not waiter[2].cancelled():
+                self.release(username, None)
+            raise
+
+    def release(self, username, latency):
+        self.active[username] -= 1
+        if self.active[username] <= 0:
+            del self.active[username]
+        if latency is not None:
+            if latency > self.target_latency:
+                self.limit = max(self.minimum, self.limit / 2)
+            else:
+                self.limit = min(self.maximum, self.limit + 1 / max(self.limit, 1))
+            SPAWN_LIMIT.set(self.limit)
+        self._wake()
+
+    def _grant(self, username):
+        self.active[username] += 1
+        SPAWN_ACTIVE.set(sum(self.active.values()))
+
+    # Users without a spawn in flight go first, then arrival order
+    def _wake(self):
+        while self.waiters and sum(self.active.values()) < self.capacity():
+            waiter = min(self.waiters, key=lambda w: (self.active[w[1]], w[0]))
+            self.waiters.remove(waiter)
+            if waiter[2].done():
+                continue
+            self._grant(waiter[1])
+            waiter[2].set_result(None)
+        SPAWN_QUEUE_DEPTH.set(len(self.waiters))
+        SPAWN_ACTIVE.set(sum(self.active.values()))
+
+    # Ready user-placeholder pods are warm slots a spawn can preempt
+    async def refresh_headroom(self, spawner):
+        if time.monotonic() - self.headroom_checked < self.headroom_ttl:
+            return
+        self.headroom_checked = time.monotonic()
+        try:
+            pods = await spawner.api.list_namespaced_pod(
+                admission_config.get("hub-namespace", os.environ.get("POD_NAMESPACE")),
+                label_selector="component=user-placeholder",
+            )
+            self.headroom = sum(1 for pod in pods.items if pod.status.phase == "Running")
+        except Exception as e:
+            spawner.log.warning(f"Spawn admission headroom check failed: {e}")
+        self._wake()
+
+
+admission = SpawnAdmission(
+    minimum=int(admission_config.get("min", 5)),
+    maximum=int(admission_config.get("max", 40)),
+    target_latency=float(admission_config.get("target-latency", 90)),
+)
+
+# The hub's Spawner.start_timeout is the sum of both, so a spawn deep in a
+# burst's queue still gets the whole start budget once admitted
+QUEUE_TIMEOUT = float(admission_config.get("queue-timeout", 600))
+START_TIMEOUT = float(admission_config.get("start-timeout", 300))
+
+
+class AdmissionSpawner(KubeSpawner):
+
+    # Seconds the last spawn waited for its slot, kept out of its start phases
+    admission_wait = 0
+    _admission_task = None
+
+    async def start(self):
+        self._admission_task = asyncio.current_task()
+        await admission.refresh_headroom(self)
+        queued = time.monotonic()
+        try:
+            await asyncio.wait_for(admission.acquire(self.user.name), QUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"No spawn slot for {self._log_name} within {QUEUE_TIMEOUT:.0f}s") from None
+        finally:
+            self.admission_wait = time.monotonic() - queued
+        SPAWN_QUEUE_WAIT.observe(self.admission_wait)
+        started = time.monotonic()
+        latency = None
+        try:
+            result = await asyncio.wait_for(super().start(), START_TIMEOUT)
+            latency = time.monotonic() - started
+            SPAWN_DURATION.observe(latency)
+            return result
+        finally:
+            admission.release(self.user.name, latency)
+
+    # The hub stops a spawn it gave up on without cancelling start(): leave
+    # the queue (or abandon the pod start) first, so no slot is granted and
+    # no pod created after the stop
+    async def stop(self, now=False):
+        task = self._admission_task
+        if task is not None and not task.done() and task is not asyncio.current_task():
+            task.cancel()
+            await asyncio.wait([task])
+        return await super().stop(now=now)
+
+
+if admission_config.get("enabled", True):
+    c.JupyterHub.spawner_class = AdmissionSpawner
@@ -0,0 +1,78 @@
+# Per-profile idle culling, loaded into the hub through hub.extraConfig.
+# Every spawner poll compares the server's last activity (proxy traffic and
+# kernel activity reported by jupyterhub-singleuser) with the idle timeout
+# of its profile, and stops idle servers through the hub so the proxy route,
+# pod and namespace quota are released. The jupyterhub-idle-culler service
+# stays enabled as a backstop with the longest timeout.
+import asyncio
+from datetime import datetime, timezone
+
+from kubespawner import KubeSpawner
+from prometheus_client import Counter
+from z2jh import get_config
+
+culling_config = get_config("custom.culling", {})
+
+CULLED_SERVERS = Counter("lab_culled_servers_total", "Idle lab servers stopped", ["profile"])
+CULLED_MEMORY = Counter("lab_culled_memory_bytes_total", "Memory limits released by culling", ["profile"])
+CULLED_NODE_HOURS = Counter("lab_culled_node_hours_total",
+                            "Node-hours released before the backstop culler would have stopped the server",
+                            ["profile"])
+
+culling_spawner_base = c.JupyterHub.get("spawner_class")
+if not isinstance(culling_spawner_base, type):
+    culling_spawner_base = KubeSpawner
+
+
+class CullingSpawner(culling_spawner_base):
+
+    _culling = False
+
+    def idle_timeout(self):
+        profile = (self.user_options or {}).get("profile")
+        return int(culling_config.get("profiles", {}).get(profile, culling_config.get("default-idle-timeout", 3600)))
+
+    async def poll(self):
+        status = await super().poll()
+        if status is None and not self._culling and self.orm_spawner.last_activity:
+            last_activity = self.orm_spawner.last_activity.replace(tzinfo=timezone.utc)
+            idle = (datetime.now(timezone.utc) - last_activity).total_seconds()
+            if idle > self.idle_timeout():
+                self._culling = True
+                asyncio.ensure_future(self.cull(idle))
+        return status
+
+    async def cull(self, idle):
+        profile = (self.user_options or {}).get("profile", "default")
+        memory = self.mem_limit or 0
+        started = self.orm_spawner.started or self.orm_spawner.last_activity
+        age = (datetime.now(timezone.utc) - started.replace(tzinfo=timezone.utc)).total_seconds()
+        # The backstop culler stops the server once idle for its timeout or at max-age, whichever comes first
+        max_age = int(culling_config.get("max-age", 604800))
+        remaining = min(max_age - age, int(culling_config.get("backstop-timeout", max_age)) - idle)
+        node_hours = memory / float(culling_config.get("node-memory", 8 * 1024 ** 3)) * max(remaining, 0) / 3600
+        self.log.info(
+            f"Culling {self._log_name} (profile {profile}) idle for {int(idle)}s, "
+            f"releasing {memory / 1024 ** 3:.1f}G and ~{node_hours:.2f} node-hours"
+        )
+        try:
+            await self.user.stop(self.name)
+        except Exception as e:
+            self.log.error(f"Culling {self._log_name} failed: {e}")
+            self._culling = False
+            return
+        CULLED_SERVERS.labels(profile=profile).inc()
+        CULLED_MEMORY.labels(profile=profile).inc(memory)
+        CULLED_NODE_HOURS.labels(profile=profile).inc(node_hours)
+
+    def clear_state(self):
+        super().clear_state()
+        self._culling = False
+
+
+if culling_config.get("enabled", True):
+    c.JupyterHub.spawner_class = CullingSpawner
+    # SIGTERM lets the server shut its kernels down cleanly before the pod goes. It saves
+    # nothing: edits are on disk through JupyterLab's autosave (forced on in the lab image,
+    # every 60s), long before a server has been idle for its timeout.
+    c.KubeSpawner.delete_grace_period = int(culling_config.get("grace-period", 30))
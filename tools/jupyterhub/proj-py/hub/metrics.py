@@ -0,0 +1,135 @@
+# Learner-experience metrics, loaded into the hub through hub.extraConfig.
+# Every completed spawn is broken into phases from its pod's conditions and
+# container state (scheduling, init containers, image pull and container
+# creation, postStart and server startup, hub-side proxy setup), labelled by
+# profile and by whether the cluster-autoscaler had to add a node. Running
+# servers are counted per profile from spawner polls, so the gauge recovers
+# after a hub restart. Served with the hub's own metrics on /hub/metrics.
+import asyncio
+import collections
+import os
+import time
+
+from kubespawner import KubeSpawner
+from prometheus_client import Counter, Gauge, Histogram
+from z2jh import get_config
+
+metrics_config = get_config("custom.metrics", {})
+
+PHASE_BUCKETS = (0.5, 1, 2, 5, 10, 20, 30, 45, 60, 90, 120, 180, 300, float("inf"))
+
+SPAWN_PHASE = Histogram("lab_spawn_phase_seconds", "Time spent in each phase of a successful spawn",
+                        ["phase", "profile", "scale_up"], buckets=PHASE_BUCKETS)
+SPAWN_FAILURES = Counter("lab_spawn_failures_total", "Spawns that failed, timed out or were abandoned by the hub", ["profile", "reason"])
+ACTIVE_SERVERS = Gauge("lab_active_servers", "Running lab servers", ["profile"])
+
+active_servers = {}
+seen_profiles = set()
+
+metrics_spawner_base = c.JupyterHub.get("spawner_class")
+if not isinstance(metrics_spawner_base, type):
+    metrics_spawner_base = KubeSpawner
+
+
+def _condition_time(pod, condition_type):
+    for condition in pod.status.conditions or []:
+        if condition.type == condition_type and condition.status == "True":
+            return condition.last_transition_time
+    return None
+
+
+def _seconds(start, end):
+    return max((end - start).total_seconds(), 0) if start and end else None
+
+
+def _count_active():
+    counts = collections.Counter(active_servers.values())
+    seen_profiles.update(counts)
+    for profile in seen_profiles:
+        ACTIVE_SERVERS.labels(profile=profile).set(counts[profile])
+
+
+class MetricsSpawner(metrics_spawner_base):
+
+    def _metrics_profile(self):
+        return (self.user_options or {}).get("profile", "default")
+
+    def _metrics_key(self):
+        return f"{self.user.name}/{self.name}"
+
+    async def start(self):
+        started = time.monotonic()
+        profile = self._metrics_profile()
+        # A spawn the hub gave up on is cancelled (admission's stop() does it), which is not an Exception
+        try:
+            result = await super().start()
+        except (Exception, asyncio.CancelledError) as e:
+            if isinstance(e, asyncio.CancelledError):
+                reason = "cancelled"
+            elif isinstance(e, TimeoutError):
+                reason = "timeout"
+            else:
+                reason = "error"
+            SPAWN_FAILURES.labels(profile=profile, reason=reason).inc()
+            raise
+        try:
+            await self._observe_phases(profile, time.monotonic() - started)
+        except Exception as e:
+            self.log.warning(f"Spawn phase metrics for {self._log_name} failed: {e}")
+        active_servers[self._metrics_key()] = profile
+        _count_active()
+        return result
+
+    async def _observe_phases(self, profile, total):
+        pod = await self.api.read_namespaced_pod(self.pod_name, self.namespace)
+        events = await self.api.list_namespaced_event(
+            self.namespace, field_selector=f"involvedObject.name={self.pod_name}"
+        )
+        scale_up = "true" if any(event.reason == "TriggeredScaleUp" for event in events.items) else "false"
+        created = pod.metadata.creation_timestamp
+        scheduled = _condition_time(pod, "PodScheduled")
+        initialized = _condition_time(pod, "Initialized")
+        ready = _condition_time(pod, "Ready")
+        container_started = next(
+            (status.state.running.started_at for status in pod.status.container_statuses or []
+             if status.name == "notebook" and status.state.running),
+            None
+        )
+        phases = {
+            "scheduling": _seconds(created, scheduled),
+            "init": _seconds(scheduled, initialized),
+            "image_pull": _seconds(initialized, container_started),
+            "post_start": _seconds(container_started, ready),
+        }
+        pod_seconds = _seconds(created, ready)
+        if pod_seconds is not None:
+            # Time queued for an admission slot is lab_spawn_queue_wait_seconds, not hub time
+            phases["hub"] = max(total - getattr(self, "admission_wait", 0) - pod_seconds, 0)
+        for phase, seconds in phases.items():
+            if seconds is not None:
+                SPAWN_PHASE.labels(phase=phase, profile=profile, scale_up=scale_up).observe(seconds)
+
+    async def poll(self):
+        status = await super().poll()
+        if status is None:
+            active_servers.setdefault(self._metrics_key(), self._metrics_profile())
+        else:
+            active_servers.pop(self._metrics_key(), None)
+        _count_active()
+        return status
+
+    async def stop(self, now=False):
+        try:
+            return await super().stop(now=now)
+        finally:
+            active_servers.pop(self._metrics_key(), None)
+            _count_active()
+
+
+if metrics_config.get("enabled", True):
+    c.JupyterHub.spawner_class = MetricsSpawner
+    # Scrapes authenticate with a service token (from the lab-metrics secret) holding read:metrics
+    c.JupyterHub.authenticate_prometheus = metrics_config.get("authenticate", True)
+    if os.environ.get("LAB_METRICS_TOKEN"):
+        c.JupyterHub.services.append({"name": "prometheus", "api_token": os.environ["LAB_METRICS_TOKEN"]})
+        c.JupyterHub.load_roles.append({"name": "prometheus", "scopes": ["read:metrics"], "services": ["prometheus"]})
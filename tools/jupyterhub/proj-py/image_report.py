@@ -0,0 +1,169 @@
+# Size/layer report and cold-pull benchmark for the lab image variants, next
+# to the same targets built from an older Dockerfile. Each image is pushed to
+# a local registry, removed locally (with its base images) and pulled again,
+# so the pull time is what a fresh autoscaled node would see over a fast
+# link; the byte counts are what it pulls from ECR.
+#
+#   docker run -d -p 5000:5000 --name lab-registry registry:2
+#   python image_report.py --target net full --baseline af7ce63 --registry localhost:5000 --output /tmp/image.json
+#
+# The Dockerfile itself is also checked for what should never reach a lab
+# image layer: build toolchains, downloaded installers and apt lists left
+# behind by the layer that created them (see leftovers()).
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DOCKERFILE = os.path.join(HERE, "image", "Dockerfile")
+
+# Packages learners never use in a lab image
+BUILD_TOOLS = ("build-essential", "gcc", "g++", "make", "unzip")
+
+INSTALLER = re.compile(r"\.(zip|tar\.gz|tgz|deb)\b")
+
+
+# Stages of a Dockerfile as {name: {"base": ..., "runs": [...]}}, in order;
+# unnamed stages get their index as name
+def dockerfile_stages(text):
+    stages = {}
+    current = None
+    for line in re.sub(r"\\\n", " ", text).splitlines():
+        words = line.strip().split()
+        if not words or words[0].startswith("#"):
+            continue
+        instruction = words[0].upper()
+        if instruction == "FROM":
+            name = words[3] if len(words) > 3 and words[2].upper() == "AS" else str(len(stages))
+            current = stages[name] = {"base": words[1], "runs": []}
+        elif instruction == "RUN" and current is not None:
+            current["runs"].append(" ".join(words[1:]))
+    return stages
+
+
+# The stages whose layers end up in the target: the target and its FROM chain
+def target_chain(stages, target=None):
+    chain = []
+    name = target or list(stages)[-1]
+    while name in stages:
+        chain.append(name)
+        name = stages[name]["base"]
+    return chain
+
+
+# What the target's own layers keep that a lab image should not:
+# build tools, installer archives and apt lists not removed in their layer
+def leftovers(text, target=None):
+    stages = dockerfile_stages(text)
+    found = []
+    for name in target_chain(stages, target):
+        for run in stages[name]["runs"]:
+            installs = re.findall(r"apt-get install (.*?)(?:&&|$)", run)
+            for package in BUILD_TOOLS:
+                if any(package in install.split() for install in installs):
+                    found.append(f"{name}: installs {package}")
+            if installs and "rm -rf /var/lib/apt/lists" not in run:
+                found.append(f"{name}: apt lists stay in the layer of '{run[:40]}...'")
+            for archive in sorted(set(INSTALLER.findall(run))):
+                if not re.search(r"rm -\w*f\w* [^&]*\." + re.escape(archive), run):
+                    found.append(f"{name}: downloaded .{archive} stays in its layer")
+    return found
+
+
+def docker(*args, capture=True):
+    completed = subprocess.run(["docker", *args], check=True, text=True,
+                               stdout=subprocess.PIPE if capture else None)
+    return completed.stdout.strip() if capture else None
+
+
+def build(dockerfile, target, tag):
+    docker("build", "--platform", "linux/amd64", "-f", dockerfile, *(["--target", target] if target else []), "-t", tag,
+           HERE, capture=False)
+
+
+# Image size and the size of each layer, largest first
+def layer_report(tag):
+    size = int(docker("image", "inspect", "--format", "{{.Size}}", tag))
+    layers = []
+    for line in docker("history", "--no-trunc", "--human=false", "--format", "{{.Size}}\t{{.CreatedBy}}", tag).splitlines():
+        layer_size, created_by = line.split("\t", 1)
+        if int(layer_size):
+            layers.append({"bytes": int(layer_size), "created_by": created_by[:120]})
+    return {"bytes": size, "layers": sorted(layers, key=lambda layer: -layer["bytes"])}
+
+
+# Seconds to pull the image from the registry with none of its layers local:
+# the image and the external base images it was built from are removed first
+def cold_pull(tag, registry, bases):
+    remote = f"{registry}/lab-image-report:{tag.split(':')[0]}"
+    docker("tag", tag, remote)
+    docker("push", remote, capture=False)
+    docker("image", "rm", "--force", remote, tag, *bases)
+    started = time.monotonic()
+    docker("pull", remote, capture=False)
+    seconds = round(time.monotonic() - started, 2)
+    docker("tag", remote, tag)
+    return seconds
+
+
+def report(dockerfile, label, targets, registry):
+    with open(dockerfile) as dockerfile_file:
+        text = dockerfile_file.read()
+    stages = dockerfile_stages(text)
+    results = {}
+    for target in targets:
+        # Older single-stage Dockerfiles have one image for every variant
+        stage = target if target in stages else None
+        tag = f"lab-image-report-{label}-{target}:latest"
+        bases = [stages[name]["base"] for name in target_chain(stages, stage) if stages[name]["base"] not in stages]
+        build(dockerfile, stage, tag)
+        results[target] = {
+            **layer_report(tag),
+            "leftovers": leftovers(text, stage),
+            "cold_pull_seconds": cold_pull(tag, registry, bases) if registry else None,
+        }
+    return results
+
+
+def print_report(reports, targets):
+    print(f"{'target':>8} {'dockerfile':>12} {'size':>10} {'layers':>7} {'cold pull':>10}")
+    for target in targets:
+        for label, results in reports.items():
+            result = results[target]
+            pull = f"{result['cold_pull_seconds']:.1f}s" if result["cold_pull_seconds"] is not None else "-"
+            print(f"{target:>8} {label:>12} {result['bytes'] / 2 ** 20:>8.0f}MB {len(result['layers']):>7} {pull:>10}")
+        for label, results in reports.items():
+            for finding in results[target]["leftovers"]:
+                print(f"  {label}: {finding}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Lab image size/layer report and cold-pull benchmark")
+    parser.add_argument("--target", nargs="+", default=["net", "full"], help="Dockerfile stages, one per variant")
+    parser.add_argument("--baseline", help="git revision whose image/Dockerfile to compare against")
+    parser.add_argument("--registry", help="local registry (e.g. localhost:5000) for the cold-pull timing")
+    parser.add_argument("--output", help="also write the report as JSON")
+    args = parser.parse_args(argv)
+
+    reports = {"current": report(DOCKERFILE, "current", args.target, args.registry)}
+    if args.baseline:
+        with tempfile.NamedTemporaryFile("w", suffix=".Dockerfile") as baseline_file:
+            baseline_file.write(subprocess.run(["git", "show", f"{args.baseline}:./image/Dockerfile"], cwd=HERE,
+                                               check=True, text=True, stdout=subprocess.PIPE).stdout)
+            baseline_file.flush()
+            reports[args.baseline] = report(baseline_file.name, args.baseline, args.target, args.registry)
+
+    print_report(reports, args.target)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(reports, output_file, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,14 @@
+import hashlib
+
+IMAGE_INPUTS = ["./image/Dockerfile", "./image/requirements.txt"]
+
+
+# Tag derived from everything that goes into the lab image
+def content_tag(paths=IMAGE_INPUTS, extra=""):
+    digest = hashlib.sha256(extra.encode("utf-8"))
+    for path in paths:
+        with open(path, "rb") as image_input:
+            digest.update(path.encode("utf-8"))
+            digest.update(image_input.read())
+    return digest.hexdigest()[:16]
+
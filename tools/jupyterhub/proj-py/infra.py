@@ -1,352 +1,995 @@
 import base64
 import json
-# import yaml
+import pulumi
 import pulumi_aws as aws
 import pulumi_docker as docker
 import pulumi_kubernetes as k8s
 from pulumi import ResourceOptions
-from pulumi_command import local
-from pulumi_kubernetes.helm.v3 import Chart, ChartOpts, FetchOpts
-from utils import data, generate_kube_config, gh_client_id, gh_client_secret, values_tpl
-
-# AWS-EKS (K8s) Connection Setup
-lab_cluster = aws.eks.get_cluster(name=data.get("eks-cluster"))
-
-lab_cluster_authn = aws.eks.get_cluster_auth(name=data.get("eks-cluster"))
-
-k8s_provider = k8s.Provider(
-                   "k8s-provider",
-                   kubeconfig=generate_kube_config(
-                                server=lab_cluster.endpoint,
-                                cert=lab_cluster.certificate_authorities[0].data,
-                                token=lab_cluster_authn.token
-                              )
-                   )
+from pulumi_kubernetes.helm.v3 import Chart, ChartOpts, FetchOpts, Release, ReleaseArgs, RepositoryOptsArgs
+from capacity import warm_capacity
+from catalog import load_catalog
+from chart_values import lab_chart_values
+from fleet import LabClusterDeployment, assign_learners, ecr_registry, fleet_clusters, home_region, hub_host, region_provider
+from images import content_tag
+from ingress import ingress_annotations, ingress_settings, wait_ready
+from lookups import acm_certificate, alb_zone, ecr_token, eks_cluster, eks_cluster_auth, latest_digest, pushed_digest, route53_zone
+from shared_cache import POST_START_LINK_DATA, cache_volume, populate_script, shared_cache_settings, singleuser_cache_values
+from monitoring import alert_rules, dashboard_json, metrics_token, monitoring_settings
+from registry import REGCRED_REFRESH_SCHEDULE, dockerconfigjson, image_pull_auth, lifecycle_policy, mirrored, pull_through_rules, regcred_refresh_script
+from node_pools import autoscaler_settings, autoscaler_values, node_pool_settings, pool_labels, pool_taints, schedule_profiles, USER_TOLERATION
+from rightsizing import DEFAULT_NODE, capacity_report, load_usage, right_size, tenant_quota
+from tenants import DEFAULT_TRUST_ROLES, LabTenant, load_roster, spec_hash, tenant_namespace, trust_groups, trust_policy
+from tracing import span, traced
+from utils import data, generate_kube_config, github_credentials, hub_extension, idle_culling, spawn_admission
+
+# "exec" refreshes short-lived EKS tokens through the AWS CLI, "token" embeds one
+lab_kubeconfig_auth = data.get("kubeconfig-auth", "exec")
+
+# Clusters (and regions) the lab is deployed to, the first one is the primary
+lab_fleet = fleet_clusters(data)
+
+lab_home_region = home_region()
+
+lab_regions = sorted({cluster["region"] for cluster in lab_fleet})
+
+# Shared ALB ingress groups, alias DNS records and readiness polling
+lab_ingress = ingress_settings(data)
 
 # AWS ECR Image Repository
 ecr_repo = aws.ecr.Repository(
                "ecr-repo",
                name=data.get("ecr-repo"),
                force_delete=False,
-               image_tag_mutability="MUTABLE",
+               image_tag_mutability="IMMUTABLE",
                tags=data.get("tags")
            )
 
-ecr_token = aws.ecr.get_authorization_token(registry_id=data.get("account"))
+ecr_lifecycle = aws.ecr.LifecyclePolicy(
+                    "ecr-lifecycle",
+                    repository=ecr_repo.name,
+                    policy=lifecycle_policy(data)
+                )
+
 
-ecr_username = base64.b64decode(ecr_token.authorization_token).decode('utf-8').split(':')[0]
+def ecr_credentials(region):
+    return ecr_token(region).authorization_token.apply(
+               lambda token: base64.b64decode(token).decode('utf-8').split(':')
+           )
 
-ecr_password = base64.b64decode(ecr_token.authorization_token).decode('utf-8').split(':')[1]
 
-ecr_configjson = json.dumps({
-    "auths": {
-        f"{data.get('account')}.dkr.ecr.us-west-2.amazonaws.com/{data.get('account')}": {
-            "username": f"{ecr_username}",
-            "password": f"{ecr_password}"
-        }
-    }
-})
+# Lab images are pushed once to the home region and replicated to the fleet's other regions
+lab_replica_regions = [region for region in lab_regions if region != lab_home_region]
+
+if lab_replica_regions:
+    ecr_replication = aws.ecr.ReplicationConfiguration(
+                          "ecr-replication",
+                          replication_configuration=aws.ecr.ReplicationConfigurationReplicationConfigurationArgs(
+                              rules=[aws.ecr.ReplicationConfigurationReplicationConfigurationRuleArgs(
+                                  destinations=[
+                                      aws.ecr.ReplicationConfigurationReplicationConfigurationRuleDestinationArgs(
+                                          region=region,
+                                          registry_id=data.get("account")
+                                      )
+                                      for region in lab_replica_regions
+                                  ],
+                                  repository_filters=[
+                                      aws.ecr.ReplicationConfigurationReplicationConfigurationRuleRepositoryFilterArgs(
+                                          filter=data.get("ecr-repo"),
+                                          filter_type="PREFIX_MATCH"
+                                      )
+                                  ]
+                              )]
+                          )
+                      )
 
-ecr_pull_secret = k8s.core.v1.Secret(
-                      "ecr-docker-config",
-                      type="kubernetes.io/dockerconfigjson",
-                      metadata=k8s.meta.v1.ObjectMetaArgs(
-                                   name="regcred",
-                                   namespace=data.get("namespace")
+# Pull-through cache rules, per region, so helper images are pulled from a nearby ECR
+lab_pull_through = pull_through_rules(data)
+
+lab_pull_auth = image_pull_auth(data)
+
+for region in lab_regions:
+    for prefix, rule in lab_pull_through.items():
+        aws.ecr.PullThroughCacheRule(
+            f"ecr-pull-through-{prefix}" + ("" if region == lab_home_region else f"-{region}"),
+            ecr_repository_prefix=prefix,
+            upstream_registry_url=rule["upstream"],
+            opts=ResourceOptions(provider=region_provider(region))
+        )
+
+# Lab courses, modules and image variants
+with span("catalog.load"):
+    lab_catalog = load_catalog(data.get("catalog", "./catalog.yaml"))
+
+# Lab images, one per catalog variant, tagged by the digest of their build
+# inputs. Every variant keeps its Image resource; a tag some other stack
+# already pushed is built without pushing (the repository's tags are
+# IMMUTABLE), from its own pushed layers as cache so no build step runs.
+# skip_push and the cache sources are decided when the Image is created and
+# ignored afterwards, so the next up does not rebuild because a push exists.
+# Since a tag names one build and cannot be overwritten, the chart values
+# pin repo:tag; the digests are exported as image_names.
+jupyter_repo_url = f"{ecr_registry(data.get('account'), lab_home_region)}/{data.get('ecr-repo')}"
+
+jupyter_img_cache = latest_digest(data.get("ecr-repo"), lab_home_region).apply(
+                        lambda digest: [f"{jupyter_repo_url}@{digest}"] if digest else []
+                    )
+
+jupyter_img_tags = {}
+
+jupyter_img_names = {}
+
+# Everything that runs a lab image waits for these
+jupyter_imgs = []
+
+for variant, variant_build in lab_catalog.images.items():
+    variant_notebooks = lab_catalog.variant_notebooks(variant)
+    variant_tag = content_tag(extra=f"{variant_build['target']} {variant_notebooks}")
+    variant_digest = pushed_digest(data.get("ecr-repo"), variant_tag, lab_home_region)
+    jupyter_img_tags[variant] = variant_tag
+    jupyter_img = docker.Image(
+                         f"lab-img-{variant}",
+                         build=docker.DockerBuildArgs(
+                                   dockerfile="./image/Dockerfile",
+                                   platform="linux/amd64",
+                                   target=variant_build["target"],
+                                   builder_version=docker.BuilderVersion.BUILDER_BUILD_KIT,
+                                   # Inline cache metadata makes every pushed tag a registry-backed layer cache
+                                   args={"BUILDKIT_INLINE_CACHE": "1", "NOTEBOOK_REPOS": variant_notebooks},
+                                   cache_from=docker.CacheFromArgs(images=pulumi.Output.all(variant_digest, jupyter_img_cache).apply(
+                                                  lambda refs: [f"{jupyter_repo_url}@{refs[0]}"] * bool(refs[0]) + refs[1]
+                                              ))
                                ),
-                      data={
-                                ".dockerconfigjson": f"{base64.b64encode(ecr_configjson.encode('utf-8')).decode('utf-8')}"
-                           },
-                      opts=ResourceOptions(provider=k8s_provider)
+                         image_name=ecr_repo.repository_url.apply(lambda repository_url, tag=variant_tag: f"{repository_url}:{tag}"),
+                         skip_push=variant_digest.apply(lambda digest: digest is not None),
+                         registry=docker.RegistryArgs(
+                                         username=ecr_credentials(lab_home_region)[0],
+                                         password=ecr_credentials(lab_home_region)[1],
+                                         server=ecr_repo.repository_url,
+                                  ),
+                         opts=ResourceOptions(ignore_changes=["skipPush", "build.cacheFrom"])
                   )
+    jupyter_imgs.append(jupyter_img)
+    # The already pushed digest, or the one this Image pushed
+    jupyter_img_names[variant] = traced(
+                                     "docker.build_push",
+                                     pulumi.Output.all(variant_digest, jupyter_img.repo_digest).apply(
+                                         lambda digests: f"{jupyter_repo_url}@{digests[0]}" if digests[0] else digests[1]
+                                     ),
+                                     variant=variant
+                                 )
+
+jupyter_img_tag = jupyter_img_tags[lab_catalog.default_image]
 
-jupyter_img = docker.Image(
-                     "lab-img",
-                     build=docker.DockerBuildArgs(dockerfile="./image/Dockerfile", platform="linux/amd64"),
-                     image_name=ecr_repo.repository_url.apply(lambda repository_url: f"{repository_url}:latest"),
-                     registry=docker.RegistryArgs(
-                                     username=ecr_username,
-                                     password=ecr_password,
-                                     server=ecr_repo.repository_url,
-                              )
-              )
-
-# Additional AWS-EKS service(s)/plugin(s)
-aws_autoscaler = Chart(
-                 "cluster-autoscaler",
-                 ChartOpts(
-                     chart="cluster-autoscaler",
-                     fetch_opts=FetchOpts(
-                        repo="https://kubernetes.github.io/autoscaler"
-                     ),
-                     namespace="kube-system",
-                     values={
-                         "cloudProvider": "aws",
-                         "awsRegion": "us-west-2",
-                         "autoDiscovery": {
-                             "enabled": "true",
-                             "clusterName": f"{data.get('eks-cluster')}",
-                         },
-                         "podLabels": {
-                             "app": "cluster-autoscaler"
-                         }
-                     }
-                 )
-                 )
-
-# JupyterHub Deployment Prerequisites
-gh_creds = k8s.core.v1.Secret(
-               "gh-credentials",
-               type="Opaque",
-               metadata=k8s.meta.v1.ObjectMetaArgs(
-                            name=data.get("gh-secret"),
-                            namespace=data.get("namespace")
-                            ),
-               data={
-                        "id": f"{base64.b64encode(gh_client_id.encode('utf-8')).decode('utf-8')}",
-                        "secret": f"{base64.b64encode(gh_client_secret.encode('utf-8')).decode('utf-8')}"
-                    },
-               opts=ResourceOptions(provider=k8s_provider)
+# User-specific environment setup
+lab_roster = load_roster(data)
+
+lab_tenant_svc_account = f"{data.get('user-svc-account')}-svc-account"
+
+# Namespaces that already exist on the primary cluster (the single-tenant
+# setup's "user-namespace"), read rather than created
+lab_existing_namespaces = data.get("existing-namespaces", [data.get("user-namespace")])
+
+# Top-level names the single-tenant setup gave the legacy tenant's resources
+lab_moved_tenant = {
+    "service-account": f"{data.get('user-svc-account')}-service-account",
+    "role": f"{data.get('user-svc-account')}-role",
+    "role-binding": f"{data.get('user-svc-account')}-role-binding",
+    "quota": "lab-quota",
+}
+
+# Learners spread over the fleet by cluster capacity
+lab_assignments = assign_learners(lab_roster, lab_fleet)
+
+# Dedicated (spot and on-demand) lab node pools and autoscaler tuning
+lab_node_pools = node_pool_settings(data)
+
+lab_autoscaler = autoscaler_settings(data)
+
+# Module requests/limits right-sized from measured usage, when samples are provided
+lab_usage = load_usage(data.get("usage-samples")) if data.get("usage-samples") else None
+
+
+def lab_profiles(repo_url):
+    profiles = lab_catalog.resolve_images(
+                   {variant: f"{repo_url}:{tag}" for variant, tag in jupyter_img_tags.items()}
                )
+    if lab_usage:
+        profiles = right_size(profiles, lab_usage)
+    # Course capacity (spot/on-demand) only means something on the lab node pools
+    return schedule_profiles(profiles, lab_catalog.scheduling) if lab_node_pools else profiles
 
 
+lab_quota = data.get("quota") or lab_catalog.quota or None
 
-jupyter_crole = k8s.rbac.v1.ClusterRole(
-                    f"{data.get('chart-name')}-cluster-role",
-                    metadata=k8s.meta.v1.ObjectMetaArgs(name=f"{data.get('chart-name')}-cluster-role"),
-                    rules=[
-                        {
-                            "apiGroups": ["*"],
-                            "resources": ["*"],
-                            "verbs": [
-                                "get",
-                                "list",
-                                "watch",
-                                "create",
-                                "update",
-                                "patch",
-                                "delete"
-                            ],
-                        }
-                    ],
-                    opts=ResourceOptions(provider=k8s_provider)
-                )
+lab_sizing_report = None
 
-jupyter_svc_account = k8s.core.v1.ServiceAccount(f"{data.get('chart-name')}-service-account",
-                          metadata=k8s.meta.v1.ObjectMetaArgs(
-                                       name=f"{data.get('chart-name')}-svc-account",
-                                       namespace=f"{data.get('namespace')}"
-                                   ),
-                          opts=ResourceOptions(provider=k8s_provider)
-                      )
+if lab_usage:
+    lab_quota = data.get("quota") or tenant_quota(lab_profiles(jupyter_repo_url), pods=int(data.get("tenant-pods", 3)))
+    lab_sizing_report = capacity_report(
+                            lab_catalog.resolve_images({variant: "" for variant in jupyter_img_tags}),
+                            lab_profiles(jupyter_repo_url),
+                            node=data.get("node-size", DEFAULT_NODE)
+                        )
+    pulumi.log.info(f"Projected nodes per {lab_sizing_report['learners']} learners: "
+                    f"{lab_sizing_report['nodes_before']} -> {lab_sizing_report['nodes_after']}")
 
-jupyter_crbinding = k8s.rbac.v1.ClusterRoleBinding(
-    f"{data.get('chart-name')}-crole-binding",
-    metadata=k8s.meta.v1.ObjectMetaArgs(
-                 name=f"{data.get('chart-name')}-crole-binding",
-                 namespace=f"{data.get('namespace')}"
-             ),
-    subjects=[k8s.rbac.v1.SubjectArgs(
-        kind="ServiceAccount",
-        name=f"{data.get('chart-name')}-svc-account",
-        namespace=f"{data.get('namespace')}",
-    )],
-    role_ref=k8s.rbac.v1.RoleRefArgs(
-        api_group="rbac.authorization.k8s.io",
-        kind="ClusterRole",
-        name=jupyter_crole.metadata["name"],
-    ),
-    opts=ResourceOptions(provider=k8s_provider),
-)
+# Spawn admission queue replacing the fixed concurrent_spawn_limit
+admission_config, spawn_limit, spawn_start_timeout = spawn_admission(data)
 
-# User-specific environment setup
-lab_cluster_oidc = lab_cluster.identities[0].oidcs[0].issuer
-
-lab_s3_access_role = aws.iam.Role(
-                         "lab-s3-access-role",
-                         assume_role_policy=f"""{{
-                            "Version": "2012-10-17",
-                            "Statement": [
-                                {{
-                                    "Effect": "Allow",
-                                    "Principal": {{
-                                        "Federated": "arn:aws:iam::{data.get("account")}:oidc-provider/{lab_cluster_oidc.replace('https://','')}"
-                                    }},
-                                    "Action": "sts:AssumeRoleWithWebIdentity",
-                                    "Condition": {{
-                                        "StringEquals": {{
-                                            "{lab_cluster_oidc.replace('https://','')}:aud": "sts.amazonaws.com",
-                                            "{lab_cluster_oidc.replace('https://','')}:sub": "system:serviceaccount:{data.get("user-namespace")}:{data.get("user-svc-account")}-svc-account"
-                                        }}
-                                    }}
-                                }}
-                            ]                         
-                         }}""",
-                     )
+# Idle culling with a timeout per profile
+culling_config, cull_config = idle_culling(data)
+
+# Hub metrics, dashboards and alert rules
+lab_monitoring = monitoring_settings(data)
+
+# Shared read-only cache of wheels and datasets mounted into every lab pod
+lab_shared_cache = shared_cache_settings(data)
+
+with open("./image/requirements.txt") as requirements_file:
+    lab_cache_version, lab_cache_script = populate_script(
+                                              lab_shared_cache,
+                                              [line.strip() for line in requirements_file if line.strip()]
+                                          )
 
-lab_s3_access_policy = aws.iam.RolePolicyAttachment("lab-s3-access-policy",
-                           role=lab_s3_access_role.name,
-                           policy_arn="arn:aws:iam::aws:policy/AmazonS3FullAccess",
+lab_zone = route53_zone()
+
+
+# Everything one cluster runs: providers, hub prerequisites, tenants and the
+# hub release. Clusters share no resources with each other, so Pulumi
+# deploys them concurrently.
+def deploy_lab_cluster(cluster, learners):
+    sfx = cluster["suffix"]
+    region = cluster["region"]
+
+    # AWS-EKS (K8s) Connection Setup
+    lab_cluster = eks_cluster(cluster["name"], region)
+
+    if lab_kubeconfig_auth == "token":
+        lab_kubeconfig = pulumi.Output.all(
+                             lab_cluster.endpoint,
+                             lab_cluster.certificate_authorities[0].data,
+                             eks_cluster_auth(cluster["name"], region).token
+                         ).apply(lambda args: generate_kube_config(server=args[0], cert=args[1], token=args[2]))
+    else:
+        lab_kubeconfig = pulumi.Output.all(
+                             lab_cluster.endpoint,
+                             lab_cluster.certificate_authorities[0].data
+                         ).apply(lambda args: generate_kube_config(
+                                                  server=args[0],
+                                                  cert=args[1],
+                                                  cluster_name=cluster["name"],
+                                                  region=region
+                                              ))
+
+    # Single provider, and so a single client connection pool, for every k8s resource
+    k8s_provider = k8s.Provider(
+                       f"k8s-provider{sfx}",
+                       kubeconfig=lab_kubeconfig
                        )
 
-lab_svc_account = k8s.core.v1.ServiceAccount(f"{data.get('user-svc-account')}-service-account",
-                      metadata=k8s.meta.v1.ObjectMetaArgs(
-                                   annotations={
-                                        "eks.amazonaws.com/role-arn": lab_s3_access_role.arn
+    # Pulls come from the cluster's own region, replicated from the home registry
+    registry = ecr_registry(data.get("account"), region)
+
+    repo_url = f"{registry}/{data.get('ecr-repo')}"
+
+    lab_pull_deps = []
+
+    # Nodes authenticate to ECR through their instance role, no secret to expire
+    if cluster["node_role"]:
+        lab_node_ecr_read = aws.iam.RolePolicyAttachment(f"lab-node-ecr-read{sfx}",
+                                role=cluster["node_role"],
+                                policy_arn="arn:aws:iam::aws:policy/AmazonEC2ContainerRegistryReadOnly",
+                            )
+        if lab_pull_through:
+            # First pull of an upstream image creates its cache repository
+            lab_node_pull_through = aws.iam.RolePolicy(f"lab-node-ecr-pull-through{sfx}",
+                                        role=cluster["node_role"],
+                                        policy=json.dumps({
+                                            "Version": "2012-10-17",
+                                            "Statement": [{
+                                                "Effect": "Allow",
+                                                "Action": ["ecr:CreateRepository", "ecr:BatchImportUpstreamImage"],
+                                                "Resource": f"arn:aws:ecr:{region}:{data.get('account')}:repository/*"
+                                            }]
+                                        })
+                                    )
+
+    if lab_pull_auth == "secret":
+        ecr_configjson = ecr_credentials(region).apply(
+                             lambda creds: dockerconfigjson(registry, creds[0], creds[1])
+                         )
+
+        # Seeds the hub namespace, the regcred refresher keeps it (and lab-* copies) current
+        ecr_pull_secret = k8s.core.v1.Secret(
+                              f"ecr-docker-config{sfx}",
+                              type="kubernetes.io/dockerconfigjson",
+                              metadata=k8s.meta.v1.ObjectMetaArgs(
+                                           name="regcred",
+                                           namespace=data.get("namespace")
+                                       ),
+                              data={
+                                        ".dockerconfigjson": ecr_configjson.apply(
+                                                                 lambda cfg: base64.b64encode(cfg.encode('utf-8')).decode('utf-8')
+                                                             )
                                    },
-                                   name=f"{data.get('user-svc-account')}-svc-account",
-                                   namespace=f"{data.get('user-namespace')}"
-                               ),
-                      opts=ResourceOptions(provider=k8s_provider)
-                  )
+                              opts=ResourceOptions(provider=k8s_provider)
+                          )
+        lab_pull_deps.append(ecr_pull_secret)
+
+    lab_pull_secrets = [k8s.core.v1.LocalObjectReferenceArgs(name="regcred")] if lab_pull_auth == "secret" else None
+
+    # Dedicated lab node pools (EKS managed node groups), tainted so only learner pods land there
+    if lab_node_pools and not cluster["node_role"]:
+        raise ValueError(f"node-pools need a node-role for cluster {cluster['name']}")
+
+    for pool in lab_node_pools:
+        aws.eks.NodeGroup(
+            f"lab-pool-{pool['name']}{sfx}",
+            cluster_name=cluster["name"],
+            node_group_name=f"lab-{pool['name']}",
+            node_role_arn=f"arn:aws:iam::{data.get('account')}:role/{cluster['node_role']}",
+            subnet_ids=lab_cluster.vpc_config.subnet_ids,
+            capacity_type=pool["capacity-type"],
+            instance_types=pool["instance-types"],
+            disk_size=int(pool["disk-size"]),
+            scaling_config=aws.eks.NodeGroupScalingConfigArgs(
+                               min_size=int(pool["min"]),
+                               max_size=int(pool["max"]),
+                               desired_size=int(pool["min"])
+                           ),
+            labels=pool_labels(pool),
+            taints=[aws.eks.NodeGroupTaintArgs(**taint) for taint in pool_taints(pool)],
+            tags=data.get("tags"),
+            # The autoscaler owns the size once the pool exists
+            opts=ResourceOptions(provider=region_provider(region), ignore_changes=["scalingConfig.desiredSize"])
+        )
+
+    # Additional AWS-EKS service(s)/plugin(s)
+    aws_autoscaler = Chart(
+                     f"cluster-autoscaler{sfx}",
+                     ChartOpts(
+                         chart="cluster-autoscaler",
+                         fetch_opts=FetchOpts(
+                            repo="https://kubernetes.github.io/autoscaler"
+                         ),
+                         namespace="kube-system",
+                         values=autoscaler_values(cluster["name"], region, lab_node_pools, lab_autoscaler)
+                     ),
+                     opts=ResourceOptions(provider=k8s_provider)
+                     )
 
-lab_svc_role = k8s.rbac.v1.Role(f"{data.get('user-svc-account')}-role",
+    # JupyterHub Deployment Prerequisites, with the GitHub OAuth app whose callback is this hub's host
+    gh_client_id, gh_client_secret = github_credentials(cluster)
+
+    gh_creds = k8s.core.v1.Secret(
+                   f"gh-credentials{sfx}",
+                   type="Opaque",
                    metadata=k8s.meta.v1.ObjectMetaArgs(
-                                name=f"{data.get('user-svc-account')}-role",
-                                namespace=f"{data.get('user-namespace')}"
-                   ),
-                   rules=[
-                        {
-                            "apiGroups": ["*"],
-                            "resources": [
-                                "pods",
-                                "secrets",
-                                "configmaps",
-                                "services"
-                            ],
-                            "verbs": [
-                                "get",
-                                "list",
-                                "watch",
-                                "create",
-                                "update",
-                                "patch",
-                                "delete"
-                            ],
-                        }
-                   ],
+                                name=data.get("gh-secret"),
+                                namespace=data.get("namespace")
+                                ),
+                   data={
+                            "id": f"{base64.b64encode(gh_client_id.encode('utf-8')).decode('utf-8')}",
+                            "secret": f"{base64.b64encode(gh_client_secret.encode('utf-8')).decode('utf-8')}"
+                        },
                    opts=ResourceOptions(provider=k8s_provider)
-               )
+                   )
 
-lab_svc_rbinding = k8s.rbac.v1.RoleBinding(
-    f"{data.get('user-svc-account')}-role-binding",
-    metadata=k8s.meta.v1.ObjectMetaArgs(
-                 name=f"{data.get('user-svc-account')}-role-binding",
-                 namespace=f"{data.get('user-namespace')}"
-             ),
-    subjects=[k8s.rbac.v1.SubjectArgs(
-        kind="ServiceAccount",
-        name=f"{data.get('user-svc-account')}-svc-account",
-        namespace=f"{data.get('user-namespace')}",
-    )],
-    role_ref=k8s.rbac.v1.RoleRefArgs(
-        api_group="rbac.authorization.k8s.io",
-        kind="Role",
-        name=lab_svc_role.metadata["name"],
-    ),
-    opts=ResourceOptions(provider=k8s_provider),
-)
-
-lab_quota = k8s.core.v1.ResourceQuota(
-                "lab-quota",
-                metadata=k8s.meta.v1.ObjectMetaArgs(
-                             namespace=f"{data.get('user-namespace')}",
-                ),
-                spec=k8s.core.v1.ResourceQuotaSpecArgs(
-                         hard={
-                                "pods": "3",
-                                "requests.memory": "5Gi",
-                         }
+    jupyter_crole = k8s.rbac.v1.ClusterRole(
+                        f"{data.get('chart-name')}-cluster-role{sfx}",
+                        metadata=k8s.meta.v1.ObjectMetaArgs(name=f"{data.get('chart-name')}-cluster-role"),
+                        rules=[
+                            {
+                                "apiGroups": ["*"],
+                                "resources": ["*"],
+                                "verbs": [
+                                    "get",
+                                    "list",
+                                    "watch",
+                                    "create",
+                                    "update",
+                                    "patch",
+                                    "delete"
+                                ],
+                            }
+                        ],
+                        opts=ResourceOptions(provider=k8s_provider)
+                    )
+
+    jupyter_svc_account = k8s.core.v1.ServiceAccount(f"{data.get('chart-name')}-service-account{sfx}",
+                              metadata=k8s.meta.v1.ObjectMetaArgs(
+                                           name=f"{data.get('chart-name')}-svc-account",
+                                           namespace=f"{data.get('namespace')}"
+                                       ),
+                              opts=ResourceOptions(provider=k8s_provider)
+                          )
+
+    jupyter_crbinding = k8s.rbac.v1.ClusterRoleBinding(
+        f"{data.get('chart-name')}-crole-binding{sfx}",
+        metadata=k8s.meta.v1.ObjectMetaArgs(
+                     name=f"{data.get('chart-name')}-crole-binding",
+                     namespace=f"{data.get('namespace')}"
+                 ),
+        subjects=[k8s.rbac.v1.SubjectArgs(
+            kind="ServiceAccount",
+            name=f"{data.get('chart-name')}-svc-account",
+            namespace=f"{data.get('namespace')}",
+        )],
+        role_ref=k8s.rbac.v1.RoleRefArgs(
+            api_group="rbac.authorization.k8s.io",
+            kind="ClusterRole",
+            name=jupyter_crole.metadata["name"],
+        ),
+        opts=ResourceOptions(provider=k8s_provider),
+    )
+
+    # User-specific environment setup
+    lab_cluster_oidc = lab_cluster.identities[0].oidcs[0].issuer
+
+    # IRSA roles tenants are spread over by a stable hash, each trusting exactly its tenants' service accounts
+    lab_tenant_roles = {}
+
+    lab_group_roles = {}
+
+    for index, namespaces in trust_groups(data.get("account"), region, lab_tenant_svc_account,
+                                          [tenant_namespace(username) for username in learners],
+                                          roles=int(data.get("irsa-roles", DEFAULT_TRUST_ROLES))).items():
+        group_sfx = f"{sfx}-{index}" if index else sfx
+        lab_group_role = aws.iam.Role(
+                             f"lab-s3-access-role{group_sfx}",
+                             assume_role_policy=lab_cluster_oidc.apply(
+                                 lambda issuer, namespaces=namespaces: trust_policy(
+                                                    account=data.get("account"),
+                                                    issuer=issuer,
+                                                    svc_account=lab_tenant_svc_account,
+                                                    namespaces=namespaces
+                                                )
+                             ),
+                         )
+
+        aws.iam.RolePolicyAttachment(f"lab-s3-access-policy{group_sfx}",
+            role=lab_group_role.name,
+            policy_arn="arn:aws:iam::aws:policy/AmazonS3FullAccess",
+        )
+
+        lab_tenant_roles.update({namespace: lab_group_role for namespace in namespaces})
+
+        lab_group_roles[index] = lab_group_role
+
+    # A cluster without learners has no roles
+    lab_s3_access_role = lab_group_roles[min(lab_group_roles)] if lab_group_roles else None
+
+    # Pull-secret mode: refresh regcred before the 12 hour ECR token expires
+    if lab_pull_auth == "secret":
+        regcred_role = aws.iam.Role(
+                           f"regcred-refresher-role{sfx}",
+                           assume_role_policy=lab_cluster_oidc.apply(
+                               lambda issuer: trust_policy(
+                                                  account=data.get("account"),
+                                                  issuer=issuer,
+                                                  svc_account="regcred-refresher",
+                                                  namespaces=[data.get("namespace")]
+                                              )
+                           ),
+                       )
+
+        regcred_policy = aws.iam.RolePolicyAttachment(f"regcred-refresher-policy{sfx}",
+                             role=regcred_role.name,
+                             policy_arn="arn:aws:iam::aws:policy/AmazonEC2ContainerRegistryReadOnly",
+                         )
+
+        regcred_svc_account = k8s.core.v1.ServiceAccount(f"regcred-refresher{sfx}",
+                                  metadata=k8s.meta.v1.ObjectMetaArgs(
+                                               name="regcred-refresher",
+                                               namespace=data.get("namespace"),
+                                               annotations={"eks.amazonaws.com/role-arn": regcred_role.arn}
+                                           ),
+                                  opts=ResourceOptions(provider=k8s_provider)
+                              )
+
+        regcred_crole = k8s.rbac.v1.ClusterRole(
+                            f"regcred-refresher{sfx}",
+                            metadata=k8s.meta.v1.ObjectMetaArgs(name="regcred-refresher"),
+                            rules=[
+                                {"apiGroups": [""], "resources": ["namespaces"], "verbs": ["list"]},
+                                {"apiGroups": [""], "resources": ["secrets"], "verbs": ["get", "create", "patch"]},
+                            ],
+                            opts=ResourceOptions(provider=k8s_provider)
+                        )
+
+        regcred_crbinding = k8s.rbac.v1.ClusterRoleBinding(
+            f"regcred-refresher{sfx}",
+            metadata=k8s.meta.v1.ObjectMetaArgs(name="regcred-refresher"),
+            subjects=[k8s.rbac.v1.SubjectArgs(
+                kind="ServiceAccount",
+                name="regcred-refresher",
+                namespace=data.get("namespace"),
+            )],
+            role_ref=k8s.rbac.v1.RoleRefArgs(
+                api_group="rbac.authorization.k8s.io",
+                kind="ClusterRole",
+                name=regcred_crole.metadata["name"],
+            ),
+            opts=ResourceOptions(provider=k8s_provider),
+        )
+
+        regcred_pod = k8s.core.v1.PodSpecArgs(
+                          service_account_name="regcred-refresher",
+                          restart_policy="OnFailure",
+                          volumes=[k8s.core.v1.VolumeArgs(
+                              name="token",
+                              empty_dir=k8s.core.v1.EmptyDirVolumeSourceArgs(medium="Memory")
+                          )],
+                          init_containers=[k8s.core.v1.ContainerArgs(
+                              name="token",
+                              image=mirrored("amazon/aws-cli:2.13.0", registry, lab_pull_through),
+                              command=["sh", "-c", f"aws ecr get-login-password --region {region} > /token/password"],
+                              volume_mounts=[k8s.core.v1.VolumeMountArgs(name="token", mount_path="/token")]
+                          )],
+                          containers=[k8s.core.v1.ContainerArgs(
+                              name="apply",
+                              image=mirrored("bitnami/kubectl:1.25", registry, lab_pull_through),
+                              command=["sh", "-c", regcred_refresh_script(registry, data.get("namespace"))],
+                              volume_mounts=[k8s.core.v1.VolumeMountArgs(name="token", mount_path="/token")]
+                          )]
+                      )
+
+        regcred_refresher = k8s.batch.v1.CronJob(
+            f"regcred-refresher{sfx}",
+            metadata=k8s.meta.v1.ObjectMetaArgs(
+                         name="regcred-refresher",
+                         namespace=data.get("namespace")
+                     ),
+            spec=k8s.batch.v1.CronJobSpecArgs(
+                     schedule=REGCRED_REFRESH_SCHEDULE,
+                     concurrency_policy="Replace",
+                     job_template=k8s.batch.v1.JobTemplateSpecArgs(
+                         spec=k8s.batch.v1.JobSpecArgs(
+                             backoff_limit=3,
+                             template=k8s.core.v1.PodTemplateSpecArgs(spec=regcred_pod)
+                         )
                      )
+                 ),
+            opts=ResourceOptions(provider=k8s_provider, depends_on=[regcred_svc_account, regcred_crbinding, regcred_policy])
+        )
+
+    lab_tenants = [
+        LabTenant(
+            username,
+            svc_account=lab_tenant_svc_account,
+            role_arn=lab_tenant_roles[tenant_namespace(username)].arn,
+            hub_namespace=data.get("namespace"),
+            quota=lab_quota,
+            existing_namespace=not sfx and tenant_namespace(username) in lab_existing_namespaces,
+            moved=lab_moved_tenant if not sfx and tenant_namespace(username) == data.get("user-namespace") else None,
+            opts=ResourceOptions(providers=[k8s_provider])
+        )
+        for username in learners
+    ]
+
+    for tenant in lab_tenants:
+        traced("tenant.ready", tenant.ready, cluster=cluster["key"], tenant=tenant.username)
+
+    # The refresher's first run is up to 6 hours away: the same pod copies regcred
+    # into every namespace once the tenants exist, and again when the roster adds some
+    if lab_pull_auth == "secret":
+        k8s.batch.v1.Job(
+            f"regcred-seed{sfx}",
+            metadata=k8s.meta.v1.ObjectMetaArgs(
+                         name=f"regcred-seed-{spec_hash(sorted(tenant.namespace_name for tenant in lab_tenants))[:8]}",
+                         namespace=data.get("namespace")
+                     ),
+            spec=k8s.batch.v1.JobSpecArgs(
+                     backoff_limit=3,
+                     template=k8s.core.v1.PodTemplateSpecArgs(spec=regcred_pod)
+                 ),
+            opts=ResourceOptions(provider=k8s_provider,
+                                 depends_on=[regcred_svc_account, regcred_crbinding, regcred_policy, *lab_tenants])
+        )
+
+    # Existing namespaces carry no tenant label; the reaper (reaper.py) keeps the ones listed here
+    if not sfx and any(lab_existing_namespaces):
+        k8s.core.v1.ConfigMap(
+            "lab-adopted-namespaces",
+            metadata=k8s.meta.v1.ObjectMetaArgs(
+                         name="lab-adopted-namespaces",
+                         namespace=data.get("namespace"),
+                         labels={"ephemeral-labs/adopted-namespaces": "true"}
+                     ),
+            data={"namespaces": "\n".join(sorted(filter(None, lab_existing_namespaces)))},
+            opts=ResourceOptions(provider=k8s_provider)
+        )
+
+    # Service token Prometheus presents to /hub/metrics
+    lab_metrics_deps = []
+
+    lab_metrics_env = []
+
+    if lab_monitoring["enabled"] and lab_monitoring["authenticate"]:
+        lab_metrics_secret = k8s.core.v1.Secret(
+                                 f"lab-metrics-token{sfx}",
+                                 type="Opaque",
+                                 metadata=k8s.meta.v1.ObjectMetaArgs(
+                                              name="lab-metrics",
+                                              namespace=data.get("namespace")
+                                          ),
+                                 data={
+                                          "token": base64.b64encode(metrics_token(gh_client_secret).encode('utf-8')).decode('utf-8')
+                                      },
+                                 opts=ResourceOptions(provider=k8s_provider)
+                             )
+        lab_metrics_deps.append(lab_metrics_secret)
+        lab_metrics_env.append({
+            "name": "LAB_METRICS_TOKEN",
+            "valueFrom": {"secretKeyRef": {"name": "lab-metrics", "key": "token"}},
+        })
+
+    if lab_monitoring["enabled"]:
+        # Picked up by the Grafana dashboard sidecar from any namespace
+        lab_dashboard = k8s.core.v1.ConfigMap(
+                            f"lab-hub-dashboard{sfx}",
+                            metadata=k8s.meta.v1.ObjectMetaArgs(
+                                         name="lab-hub-dashboard",
+                                         namespace=data.get("namespace"),
+                                         labels={lab_monitoring["dashboard-label"]: "1"}
+                                     ),
+                            data={"lab-hub.json": dashboard_json(data.get("namespace"))},
+                            opts=ResourceOptions(provider=k8s_provider)
+                        )
+
+    if lab_monitoring["enabled"] and lab_monitoring["prometheus-operator"]:
+        lab_scrape_endpoint = {"port": "hub", "path": "/hub/metrics", "interval": "30s"}
+        if lab_monitoring["authenticate"]:
+            lab_scrape_endpoint["bearerTokenSecret"] = {"name": "lab-metrics", "key": "token"}
+
+        lab_service_monitor = k8s.apiextensions.CustomResource(
+                                  f"lab-hub-monitor{sfx}",
+                                  api_version="monitoring.coreos.com/v1",
+                                  kind="ServiceMonitor",
+                                  metadata=k8s.meta.v1.ObjectMetaArgs(
+                                               name="lab-hub",
+                                               namespace=data.get("namespace")
+                                           ),
+                                  spec={
+                                      "selector": {"matchLabels": {"app": "jupyterhub", "component": "hub"}},
+                                      "endpoints": [lab_scrape_endpoint],
+                                  },
+                                  opts=ResourceOptions(provider=k8s_provider, depends_on=lab_metrics_deps)
+                              )
+
+        lab_alert_rules = k8s.apiextensions.CustomResource(
+                              f"lab-hub-alerts{sfx}",
+                              api_version="monitoring.coreos.com/v1",
+                              kind="PrometheusRule",
+                              metadata=k8s.meta.v1.ObjectMetaArgs(
+                                           name="lab-hub",
+                                           namespace=data.get("namespace")
+                                       ),
+                              spec={"groups": alert_rules(data.get("namespace"), lab_monitoring["alerts"])},
+                              opts=ResourceOptions(provider=k8s_provider)
+                          )
+
+    # Warm capacity: user-placeholder pods sized from the cluster's learners, pre-pulled image
+    lab_warm_capacity = warm_capacity(data, len(learners))
+
+    lab_values = lab_chart_values(
+        data,
+        hub_host=hub_host(data, cluster),
+        image_name=repo_url,
+        image_tag=jupyter_img_tag,
+        placeholder_replicas=lab_warm_capacity["baseline_replicas"],
+        spawn_limit=spawn_limit,
+        start_timeout=spawn_start_timeout,
+        extensions={
+            "admission": (hub_extension("admission"), admission_config),
+            "culling": (hub_extension("culling"), culling_config),
+            "metrics": (hub_extension("metrics"), {"enabled": lab_monitoring["enabled"],
+                                                   "authenticate": lab_monitoring["authenticate"]}),
+        },
+        cull=cull_config,
+        profiles=lab_profiles(repo_url),
+        singleuser_extra=singleuser_cache_values(lab_shared_cache) if lab_shared_cache["enabled"] else None,
+        post_start=[POST_START_LINK_DATA] if lab_shared_cache["enabled"] else [],
+        pull_secrets=["regcred"] if lab_pull_auth == "secret" else [],
+        hub_extra_env=lab_metrics_env,
+        dedicated_user_nodes=bool(lab_node_pools),
+        # Learners log in on the hub of the cluster they were assigned to
+        allowed_users=learners if len(lab_fleet) > 1 else None
+    )
+
+    values_hash = lab_values.checksum()
+
+    # Optional on-disk copy for running helm by hand, the release takes the values in memory
+    if data.get("values-file"):
+        lab_values.write(data.get("values-file").replace(".yml", f"{sfx}.yml"))
+
+    # Removing the release (deploy: False) uninstalls the hub on the next "pulumi up".
+    # Helm diffs the values itself: unchanged values mean no upgrade. A hub
+    # installed by the old "helm upgrade --install" command has to be
+    # imported once before the first up (see the README), Helm refuses to
+    # install over a release name still in use.
+    jupyter_hub = None
+
+    if data.get("deploy") == True:
+        jupyter_hub = Release(
+                          f"jupyter-hub{sfx}",
+                          ReleaseArgs(
+                              name=data.get("chart-name"),
+                              chart=data.get("chart-name"),
+                              namespace=data.get("namespace"),
+                              repository_opts=RepositoryOptsArgs(
+                                  repo="https://jupyterhub.github.io/helm-chart/"
+                              ),
+                              values=lab_values.to_dict(),
+                              atomic=True,
+                              cleanup_on_fail=True,
+                              wait_for_jobs=True,
+                              timeout=data.get("helm-timeout", 600)
+                          ),
+                          opts=ResourceOptions(
+                              provider=k8s_provider,
+                              depends_on=[*lab_pull_deps, *jupyter_imgs, *lab_metrics_deps, gh_creds, jupyter_svc_account, jupyter_crbinding]
+                          )
+                      )
+        traced("helm.release", jupyter_hub.id, cluster=cluster["key"])
+
+    # Fill the shared cache once per version: on every node for hostPath, once for NFS
+    if lab_shared_cache["enabled"]:
+        lab_cache_pod = k8s.core.v1.PodSpecArgs(
+                            image_pull_secrets=lab_pull_secrets,
+                            # hostPath caches have to be filled on the lab pools too
+                            tolerations=[USER_TOLERATION] if lab_node_pools else None,
+                            volumes=[cache_volume(lab_shared_cache)],
+                            init_containers=[k8s.core.v1.ContainerArgs(
+                                name="populate",
+                                image=f"{repo_url}:{jupyter_img_tag}",
+                                security_context=k8s.core.v1.SecurityContextArgs(run_as_user=0),
+                                command=["sh", "-c", lab_cache_script],
+                                volume_mounts=[k8s.core.v1.VolumeMountArgs(name="lab-cache", mount_path="/cache")]
+                            )],
+                            containers=[k8s.core.v1.ContainerArgs(
+                                name="pause",
+                                image=mirrored("registry.k8s.io/pause:3.9", registry, lab_pull_through),
+                                resources=k8s.core.v1.ResourceRequirementsArgs(requests={"cpu": "1m", "memory": "8Mi"})
+                            )]
+                        )
+        lab_cache_labels = {"app": "lab-cache", "ephemeral-labs/cache-version": lab_cache_version}
+        if lab_shared_cache["mode"] == "nfs":
+            lab_cache_populate = k8s.batch.v1.Job(
+                f"lab-cache-populate-{lab_cache_version}{sfx}",
+                metadata=k8s.meta.v1.ObjectMetaArgs(namespace=data.get("namespace"), labels=lab_cache_labels),
+                spec=k8s.batch.v1.JobSpecArgs(
+                         backoff_limit=3,
+                         template=k8s.core.v1.PodTemplateSpecArgs(
+                             metadata=k8s.meta.v1.ObjectMetaArgs(labels=lab_cache_labels),
+                             spec=k8s.core.v1.PodSpecArgs(
+                                      restart_policy="OnFailure",
+                                      image_pull_secrets=lab_cache_pod.image_pull_secrets,
+                                      volumes=lab_cache_pod.volumes,
+                                      containers=lab_cache_pod.init_containers
+                                  )
+                         )
+                     ),
+                opts=ResourceOptions(provider=k8s_provider, depends_on=[*lab_pull_deps, *jupyter_imgs])
+            )
+        else:
+            lab_cache_populate = k8s.apps.v1.DaemonSet(
+                f"lab-cache-populate{sfx}",
+                metadata=k8s.meta.v1.ObjectMetaArgs(namespace=data.get("namespace")),
+                spec=k8s.apps.v1.DaemonSetSpecArgs(
+                         selector=k8s.meta.v1.LabelSelectorArgs(match_labels={"app": "lab-cache"}),
+                         template=k8s.core.v1.PodTemplateSpecArgs(
+                             metadata=k8s.meta.v1.ObjectMetaArgs(labels=lab_cache_labels),
+                             spec=lab_cache_pod
+                         )
+                     ),
+                opts=ResourceOptions(provider=k8s_provider, depends_on=[*lab_pull_deps, *jupyter_imgs])
             )
 
-values_render = values_tpl.format(
-    app_name=data.get('tags')['purpose'],
-    lab_name=data.get('chart-name'),
-    dns_zone=data.get('user-domain'),
-    secret_name=data.get('gh-secret'),
-    git_org=data.get('org-allow'),
-    hub_ns=data.get('namespace'),
-    svc_account=data.get('chart-name'),
-    usr_svc_account=data.get('user-svc-account'),
-    repo_url=f"{data.get('account')}.dkr.ecr.us-west-2.amazonaws.com/{data.get('ecr-repo')}"
-)
-
-with open("values.yml", "w") as config_file:
-    config_file.write(values_render)
-
-# Current Pulumi bug for helmv3:
-# - https://github.com/pulumi/pulumi-kubernetes/issues/555
-# jupyter_hub = Chart(
-#                      "jupyter-hub-deployment",
-#                      ChartOpts(
-#                          chart=data.get("chart-name"),
-#                          fetch_opts=FetchOpts(
-#                             repo="https://jupyterhub.github.io/helm-chart/"
-#                          ),
-#                          namespace=data.get("namespace")
-#                          values=yaml.safe_load(config_file)
-#                      )
-#               )
-
-if data.get("deploy") == True:
-    deploy_jupyter = local.Command(
-    # Increment "jupyter_install_#" to let helm run
-                     "jupyter-install-11",
-                     create=f"helm upgrade --install -n {data.get('namespace')} {data.get('chart-name')} {data.get('chart-name')}/{data.get('chart-name')} -f ./values.yml"
+    # Scale placeholders up ahead of a class and back down after it. The
+    # release values hold the idle count, so a release upgrade resets the
+    # StatefulSet to it; a Job run after every values change scales it back
+    # up when class-start fired more recently than class-end.
+    if data.get("deploy") == True and lab_warm_capacity["scheduled"]:
+        lab_warm_schedules = []
+
+        for window, schedule, replicas in [
+            ("class-start", lab_warm_capacity["class_start"], lab_warm_capacity["peak_replicas"]),
+            ("class-end", lab_warm_capacity["class_end"], lab_warm_capacity["baseline_replicas"]),
+        ]:
+            lab_warm_schedule = k8s.batch.v1.CronJob(
+                f"warm-capacity-{window}{sfx}",
+                metadata=k8s.meta.v1.ObjectMetaArgs(
+                             name=f"warm-capacity-{window}",
+                             namespace=data.get("namespace")
+                         ),
+                spec=k8s.batch.v1.CronJobSpecArgs(
+                         schedule=schedule,
+                         concurrency_policy="Replace",
+                         job_template=k8s.batch.v1.JobTemplateSpecArgs(
+                             spec=k8s.batch.v1.JobSpecArgs(
+                                 backoff_limit=2,
+                                 template=k8s.core.v1.PodTemplateSpecArgs(
+                                     spec=k8s.core.v1.PodSpecArgs(
+                                         service_account_name=f"{data.get('chart-name')}-svc-account",
+                                         restart_policy="OnFailure",
+                                         containers=[k8s.core.v1.ContainerArgs(
+                                             name="scale",
+                                             image=mirrored("bitnami/kubectl:1.25", registry, lab_pull_through),
+                                             command=[
+                                                 "kubectl", "-n", data.get("namespace"),
+                                                 "scale", "statefulset", "user-placeholder",
+                                                 f"--replicas={replicas}"
+                                             ]
+                                         )]
+                                     )
+                                 )
+                             )
+                         )
+                     ),
+                opts=ResourceOptions(provider=k8s_provider, depends_on=[jupyter_svc_account, jupyter_hub])
+            )
+            lab_warm_schedules.append(lab_warm_schedule)
+
+        lab_warm_last_run = "$(kubectl -n {} get cronjob warm-capacity-{} -o jsonpath='{{.status.lastScheduleTime}}')"
+
+        k8s.batch.v1.Job(
+            f"warm-capacity-restore{sfx}",
+            metadata=k8s.meta.v1.ObjectMetaArgs(
+                         name=f"warm-capacity-restore-{values_hash[:8]}",
+                         namespace=data.get("namespace")
+                     ),
+            spec=k8s.batch.v1.JobSpecArgs(
+                     backoff_limit=2,
+                     template=k8s.core.v1.PodTemplateSpecArgs(
+                         spec=k8s.core.v1.PodSpecArgs(
+                             service_account_name=f"{data.get('chart-name')}-svc-account",
+                             restart_policy="OnFailure",
+                             containers=[k8s.core.v1.ContainerArgs(
+                                 name="scale",
+                                 image=mirrored("bitnami/kubectl:1.25", registry, lab_pull_through),
+                                 command=["sh", "-c", "; ".join([
+                                     f"start={lab_warm_last_run.format(data.get('namespace'), 'class-start')}",
+                                     f"end={lab_warm_last_run.format(data.get('namespace'), 'class-end')}",
+                                     'if [ -n "$start" ] && expr "$start" \\> "$end" > /dev/null; then '
+                                     f"kubectl -n {data.get('namespace')} scale statefulset user-placeholder "
+                                     f"--replicas={lab_warm_capacity['peak_replicas']}; fi",
+                                 ])]
+                             )]
+                         )
                      )
-elif data.get("deploy") == False:
-    destroy_jupyter = local.Command(
-        # Increment "jupyter_install_#" to let helm run
-        "jupyter-destroy",
-        create=f"helm uninstall -n {data.get('namespace')} {data.get('chart-name')} --dry-run --debug"
-    )
+                 ),
+            opts=ResourceOptions(provider=k8s_provider, depends_on=[jupyter_hub, *lab_warm_schedules])
+        )
 
-jupyter_cert = aws.acm.get_certificate(domain=f"*.{data.get('user-domain')}", types=["AMAZON_ISSUED"])
-
-jupyter_alb = k8s.networking.v1.Ingress(
-                  "jupyter-lb",
-                  metadata=k8s.meta.v1.ObjectMetaArgs(
-                               name="jupyterhub",
-                               namespace=data.get("namespace"),
-                               annotations={
-                                    "kubernetes.io/ingress.class": "alb",
-                                    "alb.ingress.kubernetes.io/scheme": "internet-facing",
-                                    "alb.ingress.kubernetes.io/listen-ports": '[{"HTTPS":443}, {"HTTP":80}]',
-                                    "alb.ingress.kubernetes.io/certificate-arn": jupyter_cert.arn
-                               }
-                           ),
-                  spec=k8s.networking.v1.IngressSpecArgs(
-                           rules=[k8s.networking.v1.IngressRuleArgs(
-                                     http=k8s.networking.v1.HTTPIngressRuleValueArgs(
-                                              paths=[
-                                                  k8s.networking.v1.HTTPIngressPathArgs(
-                                                      backend=k8s.networking.v1.IngressBackendArgs(
-                                                                  service=k8s.networking.v1.IngressServiceBackendArgs(
-                                                                              name="proxy-public",
-                                                                              port=k8s.networking.v1.ServiceBackendPortArgs(
-                                                                                       number=80
+    jupyter_cert = acm_certificate(region)
+
+    jupyter_alb = k8s.networking.v1.Ingress(
+                      f"jupyter-lb{sfx}",
+                      metadata=k8s.meta.v1.ObjectMetaArgs(
+                                   name="jupyterhub",
+                                   namespace=data.get("namespace"),
+                                   annotations=ingress_annotations(lab_ingress, jupyter_cert.arn)
+                               ),
+                      spec=k8s.networking.v1.IngressSpecArgs(
+                               # Host routing lets every ingress in the group share the ALB's listeners
+                               rules=[k8s.networking.v1.IngressRuleArgs(
+                                         host=hub_host(data, cluster),
+                                         http=k8s.networking.v1.HTTPIngressRuleValueArgs(
+                                                  paths=[
+                                                      k8s.networking.v1.HTTPIngressPathArgs(
+                                                          backend=k8s.networking.v1.IngressBackendArgs(
+                                                                      service=k8s.networking.v1.IngressServiceBackendArgs(
+                                                                                  name="proxy-public",
+                                                                                  port=k8s.networking.v1.ServiceBackendPortArgs(
+                                                                                           number=80
+                                                                                  )
                                                                               )
-                                                                          )
-                                                              ),
-                                                  path="/",
-                                                  path_type="Prefix"
-                                                  )
-                                              ],
-                                          )
-                                 )]
+                                                                  ),
+                                                      path="/",
+                                                      path_type="Prefix"
+                                                      )
+                                                  ],
+                                              )
+                                     )]
+                           ),
+                      opts=ResourceOptions(provider=k8s_provider)
+                  )
+
+    traced("alb.ingress", jupyter_alb.status.load_balancer.ingress[0].hostname, cluster=cluster["key"])
+
+    jupyter_alb_hostname = jupyter_alb.status.load_balancer.ingress[0].hostname
+
+    # Alias records resolve straight to the ALB's addresses (no TTL to wait out)
+    if lab_ingress["dns"] == "alias":
+        jupyter_record = {
+            "type": "A",
+            "aliases": [aws.route53.RecordAliasArgs(
+                           name=jupyter_alb_hostname,
+                           zone_id=alb_zone(region).id,
+                           evaluate_target_health=True
+                       )]
+        }
+    else:
+        jupyter_record = {"type": "CNAME", "ttl": 300, "records": [jupyter_alb_hostname]}
+
+    jupyter_fqdn = aws.route53.Record(
+                       f"jupyter-fqdn{sfx}",
+                       zone_id=lab_zone.zone_id,
+                       name=hub_host(data, cluster),
+                       **jupyter_record,
+                       # A CNAME and an A record cannot share the name while switching
+                       opts=ResourceOptions(delete_before_replace=True)
+                   )
+
+    traced("route53.record", jupyter_fqdn.id, cluster=cluster["key"])
+
+    # The hub's public name, once both its record and its release are in place
+    jupyter_endpoint = pulumi.Output.all(jupyter_fqdn.fqdn, jupyter_hub.status if jupyter_hub else None).apply(
+                           lambda args: args[0]
                        )
-              )
-
-lab_zone = aws.route53.get_zone(name=data.get("user-domain"))
-
-jupyter_fqdn = aws.route53.Record(
-                   "jupyter-fqdn",
-                   zone_id=lab_zone.zone_id,
-                   name=f"{data.get('tags')['purpose']}-{data.get('chart-name')}.{data.get('user-domain')}",
-                   type="CNAME",
-                   ttl=300,
-                   records=[
-                       jupyter_alb.status.load_balancer.ingress[0].hostname
-                   ]
-               )
\ No newline at end of file
+
+    return LabClusterDeployment(
+               cluster=cluster,
+               learners=learners,
+               eks=lab_cluster,
+               kubeconfig=lab_kubeconfig,
+               k8s_provider=k8s_provider,
+               oidc=lab_cluster_oidc,
+               s3_access_role=lab_s3_access_role,
+               tenants=lab_tenants,
+               values_hash=values_hash,
+               fqdn=jupyter_fqdn,
+               endpoint=jupyter_endpoint
+           )
+
+
+lab_deployments = []
+
+for cluster in lab_fleet:
+    with span("cluster.graph", cluster=cluster["key"], learners=len(lab_assignments[cluster["key"]])):
+        lab_deployments.append(deploy_lab_cluster(cluster, lab_assignments[cluster["key"]]))
+
+# The primary cluster keeps the single-cluster names used by the stack outputs
+lab_primary = lab_deployments[0]
+
+lab_cluster = lab_primary.eks
+
+lab_kubeconfig = lab_primary.kubeconfig
+
+lab_cluster_oidc = lab_primary.oidc
+
+lab_s3_access_role = lab_primary.s3_access_role
+
+values_hash = lab_primary.values_hash
+
+jupyter_fqdn = lab_primary.fqdn
+
+lab_tenants = [tenant for deployment in lab_deployments for tenant in deployment.tenants]
+
+# Hub each learner logs in on
+lab_learner_hubs = {
+    username: hub_host(data, deployment.cluster) for deployment in lab_deployments for username in deployment.learners
+}
+
+lab_fleet_report = {
+    deployment.cluster["key"] or deployment.cluster["name"]: {
+        "region": deployment.cluster["region"],
+        "learners": len(deployment.learners),
+        "fqdn": deployment.fqdn.fqdn,
+    }
+    for deployment in lab_deployments
+}
+
+# Seconds until each hub answered on its public name (None: not within the
+# timeout), polled for every hub at once after all of them are deployed
+lab_hubs_ready = None
+
+if lab_ingress["wait-ready"] and data.get("deploy") == True and not pulumi.runtime.is_dry_run():
+    lab_hubs_ready = traced(
+                         "hubs.ready",
+                         pulumi.Output.all(*[deployment.endpoint for deployment in lab_deployments]).apply(
+                             lambda hosts: wait_ready(hosts, lab_ingress)
+                         ),
+                         hubs=len(lab_deployments)
+                     )
@@ -0,0 +1,72 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+import urllib.error
+import urllib.request
+
+DEFAULT_INGRESS = {
+    # Ingresses of one cluster in the same group share a single ALB and are
+    # routed by host, so the hub joins an ALB that other applications on the
+    # cluster already use instead of waiting for its own. "" gives this hub
+    # an ALB of its own. The stack deploys one hub per cluster: a second
+    # stack on the same cluster would clash on its cluster-wide resources.
+    "group": "ephemeral-labs",
+    # Rule evaluation order within the group, lower goes first
+    "group-order": 10,
+    "scheme": "internet-facing",
+    # "alias" A record to the ALB or a "cname" to its hostname
+    "dns": "alias",
+    # Poll every hub's health endpoint once its record exists, all hubs at once
+    "wait-ready": True,
+    "ready-timeout": 600,
+    "ready-interval": 10,
+}
+
+HEALTH_PATH = "/hub/health"
+
+
+def ingress_settings(details):
+    settings = {**DEFAULT_INGRESS, **(details.get("ingress") or {})}
+    if settings["dns"] not in ("alias", "cname"):
+        raise ValueError(f"ingress dns must be 'alias' or 'cname', got {settings['dns']!r}")
+    return settings
+
+
+def ingress_annotations(settings, certificate_arn):
+    annotations = {
+        "kubernetes.io/ingress.class": "alb",
+        "alb.ingress.kubernetes.io/scheme": settings["scheme"],
+        "alb.ingress.kubernetes.io/listen-ports": '[{"HTTPS":443}, {"HTTP":80}]',
+        "alb.ingress.kubernetes.io/certificate-arn": certificate_arn,
+    }
+    if settings["group"]:
+        annotations["alb.ingress.kubernetes.io/group.name"] = settings["group"]
+        annotations["alb.ingress.kubernetes.io/group.order"] = str(settings["group-order"])
+    return annotations
+
+
+# Seconds until https://<host>/hub/health answers, None when it never does
+# within the timeout (DNS not propagated yet, ALB target still unhealthy)
+def hub_ready(host, settings):
+    started = time.monotonic()
+    deadline = started + float(settings["ready-timeout"])
+    while True:
+        try:
+            with urllib.request.urlopen(f"https://{host}{HEALTH_PATH}", timeout=10) as response:
+                if response.status == 200:
+                    return round(time.monotonic() - started, 1)
+        except (urllib.error.URLError, OSError):
+            pass
+        if time.monotonic() + float(settings["ready-interval"]) > deadline:
+            return None
+        time.sleep(float(settings["ready-interval"]))
+
+
+# Readiness of every hub, polled concurrently so the wait is as long as the
+# slowest hub rather than the sum of them. The pollers get their own threads,
+# Pulumi's RPCs use the event loop's default executor.
+async def wait_ready(hosts, settings):
+    loop = asyncio.get_running_loop()
+    with ThreadPoolExecutor(max_workers=max(len(hosts), 1)) as executor:
+        seconds = await asyncio.gather(*[loop.run_in_executor(executor, hub_ready, host, settings) for host in hosts])
+    return dict(zip(hosts, seconds))
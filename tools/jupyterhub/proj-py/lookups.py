@@ -0,0 +1,108 @@
+import time
+from functools import lru_cache
+import pulumi
+import pulumi_aws as aws
+from fleet import invoke_opts
+from tracing import traced
+from utils import data
+
+# AWS data-source lookups, started on first use and memoized per cluster or
+# region, so branches that never need a lookup never make it. pulumi-aws 5
+# implements its *_output functions as an apply around the blocking invoke,
+# which runs lookups one at a time (and nests event loops), so the invokes
+# are issued here as Output invokes that resolve concurrently.
+lookup_timings = {}
+_started = []
+
+
+def _timed(name, output):
+    started = time.monotonic()
+
+    def record(result):
+        lookup_timings[name] = round(time.monotonic() - started, 3)
+        pulumi.log.debug(f"Lookup {name} resolved in {lookup_timings[name]}s")
+        return result
+
+    timed = traced(f"lookup.{name}", output.apply(record))
+    _started.append(timed)
+    return timed
+
+
+def _invoke(token, args, result_type, region=None):
+    return pulumi.runtime.invoke_output(token, args, opts=invoke_opts(region), typ=result_type)
+
+
+@lru_cache(maxsize=None)
+def eks_cluster(name, region):
+    return _timed(f"eks_cluster[{name}]",
+                  _invoke("aws:eks/getCluster:getCluster", {"name": name}, aws.eks.GetClusterResult, region))
+
+
+@lru_cache(maxsize=None)
+def eks_cluster_auth(name, region):
+    return _timed(f"eks_cluster_auth[{name}]",
+                  _invoke("aws:eks/getClusterAuth:getClusterAuth", {"name": name}, aws.eks.GetClusterAuthResult, region))
+
+
+@lru_cache(maxsize=None)
+def ecr_token(region):
+    return _timed(f"ecr_token[{region}]",
+                  _invoke("aws:ecr/getAuthorizationToken:getAuthorizationToken", {"registryId": data.get("account")},
+                          aws.ecr.GetAuthorizationTokenResult, region))
+
+
+@lru_cache(maxsize=None)
+def acm_certificate(region):
+    return _timed(f"acm_certificate[{region}]",
+                  _invoke("aws:acm/getCertificate:getCertificate",
+                          {"domain": f"*.{data.get('user-domain')}", "types": ["AMAZON_ISSUED"]},
+                          aws.acm.GetCertificateResult, region))
+
+
+# Canonical hosted zone of the region's load balancers, the target zone of ALB alias records
+@lru_cache(maxsize=None)
+def alb_zone(region):
+    return _timed(f"alb_zone[{region}]",
+                  _invoke("aws:elb/getHostedZoneId:getHostedZoneId", {"region": region}, aws.elb.GetHostedZoneIdResult, region))
+
+
+@lru_cache(maxsize=None)
+def route53_zone():
+    return _timed("route53_zone",
+                  _invoke("aws:route53/getZone:getZone", {"name": data.get("user-domain")}, aws.route53.GetZoneResult))
+
+
+# Errors getImage reports for an image (or repository) that is not there;
+# anything else (auth, throttling) fails the lookup instead of reading as
+# "not pushed" and then failing the push to the IMMUTABLE repository
+IMAGE_MISSING = ("ImageNotFoundException", "RepositoryNotFoundException")
+
+
+async def _image_digest(repository, selector, region):
+    try:
+        image = await pulumi.runtime.invoke_async("aws:ecr/getImage:getImage", {"repositoryName": repository, **selector},
+                                                  opts=invoke_opts(region), typ=aws.ecr.GetImageResult)
+    except Exception as error:
+        if any(code in str(error) for code in IMAGE_MISSING):
+            return None
+        raise
+    return image.image_digest
+
+
+# Digest of repository:tag if already pushed to ECR, otherwise None
+@lru_cache(maxsize=None)
+def pushed_digest(repository, tag, region):
+    return _timed(f"pushed_digest[{tag}]",
+                  pulumi.Output.from_input(_image_digest(repository, {"imageTag": tag}, region)))
+
+
+# Digest of the most recently pushed image, None for an empty repository
+@lru_cache(maxsize=None)
+def latest_digest(repository, region):
+    return _timed(f"latest_digest[{region}]",
+                  pulumi.Output.from_input(_image_digest(repository, {"mostRecent": True}, region)))
+
+
+# Seconds each started lookup took to resolve, once all of them have
+def lookup_report():
+    return pulumi.Output.all(*_started).apply(lambda _: dict(sorted(lookup_timings.items())))
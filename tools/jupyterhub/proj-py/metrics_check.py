@@ -0,0 +1,78 @@
+# Scrapes a hub's /hub/metrics and checks that every lab metric is exported,
+# e.g. against a port-forwarded or locally running hub:
+#
+#   kubectl -n aws2023 port-forward svc/hub 8081:8081 &
+#   kubectl -n aws2023 get secret lab-metrics -o jsonpath='{.data.token}' | base64 -d > /tmp/lab-metrics-token
+#   python metrics_check.py --url http://localhost:8081/hub/metrics --token-file /tmp/lab-metrics-token
+import argparse
+import sys
+import urllib.request
+
+LAB_METRICS = {
+    "lab_spawn_queue_depth": "gauge",
+    "lab_spawn_queue_depth_seen": "histogram",
+    "lab_spawn_queue_wait_seconds": "histogram",
+    "lab_spawn_duration_seconds": "histogram",
+    "lab_spawn_concurrency_limit": "gauge",
+    "lab_spawn_active": "gauge",
+    "lab_spawn_phase_seconds": "histogram",
+    "lab_spawn_failures_total": "counter",
+    "lab_active_servers": "gauge",
+    "lab_culled_servers_total": "counter",
+    "lab_culled_memory_bytes_total": "counter",
+    "lab_culled_node_hours_total": "counter",
+}
+
+
+# Metric family -> type from the "# TYPE" lines of a text exposition
+def exported_types(text):
+    types = {}
+    for line in text.splitlines():
+        if line.startswith("# TYPE "):
+            _, _, name, kind = line.split(" ", 3)
+            types[name] = kind.strip()
+    return types
+
+
+def missing_metrics(text, expected=LAB_METRICS):
+    types = exported_types(text)
+    missing = []
+    for name, kind in expected.items():
+        family = name[:-len("_total")] if kind == "counter" and name.endswith("_total") else name
+        if types.get(name, types.get(family)) != kind:
+            missing.append(name)
+    return missing
+
+
+def scrape(url, token=None):
+    request = urllib.request.Request(url, headers={"Authorization": f"token {token}"} if token else {})
+    with urllib.request.urlopen(request, timeout=10) as response:
+        return response.read().decode("utf-8")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check the lab metrics a hub exports")
+    parser.add_argument("--url", default="http://localhost:8081/hub/metrics")
+    parser.add_argument("--token-file", help="file holding the hub's prometheus service token")
+    parser.add_argument("--show", action="store_true", help="print the lab_* samples")
+    args = parser.parse_args(argv)
+
+    token = None
+    if args.token_file:
+        with open(args.token_file) as token_file:
+            token = token_file.read().strip()
+
+    text = scrape(args.url, token)
+    if args.show:
+        for line in text.splitlines():
+            if line.startswith("lab_"):
+                print(line)
+    missing = missing_metrics(text)
+    for name in missing:
+        print(f"Missing {name} ({LAB_METRICS[name]})", file=sys.stderr)
+    print(f"{len(LAB_METRICS) - len(missing)}/{len(LAB_METRICS)} lab metrics exported by {args.url}")
+    return 1 if missing else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,159 @@
+import hashlib
+import hmac
+import json
+
+DEFAULT_MONITORING = {
+    "enabled": True,
+    # Require a service token for /hub/metrics, the proxy exposes it publicly
+    "authenticate": True,
+    # Create a ServiceMonitor and PrometheusRule (prometheus-operator CRDs)
+    "prometheus-operator": False,
+    # Label the Grafana dashboard sidecar watches for
+    "dashboard-label": "grafana_dashboard",
+    "alerts": {
+        "spawn-p95-seconds": 240,
+        "queue-depth": 20,
+        "spawn-failures": 3,
+        "scale-up-p95-seconds": 180,
+    },
+}
+
+def monitoring_settings(details):
+    settings = {**DEFAULT_MONITORING, **(details.get("monitoring") or {})}
+    settings["alerts"] = {**DEFAULT_MONITORING["alerts"], **settings["alerts"]}
+    return settings
+
+
+# Scrape token for the hub's "prometheus" service, derived from the OAuth
+# secret so it stays stable across runs without another stored secret
+def metrics_token(secret):
+    return hmac.new(secret.encode("utf-8"), b"lab-metrics", hashlib.sha256).hexdigest()
+
+
+def _panel(panel_id, title, exprs, x, y, unit="short", kind="timeseries", width=12):
+    return {
+        "id": panel_id,
+        "type": kind,
+        "title": title,
+        "datasource": {"type": "prometheus", "uid": "${datasource}"},
+        "gridPos": {"x": x, "y": y, "w": width, "h": 8},
+        "fieldConfig": {"defaults": {"unit": unit}, "overrides": []},
+        "targets": [
+            {"refId": chr(ord("A") + index), "expr": expr, "legendFormat": legend}
+            for index, (expr, legend) in enumerate(exprs)
+        ],
+    }
+
+
+def _quantile(q, metric, by="le", selector=""):
+    return f"histogram_quantile({q}, sum by ({by}) (rate({metric}_bucket{selector}[5m])))"
+
+
+# Grafana dashboard for spawn latency, its phases, admission and culling
+def hub_dashboard(namespace):
+    selector = f'{{namespace="{namespace}"}}'
+    panels = [
+        _panel(1, "Spawn duration", [
+            (_quantile(0.5, "lab_spawn_duration_seconds", selector=selector), "p50"),
+            (_quantile(0.95, "lab_spawn_duration_seconds", selector=selector), "p95"),
+        ], 0, 0, unit="s"),
+        _panel(2, "Spawn phases (p95)", [
+            (_quantile(0.95, "lab_spawn_phase_seconds", by="le, phase", selector=selector), "{{phase}}"),
+        ], 12, 0, unit="s"),
+        _panel(3, "Scheduling with and without scale-up (p95)", [
+            (_quantile(0.95, "lab_spawn_phase_seconds", by="le, scale_up",
+                       selector=f'{{namespace="{namespace}", phase="scheduling"}}'), "scale_up={{scale_up}}"),
+        ], 0, 8, unit="s"),
+        _panel(4, "Admission queue", [
+            (f"lab_spawn_queue_depth{selector}", "waiting"),
+            (f"lab_spawn_active{selector}", "spawning"),
+            (f"lab_spawn_concurrency_limit{selector}", "limit"),
+        ], 12, 8),
+        _panel(5, "Queue depth seen on arrival", [
+            (f"sum by (le) (increase(lab_spawn_queue_depth_seen_bucket{selector}[$__rate_interval]))", "{{le}}"),
+        ], 0, 16, kind="heatmap"),
+        _panel(6, "Queue wait (p95)", [
+            (_quantile(0.95, "lab_spawn_queue_wait_seconds", selector=selector), "p95"),
+        ], 12, 16, unit="s"),
+        _panel(7, "Active servers by profile", [
+            (f"sum by (profile) (lab_active_servers{selector})", "{{profile}}"),
+        ], 0, 24),
+        _panel(8, "Spawn failures", [
+            (f"sum by (profile, reason) (increase(lab_spawn_failures_total{selector}[15m]))", "{{profile}} {{reason}}"),
+        ], 12, 24),
+        _panel(9, "Culled servers", [
+            (f"sum by (profile) (increase(lab_culled_servers_total{selector}[1h]))", "{{profile}}"),
+        ], 0, 32),
+        _panel(10, "Node-hours released by culling", [
+            (f"sum by (profile) (increase(lab_culled_node_hours_total{selector}[1h]))", "{{profile}}"),
+        ], 12, 32),
+    ]
+    return {
+        "uid": f"lab-hub-{namespace}",
+        "title": f"Lab hub ({namespace})",
+        "tags": ["jupyterhub", "ephemeral-labs"],
+        "timezone": "browser",
+        "schemaVersion": 38,
+        "refresh": "30s",
+        "time": {"from": "now-6h", "to": "now"},
+        "templating": {"list": [{
+            "name": "datasource",
+            "type": "datasource",
+            "query": "prometheus",
+        }]},
+        "panels": panels,
+    }
+
+
+def dashboard_json(namespace):
+    return json.dumps(hub_dashboard(namespace), indent=1, sort_keys=True)
+
+
+# PrometheusRule groups, thresholds from details.monitoring.alerts
+def alert_rules(namespace, alerts):
+    selector = f'{{namespace="{namespace}"}}'
+    scale_up_selector = f'{{namespace="{namespace}", phase="scheduling", scale_up="true"}}'
+    return [{
+        "name": "lab-hub",
+        "rules": [
+            {
+                "alert": "LabSpawnLatencyHigh",
+                "expr": f"{_quantile(0.95, 'lab_spawn_duration_seconds', selector=selector)} > {alerts['spawn-p95-seconds']}",
+                "for": "10m",
+                "labels": {"severity": "warning"},
+                "annotations": {
+                    "summary": "95th percentile lab spawn time is above {{ $value | humanizeDuration }}",
+                    "description": "Check the spawn phase panel: scheduling points at warm capacity, "
+                                   "image_pull at the registry, post_start at the image.",
+                },
+            },
+            {
+                "alert": "LabSpawnQueueBacklog",
+                "expr": f"lab_spawn_queue_depth{selector} > {alerts['queue-depth']}",
+                "for": "5m",
+                "labels": {"severity": "warning"},
+                "annotations": {"summary": "{{ $value }} spawns are waiting for an admission slot"},
+            },
+            {
+                "alert": "LabSpawnFailures",
+                "expr": f"sum(increase(lab_spawn_failures_total{selector}[15m])) > {alerts['spawn-failures']}",
+                "labels": {"severity": "critical"},
+                "annotations": {"summary": "{{ $value }} lab spawns failed in the last 15 minutes"},
+            },
+            {
+                "alert": "LabScaleUpSlow",
+                "expr": f"{_quantile(0.95, 'lab_spawn_phase_seconds', selector=scale_up_selector)} > {alerts['scale-up-p95-seconds']}",
+                "for": "15m",
+                "labels": {"severity": "warning"},
+                "annotations": {"summary": "Spawns waiting on new nodes take {{ $value | humanizeDuration }} to schedule, "
+                                           "raise warm capacity before class"},
+            },
+            {
+                "alert": "LabHubMetricsAbsent",
+                "expr": f"absent(jupyterhub_running_servers{selector})",
+                "for": "10m",
+                "labels": {"severity": "critical"},
+                "annotations": {"summary": f"The lab hub in {namespace} is not being scraped"},
+            },
+        ],
+    }]
@@ -0,0 +1,130 @@
+from dataclasses import replace
+import yaml
+
+# z2jh's node conventions: user pods require/prefer nodes labelled with the
+# "user" purpose and tolerate the dedicated=user taint, core pods (hub,
+# proxy) do not tolerate it, so dedicated lab pools only run learner pods
+NODE_PURPOSE_LABEL = "hub.jupyter.org/node-purpose"
+DEDICATED_TAINT = {"key": "hub.jupyter.org/dedicated", "value": "user", "effect": "NO_SCHEDULE"}
+USER_TOLERATION = {"key": "hub.jupyter.org/dedicated", "operator": "Equal", "value": "user", "effect": "NoSchedule"}
+POOL_LABEL = "ephemeral-labs/pool"
+# Set by EKS on managed node group nodes
+CAPACITY_LABEL = "eks.amazonaws.com/capacityType"
+
+DEFAULT_NODE_POOL = {
+    "capacity-type": "SPOT",
+    # Several interchangeable types give spot more pools to draw from
+    "instance-types": ["m5.large", "m5a.large", "m6i.large"],
+    "min": 0,
+    "max": 10,
+    # Higher wins with the priority expander
+    "priority": 10,
+    "disk-size": 50,
+    # Extra taints on top of the dedicated=user one, e.g. a GPU taint
+    "taints": [],
+}
+
+DEFAULT_AUTOSCALER = {
+    # Priority between pools first, then the pool wasting the least CPU/memory
+    "expander": "priority,least-waste",
+    # Nodes stay through a class (no churn right after a burst of logins) and
+    # go quickly once sessions end
+    "scale-down-delay-after-add": "20m",
+    "scale-down-unneeded-time": "5m",
+    "scale-down-utilization-threshold": 0.5,
+    "max-node-provision-time": "10m",
+    # Lab pods use emptyDir scratch space, it must not pin nodes
+    "skip-nodes-with-local-storage": False,
+    "balance-similar-node-groups": True,
+}
+
+# Spot unless a course declares "capacity: on-demand" in the catalog
+DEFAULT_PROFILE_CAPACITY = "spot"
+
+
+def node_pool_settings(details):
+    return [{**DEFAULT_NODE_POOL, **pool} for pool in details.get("node-pools") or []]
+
+
+def autoscaler_settings(details):
+    return {**DEFAULT_AUTOSCALER, **(details.get("autoscaler") or {})}
+
+
+# Priority expander config over node group names as the autoscaler sees them
+# ("eks-<nodegroup>-<uuid>"), as YAML text since its keys are integers
+def expander_priorities(pools):
+    priorities = {}
+    for pool in pools:
+        priorities.setdefault(int(pool["priority"]), []).append(f".*lab-{pool['name']}.*")
+    return yaml.safe_dump(priorities, default_flow_style=False)
+
+
+def autoscaler_values(cluster_name, region, pools, settings):
+    expander = settings["expander"]
+    if not pools:
+        # Without lab pools there is nothing to rank
+        expander = ",".join(name for name in expander.split(",") if name != "priority") or "least-waste"
+    values = {
+        "cloudProvider": "aws",
+        "awsRegion": region,
+        "autoDiscovery": {
+            "enabled": "true",
+            "clusterName": f"{cluster_name}",
+        },
+        "podLabels": {
+            "app": "cluster-autoscaler"
+        },
+        "extraArgs": {
+            "expander": expander,
+            **{
+                key: str(value).lower() if isinstance(value, bool) else str(value)
+                for key, value in settings.items() if key != "expander"
+            },
+        },
+    }
+    if "priority" in expander.split(","):
+        values["expanderPriorities"] = expander_priorities(pools)
+    return values
+
+
+def pool_labels(pool):
+    return {NODE_PURPOSE_LABEL: "user", POOL_LABEL: pool["name"]}
+
+
+def pool_taints(pool):
+    return [DEDICATED_TAINT, *pool["taints"]]
+
+
+# KubeSpawner overrides placing a course's servers: on-demand courses require
+# on-demand nodes, spot courses prefer spot but fall back to on-demand
+def capacity_overrides(scheduling):
+    capacity = scheduling.get("capacity", DEFAULT_PROFILE_CAPACITY)
+    overrides = {}
+    if capacity == "on-demand":
+        overrides["node_affinity_required"] = [{
+            "matchExpressions": [{"key": CAPACITY_LABEL, "operator": "In", "values": ["ON_DEMAND"]}]
+        }]
+    elif capacity == "spot":
+        overrides["node_affinity_preferred"] = [{
+            "weight": 100,
+            "preference": {"matchExpressions": [{"key": CAPACITY_LABEL, "operator": "In", "values": ["SPOT"]}]},
+        }]
+    elif capacity != "any":
+        raise ValueError(f"capacity must be 'spot', 'on-demand' or 'any', got {capacity!r}")
+    if scheduling.get("tolerations"):
+        # Replaces the chart-wide user pod tolerations, so keep the dedicated one
+        overrides["tolerations"] = [USER_TOLERATION, *scheduling["tolerations"]]
+    return overrides
+
+
+# Profiles with each course's capacity and tolerations applied to its modules
+def schedule_profiles(profiles, scheduling):
+    scheduled = []
+    for profile in profiles:
+        overrides = capacity_overrides(scheduling.get(profile.slug, {}))
+        modules = [
+            replace(module, kubespawner_override={**module.kubespawner_override, **overrides})
+            for module in profile.modules
+        ]
+        scheduled.append(replace(profile, modules=modules))
+    return scheduled
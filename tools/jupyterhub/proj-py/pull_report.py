@@ -0,0 +1,104 @@
+# Reports image pull latency and ECR auth failures from kubelet events in the
+# hub namespace and the lab-* user namespaces.
+#
+#   pulumi stack output kubeconfig --show-secrets > /tmp/lab-kubeconfig
+#   python pull_report.py --kubeconfig /tmp/lab-kubeconfig --namespace aws2023
+import argparse
+import re
+import sys
+from collections import defaultdict
+from kubernetes import client, config
+
+NAMESPACE_PREFIX = "lab-"
+
+# 'Successfully pulled image "x" in 1.234s (1.234s including waiting)' or, on older kubelets, '... in 812ms'
+PULLED = re.compile(r'Successfully pulled image "(?P<image>[^"]+)" in (?P<value>[\d.]+)(?P<unit>ms|s)\b')
+FAILED = re.compile(r'Failed to pull image "(?P<image>[^"]+)"')
+AUTH_FAILURES = (
+    "no basic auth credentials",
+    "authorization token has expired",
+    "401 unauthorized",
+    "403 forbidden",
+    "pull access denied",
+)
+
+
+def is_auth_failure(message):
+    message = message.lower()
+    return any(marker in message for marker in AUTH_FAILURES)
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+# Pull durations and failures per image from a list of core/v1 events
+def summarize(events):
+    pulls = defaultdict(lambda: {"seconds": [], "failed": 0, "auth_failed": 0})
+    for event in events:
+        message = event.message or ""
+        if event.reason == "Pulled":
+            pulled = PULLED.search(message)
+            if pulled:
+                seconds = float(pulled["value"]) / (1000 if pulled["unit"] == "ms" else 1)
+                pulls[pulled["image"]]["seconds"].extend([seconds] * (event.count or 1))
+        elif event.reason == "Failed":
+            failed = FAILED.search(message)
+            if failed:
+                pulls[failed["image"]]["failed"] += event.count or 1
+                if is_auth_failure(message):
+                    pulls[failed["image"]]["auth_failed"] += event.count or 1
+    return pulls
+
+
+def list_events(api, namespaces, page_size=500):
+    events = []
+    for namespace in namespaces:
+        token = None
+        while True:
+            page = api.list_namespaced_event(namespace, limit=page_size, _continue=token)
+            events.extend(page.items)
+            token = page.metadata._continue
+            if not token:
+                break
+    return events
+
+
+def lab_namespaces(api, hub_namespace):
+    namespaces = [namespace.metadata.name for namespace in api.list_namespace().items
+                  if namespace.metadata.name.startswith(NAMESPACE_PREFIX)]
+    return [hub_namespace, *sorted(namespaces)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Image pull latency and auth failure report")
+    parser.add_argument("--kubeconfig", help="kubeconfig file, e.g. from 'pulumi stack output kubeconfig'")
+    parser.add_argument("--namespace", required=True, help="hub namespace, lab-* namespaces are always included")
+    args = parser.parse_args(argv)
+
+    config.load_kube_config(config_file=args.kubeconfig)
+    api = client.CoreV1Api()
+
+    pulls = summarize(list_events(api, lab_namespaces(api, args.namespace)))
+    if not pulls:
+        print("No image pull events (events are kept for about an hour)")
+        return 0
+
+    total = failed = auth_failed = 0
+    print(f"{'image':<80} {'pulls':>6} {'p50':>7} {'p95':>7} {'max':>7} {'failed':>6} {'auth':>5}")
+    for image, stats in sorted(pulls.items()):
+        seconds = stats["seconds"]
+        timings = [f"{percentile(seconds, q):.1f}s" for q in (0.5, 0.95)] + [f"{max(seconds):.1f}s"] if seconds else ["-"] * 3
+        print(f"{image:<80} {len(seconds):>6} {timings[0]:>7} {timings[1]:>7} {timings[2]:>7} "
+              f"{stats['failed']:>6} {stats['auth_failed']:>5}")
+        total += len(seconds) + stats["failed"]
+        failed += stats["failed"]
+        auth_failed += stats["auth_failed"]
+    print(f"Pull attempts: {total}, failed: {failed} ({failed / total:.1%}), "
+          f"auth failures: {auth_failed} ({auth_failed / total:.1%})")
+    return 1 if auth_failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,142 @@
+# Deletes expired lab-* namespaces left behind by KubeSpawner user namespaces.
+# Namespaces the Pulumi stack owns are kept: the tenants it creates carry
+# TENANT_LABEL, the ones it adopted are listed in ConfigMaps labelled
+# ADOPTED_LABEL.
+#
+#   pulumi stack output kubeconfig --show-secrets > /tmp/lab-kubeconfig
+#   python reaper.py --kubeconfig /tmp/lab-kubeconfig --max-age-days 14 --dry-run
+import argparse
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from kubernetes import client, config
+from kubernetes.client.rest import ApiException
+
+NAMESPACE_PREFIX = "lab-"
+TENANT_LABEL = "ephemeral-labs/tenant"
+EXPIRES_ANNOTATION = "ephemeral-labs/expires-at"
+ADOPTED_LABEL = "ephemeral-labs/adopted-namespaces"
+
+
+# Token bucket shared by the delete workers to stay gentle on the API server
+class RateLimiter:
+
+    def __init__(self, qps, burst=None):
+        self.interval = 1.0 / qps
+        self.capacity = burst or max(int(qps), 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) / self.interval)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) * self.interval
+            time.sleep(wait)
+
+
+def is_expired(namespace, now, max_age, include_managed=False, adopted=()):
+    metadata = namespace.metadata
+    if not metadata.name.startswith(NAMESPACE_PREFIX) or namespace.status.phase == "Terminating":
+        return False
+    expires_at = (metadata.annotations or {}).get(EXPIRES_ANNOTATION)
+    if expires_at:
+        return datetime.fromisoformat(expires_at.replace("Z", "+00:00")) <= now
+    # Roster tenants are owned by the Pulumi stack, remove them from the roster instead
+    if (TENANT_LABEL in (metadata.labels or {}) or metadata.name in adopted) and not include_managed:
+        return False
+    return now - metadata.creation_timestamp >= max_age
+
+
+# Existing namespaces the Pulumi stack reads into its tenants, which carry no tenant label
+def adopted_namespaces(api):
+    config_maps = api.list_config_map_for_all_namespaces(label_selector=ADOPTED_LABEL)
+    return {name for config_map in config_maps.items for name in (config_map.data or {}).get("namespaces", "").split()}
+
+
+def has_running_server(api, namespace):
+    pods = api.list_namespaced_pod(namespace, label_selector="component=singleuser-server", limit=1)
+    return bool(pods.items)
+
+
+def find_expired(api, max_age, selector=None, include_managed=False, page_size=200):
+    now = datetime.now(timezone.utc)
+    adopted = set() if include_managed else adopted_namespaces(api)
+    expired = []
+    token = None
+    while True:
+        page = api.list_namespace(label_selector=selector, limit=page_size, _continue=token)
+        expired.extend(
+            namespace.metadata.name for namespace in page.items
+            if is_expired(namespace, now, max_age, include_managed, adopted)
+        )
+        token = page.metadata._continue
+        if not token:
+            return expired
+
+
+def reap(api, namespaces, concurrency=8, qps=5.0, dry_run=False):
+    limiter = RateLimiter(qps)
+    results = {"deleted": [], "skipped": [], "failed": []}
+
+    def delete(namespace):
+        limiter.acquire()
+        if has_running_server(api, namespace):
+            return "skipped", namespace
+        if dry_run:
+            return "deleted", namespace
+        limiter.acquire()
+        try:
+            api.delete_namespace(namespace, propagation_policy="Background")
+        except ApiException as e:
+            if e.status != 404:
+                return "failed", f"{namespace}: {e.reason}"
+        return "deleted", namespace
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for outcome, namespace in pool.map(delete, namespaces):
+            results[outcome].append(namespace)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Delete expired lab-* namespaces")
+    parser.add_argument("--kubeconfig", help="kubeconfig file, e.g. from 'pulumi stack output kubeconfig'")
+    parser.add_argument("--max-age-days", type=float, default=14)
+    parser.add_argument("--selector", help="extra label selector for candidate namespaces")
+    parser.add_argument("--include-managed", action="store_true", help="also reap roster tenant namespaces")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--qps", type=float, default=5.0, help="API requests per second across workers")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args(argv)
+
+    config.load_kube_config(config_file=args.kubeconfig)
+    api = client.CoreV1Api()
+
+    started = time.monotonic()
+    candidates = find_expired(api, timedelta(days=args.max_age_days), args.selector, args.include_managed)
+    results = reap(api, candidates, args.concurrency, args.qps, args.dry_run)
+    elapsed = time.monotonic() - started
+
+    verb = "Would delete" if args.dry_run else "Deleted"
+    for namespace in results["deleted"]:
+        print(f"{verb} {namespace}")
+    for namespace in results["skipped"]:
+        print(f"Skipped {namespace} (server running)")
+    for failure in results["failed"]:
+        print(f"Failed {failure}", file=sys.stderr)
+    print(f"{verb} {len(results['deleted'])}/{len(candidates)} namespaces in {elapsed:.1f}s "
+          f"({len(results['deleted']) / max(elapsed, 0.001):.1f}/s)")
+    return 1 if results["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
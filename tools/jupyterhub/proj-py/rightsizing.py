@@ -0,0 +1,131 @@
+import csv
+import math
+from dataclasses import replace
+from statistics import quantiles
+
+MEMORY_UNITS = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4,
+                "Ki": 1024, "Mi": 1024 ** 2, "Gi": 1024 ** 3, "Ti": 1024 ** 4}
+
+DEFAULT_NODE = {
+    "cpu": 2,
+    "memory": "8Gi",
+}
+
+
+def parse_memory(value):
+    value = str(value)
+    for suffix in sorted(MEMORY_UNITS, key=len, reverse=True):
+        if value.endswith(suffix):
+            return int(float(value[:-len(suffix)]) * MEMORY_UNITS[suffix])
+    return int(float(value))
+
+
+def parse_cpu(value):
+    value = str(value)
+    if value.endswith("m"):
+        return float(value[:-1]) / 1000
+    return float(value)
+
+
+# Rounded up to 64Mi steps
+def round_mib(value):
+    return math.ceil(value / (64 * 1024 ** 2)) * 64
+
+
+# KubeSpawner reads "M" as MiB
+def format_memory(value):
+    return f"{round_mib(value)}M"
+
+
+def format_cpu(value):
+    return round(max(math.ceil(value * 20) / 20, 0.05), 2)
+
+
+# Usage samples from a metrics dump: CSV with profile, module, cpu (cores or
+# millicores) and memory (bytes or a quantity) columns, one row per sample
+def load_usage(path):
+    usage = {}
+    with open(path, newline="") as usage_file:
+        for row in csv.DictReader(usage_file):
+            samples = usage.setdefault((row["profile"], row["module"]), {"cpu": [], "memory": []})
+            samples["cpu"].append(parse_cpu(row["cpu"]))
+            samples["memory"].append(parse_memory(row["memory"]))
+    return usage
+
+
+def _percentile(samples, pct):
+    if len(samples) < 2:
+        return samples[0]
+    return quantiles(samples, n=100, method="inclusive")[pct - 1]
+
+
+# Requests at p95 of observed usage, limits at p99 plus headroom
+def recommend(samples, headroom=1.25):
+    cpu_request = _percentile(samples["cpu"], 95)
+    mem_request = _percentile(samples["memory"], 95)
+    return {
+        "cpu_guarantee": format_cpu(cpu_request),
+        "cpu_limit": format_cpu(max(_percentile(samples["cpu"], 99) * headroom, cpu_request)),
+        "mem_guarantee": format_memory(mem_request),
+        "mem_limit": format_memory(max(_percentile(samples["memory"], 99) * headroom, mem_request)),
+    }
+
+
+# Profiles with measured modules' kubespawner_override replaced by recommendations
+def right_size(profiles, usage):
+    sized = []
+    for profile in profiles:
+        modules = []
+        for module in profile.modules:
+            samples = usage.get((profile.slug, module.slug))
+            if samples:
+                module = replace(module, kubespawner_override={**module.kubespawner_override, **recommend(samples)})
+            modules.append(module)
+        sized.append(replace(profile, modules=modules))
+    return sized
+
+
+# Effective scheduler requests: Kubernetes uses the limit when no request is set
+def module_requests(profiles):
+    requests = []
+    for profile in profiles:
+        for module in profile.modules:
+            override = module.kubespawner_override
+            memory = override.get("mem_guarantee", override.get("mem_limit", "1G"))
+            cpu = override.get("cpu_guarantee", override.get("cpu_limit", 0))
+            requests.append((parse_cpu(cpu), parse_memory(memory)))
+    return requests
+
+
+# Namespace quota fitting "pods" servers of the largest module. A quota on
+# requests.cpu rejects pods without a cpu request, so it is only set when
+# every module has one.
+def tenant_quota(profiles, pods=3):
+    requests = module_requests(profiles)
+    quota = {
+        "pods": str(pods),
+        "requests.memory": f"{round_mib(pods * max(memory for _, memory in requests))}Mi",
+    }
+    if all(cpu for cpu, _ in requests):
+        quota["requests.cpu"] = str(format_cpu(pods * max(cpu for cpu, _ in requests)))
+    return quota
+
+
+# Nodes needed for a number of learners spread evenly over the modules
+def projected_nodes(profiles, node=DEFAULT_NODE, learners=100):
+    requests = module_requests(profiles)
+    cpu = sum(cpu for cpu, _ in requests) / len(requests) * learners
+    memory = sum(memory for _, memory in requests) / len(requests) * learners
+    return max(math.ceil(cpu / parse_cpu(node["cpu"])), math.ceil(memory / parse_memory(node["memory"])))
+
+
+def capacity_report(before, after, node=DEFAULT_NODE, learners=100):
+    return {
+        "learners": learners,
+        "nodes_before": projected_nodes(before, node, learners),
+        "nodes_after": projected_nodes(after, node, learners),
+        "requests": {
+            f"{profile.slug}/{module.slug}": module.kubespawner_override
+            for profile in after for module in profile.modules
+        },
+    }
@@ -0,0 +1,80 @@
+import hashlib
+import json
+
+CACHE_MOUNT = "/opt/lab-cache"
+SCRATCH_MOUNT = "/opt/lab-scratch"
+
+DEFAULT_SHARED_CACHE = {
+    "enabled": False,
+    # "hostPath": node-local copy filled by a DaemonSet on every node
+    # "nfs": one shared export (e.g. EFS) filled once by a Job
+    "mode": "hostPath",
+    "path": "/var/lib/lab-cache",
+    "nfs-server": None,
+    "scratch-size": "2Gi",
+    # Extra pip packages beyond image/requirements.txt, pre-downloaded as wheels
+    "packages": [],
+    # name -> URL of sample data files
+    "datasets": {},
+}
+
+
+def shared_cache_settings(details):
+    return {**DEFAULT_SHARED_CACHE, **(details.get("shared-cache") or {})}
+
+
+# Shell run once per cache version: wheels for the lab's pip requirements
+# and sample datasets, written under a version directory then swapped in
+def populate_script(settings, requirements):
+    version = hashlib.sha256(json.dumps([settings["packages"], settings["datasets"], requirements],
+                                        sort_keys=True).encode("utf-8")).hexdigest()[:16]
+    packages = " ".join(settings["packages"] + requirements)
+    downloads = "".join(
+        f'curl -sSLo "$stage/data/{name}" "{url}" && '
+        for name, url in sorted(settings["datasets"].items())
+    )
+    return version, (
+        f'set -e; [ -f /cache/.version-{version} ] && exit 0; '
+        f'stage=/cache/.stage-{version}; rm -rf "$stage"; mkdir -p "$stage/wheels" "$stage/data"; '
+        f'pip download --no-cache-dir -d "$stage/wheels" {packages}; '
+        f'{downloads}'
+        f'rm -rf /cache/wheels /cache/data; mv "$stage/wheels" "$stage/data" /cache/; rm -rf "$stage"; '
+        f'rm -f /cache/.version-*; touch /cache/.version-{version}'
+    )
+
+
+# Cache volume as seen by the populate workload (writable)
+def cache_volume(settings):
+    if settings["mode"] == "nfs":
+        return {"name": "lab-cache", "nfs": {"server": settings["nfs-server"], "path": settings["path"]}}
+    return {"name": "lab-cache", "hostPath": {"path": settings["path"], "type": "DirectoryOrCreate"}}
+
+
+# singleuser values: the cache mounted read-only and a per-user writable
+# scratch volume for the pip and XDG caches. ~/data is a tree of symlinks
+# into the cache, not an overlay: its files are shared and read-only, and
+# writing to one fails (Jupyter's save follows the link too). A learner who
+# wants to change a dataset copies it out of ~/data first.
+def singleuser_cache_values(settings):
+    return {
+        "storage": {
+            "extraVolumes": [
+                cache_volume(settings),
+                {"name": "lab-scratch", "emptyDir": {"sizeLimit": settings["scratch-size"]}},
+            ],
+            "extraVolumeMounts": [
+                {"name": "lab-cache", "mountPath": CACHE_MOUNT, "readOnly": True},
+                {"name": "lab-scratch", "mountPath": SCRATCH_MOUNT},
+            ],
+        },
+        "extraEnv": {
+            "PIP_FIND_LINKS": f"{CACHE_MOUNT}/wheels",
+            "PIP_CACHE_DIR": f"{SCRATCH_MOUNT}/pip",
+            "XDG_CACHE_HOME": f"{SCRATCH_MOUNT}",
+            "LAB_DATA": f"{CACHE_MOUNT}/data",
+        },
+    }
+
+
+# Links (not copies) of every cached data file under ~/data, existing files kept
+POST_START_LINK_DATA = f'mkdir -p "$HOME/data" && cp -rsn {CACHE_MOUNT}/data/. "$HOME/data"/ || true'
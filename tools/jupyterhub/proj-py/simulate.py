@@ -0,0 +1,418 @@
+# Replays a recorded login trace against the lab node pools and reports node
+# count, node-hours, cost and spawn latency, next to a baseline of a single
+# on-demand pool and of the lab pools with warm capacity (placeholder pods
+# scaled up --class-lead seconds before the first login, image pre-pulled on
+# every node), i.e. how much time to first notebook drops. The trace is a CSV with timestamp (ISO 8601 or epoch
+# seconds), user, profile, module and duration (seconds) columns, module
+# requests come from the catalog (right-sized when usage samples are given).
+#
+#   python simulate.py --trace logins.csv --stack-config Pulumi.aws2023-jupyterhub.yaml
+#
+# The model follows the user scheduler and the cluster-autoscaler settings:
+# pods bin-pack onto the most allocated node that fits, pending pods trigger
+# a scale-up of the pool picked by the expander and wait for it to boot, and
+# empty nodes go after the unneeded time (lab pods are bare pods, the
+# autoscaler never drains a node that still runs one). Spot interruptions
+# are not modelled.
+import argparse
+import csv
+import heapq
+import json
+import sys
+from datetime import datetime
+import yaml
+from capacity import warm_capacity
+from catalog import load_catalog
+from node_pools import autoscaler_settings, node_pool_settings
+from rightsizing import load_usage, module_requests, parse_cpu, parse_memory, right_size
+
+# vCPU, memory and us-west-2 on-demand price of the usual lab instance types,
+# other types need "cpu", "memory" and "hourly-cost" on the pool
+INSTANCE_TYPES = {
+    "t3.large": {"cpu": 2, "memory": "8Gi", "hourly-cost": 0.0832},
+    "t3.xlarge": {"cpu": 4, "memory": "16Gi", "hourly-cost": 0.1664},
+    "m5.large": {"cpu": 2, "memory": "8Gi", "hourly-cost": 0.096},
+    "m5.xlarge": {"cpu": 4, "memory": "16Gi", "hourly-cost": 0.192},
+    "m5a.large": {"cpu": 2, "memory": "8Gi", "hourly-cost": 0.086},
+    "m5a.xlarge": {"cpu": 4, "memory": "16Gi", "hourly-cost": 0.172},
+    "m6i.large": {"cpu": 2, "memory": "8Gi", "hourly-cost": 0.096},
+    "m6i.xlarge": {"cpu": 4, "memory": "16Gi", "hourly-cost": 0.192},
+    "r5.large": {"cpu": 2, "memory": "16Gi", "hourly-cost": 0.126},
+}
+
+# Spot price as a share of on-demand when the pool does not set hourly-cost
+SPOT_PRICE_RATIO = 0.35
+
+# Kept back from every node for the kubelet, system reservations and daemonsets
+NODE_OVERHEAD = {"cpu": 0.2, "memory": "1Gi"}
+
+DEFAULT_TIMINGS = {
+    # Launch to Ready for a new node
+    "node-boot": 150,
+    # Lab image pull on a node that has not pulled it yet
+    "image-pull": 60,
+    # Container start to a responding server
+    "server-start": 10,
+}
+
+BASELINE_POOL = {"name": "baseline", "capacity-type": "ON_DEMAND", "instance-types": ["m5.large"],
+                 "min": 0, "max": 1000, "priority": 10}
+
+# Compared against the baseline when the stack has no node-pools yet
+EXAMPLE_POOLS = [
+    {"name": "spot", "max": 100, "priority": 50},
+    {"name": "on-demand", "capacity-type": "ON_DEMAND", "instance-types": ["m5.large"], "max": 100, "priority": 10},
+]
+
+
+def duration_seconds(value):
+    value = str(value).strip()
+    units = {"s": 1, "m": 60, "h": 3600}
+    if value[-1:] in units:
+        return float(value[:-1]) * units[value[-1]]
+    return float(value)
+
+
+def parse_timestamp(value):
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+
+
+def load_trace(path):
+    logins = []
+    with open(path, newline="") as trace_file:
+        for row in csv.DictReader(trace_file):
+            logins.append({
+                "at": parse_timestamp(row["timestamp"]),
+                "user": row["user"],
+                "profile": row["profile"],
+                "module": row["module"],
+                "duration": duration_seconds(row["duration"]),
+            })
+    return sorted(logins, key=lambda login: login["at"])
+
+
+# Allocatable shape and hourly price of a pool's nodes, from its first instance type
+def pool_shape(pool):
+    instance = {**INSTANCE_TYPES.get(pool["instance-types"][0], {}), **pool}
+    if "cpu" not in instance or "memory" not in instance:
+        raise ValueError(f"unknown instance type {pool['instance-types'][0]!r}, set cpu and memory on pool {pool['name']}")
+    price = float(instance["hourly-cost"])
+    if pool["capacity-type"] == "SPOT" and "hourly-cost" not in pool:
+        price *= SPOT_PRICE_RATIO
+    return {
+        "cpu": parse_cpu(instance["cpu"]) - parse_cpu(NODE_OVERHEAD["cpu"]),
+        "memory": parse_memory(instance["memory"]) - parse_memory(NODE_OVERHEAD["memory"]),
+        "hourly-cost": price,
+    }
+
+
+# (profile, module) -> cpu and memory requests, image variant and node capacity
+def module_demands(lab_catalog, usage=None):
+    profiles = lab_catalog.resolve_images({variant: variant for variant in lab_catalog.images})
+    if usage:
+        profiles = right_size(profiles, usage)
+    requests = iter(module_requests(profiles))
+    demands = {}
+    for profile in profiles:
+        capacity = lab_catalog.scheduling.get(profile.slug, {}).get("capacity", "spot")
+        for module in profile.modules:
+            cpu, memory = next(requests)
+            demands[(profile.slug, module.slug)] = {
+                "cpu": cpu,
+                "memory": memory,
+                "image": module.kubespawner_override["image"],
+                "capacity": capacity,
+            }
+    return demands
+
+
+# Warm capacity for a trace as the stack would configure it: placeholders
+# for the trace's learners at the stack's concurrency, shaped like the most
+# requested module, created "lead" seconds before the first login
+def warm_settings(details, logins, demands, lead):
+    counts = {}
+    for login in logins:
+        key = (login["profile"], login["module"])
+        counts[key] = counts.get(key, 0) + 1
+    return {
+        "replicas": warm_capacity(details, len({login["user"] for login in logins}))["peak_replicas"],
+        "demand": demands[max(counts, key=counts.get)],
+        "prepull": True,
+        "lead": lead,
+    }
+
+
+def _percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+# Warm capacity: "replicas" user-placeholder pods of the "demand" shape
+# created "lead" seconds before the first login (the class-start CronJob),
+# and with "prepull" every node pulls the lab image as soon as it is Ready.
+# Placeholders are preempted by lab pods and go pending, which scales up
+# the next node ahead of the logins that will need it.
+class Simulation:
+
+    def __init__(self, pools, autoscaler, demands, timings=DEFAULT_TIMINGS, warm=None):
+        self.pools = {pool["name"]: {**pool, **pool_shape(pool)} for pool in pools}
+        self.demands = demands
+        self.timings = {key: duration_seconds(value) for key, value in {**DEFAULT_TIMINGS, **timings}.items()}
+        self.unneeded = duration_seconds(autoscaler["scale-down-unneeded-time"])
+        self.delay_after_add = duration_seconds(autoscaler["scale-down-delay-after-add"])
+        self.nodes = []
+        self.events = []
+        self.sequence = 0
+        self.last_scale_up = None
+        self.latencies = []
+        self.scale_ups = 0
+        self.peak_nodes = 0
+        self.unschedulable = 0
+        self.warm = warm
+
+    def _push(self, at, kind, payload):
+        self.sequence += 1
+        heapq.heappush(self.events, (at, self.sequence, kind, payload))
+
+    def _eligible(self, pool, demand):
+        if demand["capacity"] == "on-demand":
+            return pool["capacity-type"] == "ON_DEMAND"
+        return True
+
+    def _fits(self, node, demand):
+        return node["cpu"] >= demand["cpu"] and node["memory"] >= demand["memory"]
+
+    # MostAllocated scoring as configured for the user scheduler, spot
+    # preferred for spot courses
+    def _score(self, node, demand):
+        pool = self.pools[node["pool"]]
+        used = 1 - node["memory"] / pool["memory"] + (1 - node["cpu"] / pool["cpu"] if pool["cpu"] else 0)
+        preferred = demand["capacity"] == "spot" and pool["capacity-type"] == "SPOT"
+        return (preferred, used)
+
+    def _launch(self, pool, now):
+        node = {
+            "pool": pool["name"],
+            "cpu": pool["cpu"],
+            "memory": pool["memory"],
+            "launched": now,
+            "ready": now + self.timings["node-boot"],
+            "stopped": None,
+            "pods": 0,
+            "placeholders": 0,
+            "images": set(),
+            "empty_since": now,
+        }
+        self.nodes.append(node)
+        self.peak_nodes = max(self.peak_nodes, len(self._running()))
+        return node
+
+    def _running(self, pool=None):
+        return [node for node in self.nodes if node["stopped"] is None and (pool is None or node["pool"] == pool)]
+
+    # Expander: highest priority pool able to run the pod, then least waste
+    def _expand(self, demand):
+        candidates = [
+            pool for pool in self.pools.values()
+            if self._eligible(pool, demand) and pool["cpu"] >= demand["cpu"] and pool["memory"] >= demand["memory"]
+            and len(self._running(pool["name"])) < int(pool["max"])
+        ]
+        if not candidates:
+            return None
+        return max(candidates, key=lambda pool: (
+            int(pool["priority"]),
+            -((pool["cpu"] - demand["cpu"]) / pool["cpu"] + (pool["memory"] - demand["memory"]) / pool["memory"]),
+        ))
+
+    # Node for a pending pod: the best Ready one it fits on, else (for a lab
+    # pod) a Ready one where evicting a placeholder makes room, else one still
+    # booting (the autoscaler expects pending pods to land on it), else a new node
+    def _schedule(self, demand, now, preempt):
+        nodes = [
+            node for node in self._running()
+            if self._eligible(self.pools[node["pool"]], demand) and self._fits(node, demand)
+        ]
+        ready = [node for node in nodes if node["ready"] <= now]
+        if ready:
+            return max(ready, key=lambda node: self._score(node, demand)), False
+        placeholder = self.warm and self.warm["demand"]
+        victims = [
+            node for node in self._running()
+            if preempt and node["placeholders"] and node["ready"] <= now and self._eligible(self.pools[node["pool"]], demand)
+            and node["cpu"] + placeholder["cpu"] >= demand["cpu"] and node["memory"] + placeholder["memory"] >= demand["memory"]
+        ]
+        if victims:
+            node = victims[0]
+            self._release(node, placeholder, now)
+            node["placeholders"] -= 1
+            return node, True
+        if nodes:
+            return max(nodes, key=lambda node: self._score(node, demand)), False
+        pool = self._expand(demand)
+        if pool is None:
+            return None, False
+        self.scale_ups += 1
+        self.last_scale_up = now
+        return self._launch(pool, now), False
+
+    def _claim(self, node, demand):
+        node["cpu"] -= demand["cpu"]
+        node["memory"] -= demand["memory"]
+        node["pods"] += 1
+        node["empty_since"] = None
+
+    # A placeholder pod, rescheduled (scaling up if needed) whenever it is evicted
+    def _hold(self, now):
+        node, _ = self._schedule(self.warm["demand"], now, preempt=False)
+        if node is not None:
+            self._claim(node, self.warm["demand"])
+            node["placeholders"] += 1
+
+    def _place(self, login, demand, now):
+        node, preempted = self._schedule(demand, now, preempt=True)
+        if node is None:
+            self.unschedulable += 1
+            return
+        self._claim(node, demand)
+        if preempted:
+            self._hold(now)
+        started = max(now, node["ready"])
+        if self.warm and self.warm["prepull"]:
+            # The pre-puller started pulling when the node became Ready
+            started = max(now, node["ready"] + self.timings["image-pull"])
+        elif demand["image"] not in node["images"]:
+            started += self.timings["image-pull"]
+            node["images"].add(demand["image"])
+        started += self.timings["server-start"]
+        self.latencies.append(started - login["at"])
+        self._push(started + login["duration"], "logout", (node, demand))
+
+    def _release(self, node, demand, now):
+        node["cpu"] += demand["cpu"]
+        node["memory"] += demand["memory"]
+        node["pods"] -= 1
+        if node["pods"] == 0:
+            node["empty_since"] = now
+            self._push(now + self.unneeded, "scale-down", node)
+
+    def _scale_down(self, node, now):
+        if node["stopped"] is not None or node["pods"] or node["empty_since"] is None:
+            return
+        if now - node["empty_since"] < self.unneeded:
+            return
+        if self.last_scale_up is not None and now - self.last_scale_up < self.delay_after_add:
+            self._push(self.last_scale_up + self.delay_after_add, "scale-down", node)
+            return
+        if len(self._running(node["pool"])) <= int(self.pools[node["pool"]]["min"]):
+            return
+        node["stopped"] = now
+
+    def run(self, logins):
+        start = logins[0]["at"] if logins else 0
+        for pool in self.pools.values():
+            for _ in range(int(pool["min"])):
+                self._launch(pool, start - self.timings["node-boot"])
+        for login in logins:
+            self._push(login["at"], "login", login)
+        if self.warm:
+            self._push(start - self.warm["lead"], "warm", self.warm["replicas"])
+        end = start
+        while self.events:
+            now, _, kind, payload = heapq.heappop(self.events)
+            end = now
+            if kind == "login":
+                demand = self.demands.get((payload["profile"], payload["module"]))
+                if demand is None:
+                    raise ValueError(f"{payload['profile']}/{payload['module']} is not in the catalog")
+                self._place(payload, demand, now)
+            elif kind == "logout":
+                self._release(*payload, now)
+            elif kind == "warm":
+                for _ in range(payload):
+                    self._hold(now)
+            else:
+                self._scale_down(payload, now)
+        return self.report(end)
+
+    def report(self, end):
+        pools = {}
+        for name, pool in self.pools.items():
+            hours = sum(
+                ((node["stopped"] if node["stopped"] is not None else end) - node["launched"]) / 3600
+                for node in self.nodes if node["pool"] == name
+            )
+            pools[name] = {
+                "nodes": sum(1 for node in self.nodes if node["pool"] == name),
+                "node_hours": round(hours, 2),
+                "cost": round(hours * pool["hourly-cost"], 2),
+            }
+        return {
+            "spawns": len(self.latencies),
+            "unschedulable": self.unschedulable,
+            "scale_ups": self.scale_ups,
+            "peak_nodes": self.peak_nodes,
+            "node_hours": round(sum(pool["node_hours"] for pool in pools.values()), 2),
+            "cost": round(sum(pool["cost"] for pool in pools.values()), 2),
+            "spawn_p50_seconds": _percentile(self.latencies, 0.5),
+            "spawn_p95_seconds": _percentile(self.latencies, 0.95),
+            "pools": pools,
+        }
+
+
+def stack_details(path):
+    with open(path) as stack_file:
+        return yaml.safe_load(stack_file)["config"]["jupyterhub:details"]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulate lab node pools over a recorded login trace")
+    parser.add_argument("--trace", required=True, help="CSV with timestamp, user, profile, module, duration")
+    parser.add_argument("--stack-config", default="Pulumi.aws2023-jupyterhub.yaml")
+    parser.add_argument("--catalog", help="defaults to the stack's catalog")
+    parser.add_argument("--usage-samples", help="defaults to the stack's usage-samples")
+    parser.add_argument("--node-boot", type=float, default=DEFAULT_TIMINGS["node-boot"])
+    parser.add_argument("--image-pull", type=float, default=DEFAULT_TIMINGS["image-pull"])
+    parser.add_argument("--server-start", type=float, default=DEFAULT_TIMINGS["server-start"])
+    parser.add_argument("--class-lead", type=float, default=900,
+                        help="seconds between the class-start scale-up and the first login")
+    parser.add_argument("--output", help="also write the reports as JSON")
+    args = parser.parse_args(argv)
+
+    details = stack_details(args.stack_config)
+    lab_catalog = load_catalog(args.catalog or details.get("catalog", "./catalog.yaml"))
+    usage_path = args.usage_samples or details.get("usage-samples")
+    demands = module_demands(lab_catalog, load_usage(usage_path) if usage_path else None)
+    logins = load_trace(args.trace)
+    timings = {"node-boot": args.node_boot, "image-pull": args.image_pull, "server-start": args.server_start}
+    autoscaler = autoscaler_settings(details)
+    pools = node_pool_settings(details) or node_pool_settings({"node-pools": EXAMPLE_POOLS})
+
+    reports = {
+        "baseline": Simulation([BASELINE_POOL], autoscaler,
+                               {key: {**demand, "capacity": "any"} for key, demand in demands.items()},
+                               timings).run(logins),
+        "lab-pools": Simulation(pools, autoscaler, demands, timings).run(logins),
+        "warm": Simulation(pools, autoscaler, demands, timings,
+                           warm_settings(details, logins, demands, args.class_lead)).run(logins),
+    }
+    print(f"{len(logins)} logins from {args.trace}")
+    print(f"{'':<10} {'peak nodes':>10} {'node-hours':>10} {'cost':>9} {'p50 spawn':>10} {'p95 spawn':>10} {'unschedulable':>13}")
+    for name, report in reports.items():
+        print(f"{name:<10} {report['peak_nodes']:>10} {report['node_hours']:>10.2f} {report['cost']:>9.2f} "
+              f"{report['spawn_p50_seconds'] or 0:>9.0f}s {report['spawn_p95_seconds'] or 0:>9.0f}s "
+              f"{report['unschedulable']:>13}")
+        for pool, usage in report["pools"].items():
+            print(f"  {pool:<8} {usage['nodes']:>10} {usage['node_hours']:>10.2f} {usage['cost']:>9.2f}")
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(reports, output_file, indent=2)
+    return 1 if reports["lab-pools"]["unschedulable"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,242 @@
+import csv
+import hashlib
+import json
+import pulumi
+import pulumi_kubernetes as k8s
+from pulumi import ResourceOptions
+
+# IAM caps a role trust policy at 2048 characters by default
+TRUST_POLICY_LIMIT = 2048
+
+# IRSA roles tenants are spread over; about 30 service accounts fit one trust policy
+DEFAULT_TRUST_ROLES = 32
+
+DEFAULT_QUOTA = {
+    "pods": "3",
+    "requests.memory": "5Gi",
+}
+
+TENANT_RULES = [
+    {
+        "apiGroups": ["*"],
+        "resources": [
+            "pods",
+            "secrets",
+            "configmaps",
+            "services"
+        ],
+        "verbs": [
+            "get",
+            "list",
+            "watch",
+            "create",
+            "update",
+            "patch",
+            "delete"
+        ],
+    }
+]
+
+SPEC_HASH_ANNOTATION = "ephemeral-labs/spec-hash"
+
+
+# Usernames from details.roster: a list, or a CSV file with a "username" column.
+# Without a roster the single legacy "user-namespace" tenant is used.
+def load_roster(details):
+    roster = details.get("roster")
+    if isinstance(roster, str):
+        with open(roster, newline="") as roster_file:
+            usernames = [row["username"] for row in csv.DictReader(roster_file)]
+    elif roster:
+        usernames = list(roster)
+    else:
+        usernames = [details.get("user-namespace").removeprefix("lab-")]
+    return sorted({username.strip().lower() for username in usernames if username.strip()})
+
+
+# Mirrors c.KubeSpawner.user_namespace_template
+def tenant_namespace(username):
+    return f"lab-{username}"
+
+
+# Everything a tenant renders to, hashed onto its namespace and component outputs
+def tenant_spec(username, svc_account, hub_namespace, quota=None):
+    return {
+        "namespace": tenant_namespace(username),
+        "hub_service": f"hub.{hub_namespace}.svc.cluster.local",
+        "service_account": svc_account,
+        "rules": TENANT_RULES,
+        "quota": quota or DEFAULT_QUOTA,
+    }
+
+
+def spec_hash(spec):
+    return hashlib.sha256(json.dumps(spec, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def _render_trust_policy(account, issuer, svc_account, namespaces):
+    oidc = issuer.replace("https://", "")
+    return json.dumps({
+        "Version": "2012-10-17",
+        "Statement": [{
+            "Effect": "Allow",
+            "Principal": {
+                "Federated": f"arn:aws:iam::{account}:oidc-provider/{oidc}"
+            },
+            "Action": "sts:AssumeRoleWithWebIdentity",
+            "Condition": {
+                "StringEquals": {
+                    f"{oidc}:aud": "sts.amazonaws.com",
+                    f"{oidc}:sub": [f"system:serviceaccount:{namespace}:{svc_account}" for namespace in namespaces]
+                }
+            }
+        }]
+    })
+
+
+# Trust policy for the tenant service accounts of the given namespaces, one
+# exact subject each. Never widened to a wildcard: a policy over the IAM size
+# limit is an error, trust_groups spreads tenants so that it does not happen.
+def trust_policy(account, issuer, svc_account, namespaces):
+    policy = _render_trust_policy(account, issuer, svc_account, namespaces)
+    if len(policy) > TRUST_POLICY_LIMIT:
+        raise ValueError(f"Trust policy for {len(namespaces)} namespaces is {len(policy)} characters, "
+                         f"over the IAM limit of {TRUST_POLICY_LIMIT}")
+    return policy
+
+
+def _role_rank(namespace, index):
+    return hashlib.sha256(f"{index}/{namespace}".encode("utf-8")).hexdigest()
+
+
+# Namespaces by IRSA role index, for roles that have tenants. Every namespace
+# goes to the role ranking highest for it (rendezvous hashing), so its role
+# never depends on the rest of the roster: adding or removing a learner only
+# changes the trust policy of that learner's role, and raising "roles" only
+# moves the learners a new role wins. A role whose policy would not fit the
+# IAM limit (sized with an EKS issuer of the usual shape, the real one is
+# only known once the cluster lookup resolves) asks for more roles.
+def trust_groups(account, region, svc_account, namespaces, roles=DEFAULT_TRUST_ROLES):
+    groups = {}
+    for namespace in sorted(namespaces):
+        groups.setdefault(max(range(roles), key=lambda index: _role_rank(namespace, index)), []).append(namespace)
+    issuer = f"https://oidc.eks.{region}.amazonaws.com/id/{'0' * 32}"
+    for index, group in groups.items():
+        if len(_render_trust_policy(account, issuer, svc_account, group)) > TRUST_POLICY_LIMIT:
+            raise ValueError(f"IRSA role {index} would trust {len(group)} service accounts, over the IAM policy "
+                             f"limit; raise details.irsa-roles (now {roles})")
+    return dict(sorted(groups.items()))
+
+
+# Per-learner namespace, IRSA service account, RBAC, quota and hub service alias.
+# An existing namespace (created before the stack managed tenants) is read,
+# not created, and "moved" maps a child ("service-account", "role",
+# "role-binding", "quota") to the name it had as a top-level resource, so the
+# stack carries its state over: updated in place, or replaced create-before-
+# delete where its Kubernetes name changed, never deleted first.
+class LabTenant(pulumi.ComponentResource):
+
+    def __init__(self, username, svc_account, role_arn, hub_namespace, quota=None, existing_namespace=False,
+                 moved=None, opts=None):
+        super().__init__("ephemeral-labs:index:LabTenant", username, None, opts)
+
+        self.username = username
+        self.namespace_name = tenant_namespace(username)
+        self.spec_hash = spec_hash(tenant_spec(username, svc_account, hub_namespace, quota))
+        child_opts = ResourceOptions(parent=self)
+        moved = moved or {}
+
+        if existing_namespace:
+            self.namespace = k8s.core.v1.Namespace.get(f"{username}-namespace", self.namespace_name, opts=child_opts)
+        else:
+            self.namespace = k8s.core.v1.Namespace(
+                                 f"{username}-namespace",
+                                 metadata=k8s.meta.v1.ObjectMetaArgs(
+                                              name=self.namespace_name,
+                                              labels={"ephemeral-labs/tenant": username},
+                                              annotations={SPEC_HASH_ANNOTATION: self.spec_hash}
+                                          ),
+                                 opts=child_opts
+                             )
+
+        def ns_opts(child):
+            return ResourceOptions(
+                       parent=self,
+                       depends_on=[self.namespace],
+                       aliases=[pulumi.Alias(name=moved[child], parent=pulumi.ROOT_STACK_RESOURCE)] if child in moved else None
+                   )
+
+        self.svc_account = k8s.core.v1.ServiceAccount(
+                               f"{username}-service-account",
+                               metadata=k8s.meta.v1.ObjectMetaArgs(
+                                            annotations={
+                                                 "eks.amazonaws.com/role-arn": role_arn
+                                            },
+                                            name=svc_account,
+                                            namespace=self.namespace_name
+                                        ),
+                               opts=ns_opts("service-account")
+                           )
+
+        self.role = k8s.rbac.v1.Role(
+                        f"{username}-role",
+                        metadata=k8s.meta.v1.ObjectMetaArgs(
+                                     name=f"{svc_account}-role",
+                                     namespace=self.namespace_name
+                                 ),
+                        rules=TENANT_RULES,
+                        opts=ns_opts("role")
+                    )
+
+        self.role_binding = k8s.rbac.v1.RoleBinding(
+                                f"{username}-role-binding",
+                                metadata=k8s.meta.v1.ObjectMetaArgs(
+                                             name=f"{svc_account}-role-binding",
+                                             namespace=self.namespace_name
+                                         ),
+                                subjects=[k8s.rbac.v1.SubjectArgs(
+                                    kind="ServiceAccount",
+                                    name=svc_account,
+                                    namespace=self.namespace_name,
+                                )],
+                                role_ref=k8s.rbac.v1.RoleRefArgs(
+                                    api_group="rbac.authorization.k8s.io",
+                                    kind="Role",
+                                    name=self.role.metadata["name"],
+                                ),
+                                opts=ns_opts("role-binding")
+                            )
+
+        self.quota = k8s.core.v1.ResourceQuota(
+                         f"{username}-quota",
+                         metadata=k8s.meta.v1.ObjectMetaArgs(
+                                      name="lab-quota",
+                                      namespace=self.namespace_name,
+                                  ),
+                         spec=k8s.core.v1.ResourceQuotaSpecArgs(
+                                  hard=quota or DEFAULT_QUOTA
+                              ),
+                         opts=ns_opts("quota")
+                     )
+
+        # Lets lab pods reach the hub API as "hub:8081" from their own namespace
+        self.hub_service = k8s.core.v1.Service(
+                               f"{username}-hub-service",
+                               metadata=k8s.meta.v1.ObjectMetaArgs(
+                                            name="hub",
+                                            namespace=self.namespace_name
+                                        ),
+                               spec=k8s.core.v1.ServiceSpecArgs(
+                                        type="ExternalName",
+                                        external_name=f"hub.{hub_namespace}.svc.cluster.local",
+                                        ports=[k8s.core.v1.ServicePortArgs(port=8081)]
+                                    ),
+                               opts=ns_opts("hub-service")
+                           )
+
+        self.ready = pulumi.Output.all(
+                         self.namespace.id, self.svc_account.id, self.role.id, self.role_binding.id, self.quota.id,
+                         self.hub_service.id
+                     )
+
+        self.register_outputs({"namespace": self.namespace_name, "spec_hash": self.spec_hash})
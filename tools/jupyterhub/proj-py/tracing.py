@@ -0,0 +1,146 @@
+import json
+import os
+import secrets
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+import pulumi
+
+# Timing spans for each phase of a "pulumi up": synchronous work (1Password,
+# catalog, graph construction) as context-managed spans, invokes and resource
+# provisioning as spans that end when their output resolves. Exported as
+# OTLP/JSON, to a file and, when OTEL_EXPORTER_OTLP_ENDPOINT is set, to a
+# collector.
+TRACE_SCOPE = "ephemeral-labs"
+
+_trace_id = secrets.token_hex(16)
+_spans = []
+_pending = []
+_context = threading.local()
+_lock = threading.Lock()
+
+
+def _now():
+    return time.time_ns()
+
+
+def current_span():
+    stack = getattr(_context, "stack", None)
+    return stack[-1] if stack else None
+
+
+def _finish(record, end, error=None):
+    record["endTimeUnixNano"] = str(end)
+    record["status"] = {"code": 2, "message": str(error)} if error else {"code": 1}
+    with _lock:
+        _spans.append(record)
+
+
+def _record(name, parent, attributes):
+    return {
+        "traceId": _trace_id,
+        "spanId": secrets.token_hex(8),
+        "parentSpanId": parent or "",
+        "name": name,
+        "kind": 1,
+        "startTimeUnixNano": str(_now()),
+        "attributes": [
+            {"key": key, "value": {"stringValue": str(value)}}
+            for key, value in sorted(attributes.items())
+        ],
+    }
+
+
+# Synchronous phase, nested spans become its children. Worker threads have no
+# parent of their own, pass parent=current_span() from the submitting thread.
+@contextmanager
+def span(name, parent=None, **attributes):
+    record = _record(name, parent or current_span(), attributes)
+    if not hasattr(_context, "stack"):
+        _context.stack = []
+    _context.stack.append(record["spanId"])
+    try:
+        yield record
+    except BaseException as e:
+        _finish(record, _now(), e)
+        raise
+    else:
+        _finish(record, _now())
+    finally:
+        _context.stack.pop()
+
+
+# Span from now until the output resolves: an invoke's round trip, or a
+# resource's provisioning when given its id. Returns the traced output.
+def traced(name, output, **attributes):
+    record = _record(name, current_span(), attributes)
+
+    def finish(value):
+        _finish(record, _now())
+        return value
+
+    traced_output = pulumi.Output.from_input(output).apply(finish)
+    _pending.append(traced_output)
+    return traced_output
+
+
+def _otlp(spans):
+    return {
+        "resourceSpans": [{
+            "resource": {
+                "attributes": [
+                    {"key": "service.name", "value": {"stringValue": f"pulumi-{pulumi.get_project()}"}},
+                    {"key": "pulumi.stack", "value": {"stringValue": pulumi.get_stack()}},
+                    {"key": "pulumi.dry_run", "value": {"boolValue": pulumi.runtime.is_dry_run()}},
+                ]
+            },
+            "scopeSpans": [{
+                "scope": {"name": TRACE_SCOPE},
+                "spans": sorted(spans, key=lambda record: int(record["startTimeUnixNano"])),
+            }],
+        }]
+    }
+
+
+def _write(path, endpoint):
+    with _lock:
+        payload = json.dumps(_otlp(list(_spans)), indent=1)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as trace_file:
+        trace_file.write(payload)
+    if endpoint:
+        request = urllib.request.Request(f"{endpoint.rstrip('/')}/v1/traces", data=payload.encode("utf-8"),
+                                         headers={"Content-Type": "application/json"})
+        try:
+            urllib.request.urlopen(request, timeout=5).close()
+        except OSError as e:
+            pulumi.log.warn(f"Trace export to {endpoint} failed: {e}")
+
+
+# Closes the program span and writes what is known now (a preview never
+# resolves resource ids), then rewrites the file once every traced output has.
+def export_traces(path, program):
+    _finish(program, _now())
+    endpoint = os.environ.get("OTEL_EXPORTER_OTLP_ENDPOINT")
+    _write(path, None)
+    return pulumi.Output.all(*_pending).apply(lambda _: _write(path, endpoint) or len(_spans))
+
+
+# Span for the whole program, opened as early as possible (on import)
+def program_span():
+    record = _record("pulumi.program", None, {})
+    _context.stack = [record["spanId"]]
+    return record
+
+
+# Count and longest duration (seconds) per span name, for quick reports
+def span_summary():
+    summary = {}
+    with _lock:
+        for record in _spans:
+            seconds = (int(record["endTimeUnixNano"]) - int(record["startTimeUnixNano"])) / 1e9
+            entry = summary.setdefault(record["name"], {"count": 0, "max": 0.0})
+            entry["count"] += 1
+            entry["max"] = round(max(entry["max"], seconds), 3)
+    return dict(sorted(summary.items(), key=lambda item: -item[1]["max"]))
@@ -1,35 +1,189 @@
 import pulumi
 import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from subprocess import run, PIPE
+from threading import Lock
+from cryptography.fernet import Fernet, InvalidToken
+from tracing import current_span, span
 
 # Load static needed details
 config = pulumi.Config()
 data = config.require_object("details")
 
+OP_CACHE_DIR = os.path.expanduser(os.environ.get("OP_CACHE_DIR", "~/.cache/ephemeral-labs"))
+
+
+# 1Password CLI backend, swap "op-bin"/OP_BIN for a fake binary in tests
+class OpCli:
+
+    def __init__(self, binary="op"):
+        self.binary = binary
+        self._signed_in = False
+        self._lock = Lock()
+
+    def signin(self):
+        with self._lock:
+            if not self._signed_in:
+                run([self.binary, "signin"], stdout=PIPE, stderr=PIPE, text=True)
+                self._signed_in = True
+
+    # One "item get" returns every field of the item
+    def get_item(self, vault, item):
+        self.signin()
+        result = run([self.binary, "--vault",
+                      f"{vault}",
+                      "item", "get",
+                      f"{item}",
+                      "--format", "json"],
+                     stdout=PIPE, stderr=PIPE, text=True, check=True)
+        fields = {}
+        for field in json.loads(result.stdout).get("fields", []):
+            if field.get("value") is None:
+                continue
+            fields[field["id"]] = field["value"]
+            if field.get("label"):
+                fields.setdefault(field["label"], field["value"])
+        return fields
+
+
+# Encrypted on-disk cache of resolved items, entries expire after "ttl" seconds.
+# The key never sits next to the cache: it comes from OP_CACHE_KEY or the OS
+# keyring, and without either nothing is written to disk.
+class SecretCache:
+
+    def __init__(self, path, ttl, key):
+        self.path = path
+        self.ttl = ttl
+        self._fernet = Fernet(key)
+        self._entries = self._read()
+
+    def _read(self):
+        try:
+            with open(self.path, "rb") as cache_in:
+                return json.loads(self._fernet.decrypt(cache_in.read()))
+        except (OSError, InvalidToken, ValueError):
+            return {}
+
+    def get(self, vault, item):
+        entry = self._entries.get(f"{vault}/{item}")
+        if entry and time.time() - entry["fetched"] < self.ttl:
+            return entry["fields"]
+        return None
+
+    def put(self, vault, item, fields):
+        self._entries[f"{vault}/{item}"] = {"fetched": time.time(), "fields": fields}
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), mode=0o700, exist_ok=True)
+        with open(os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "wb") as cache_out:
+            cache_out.write(self._fernet.encrypt(json.dumps(self._entries).encode("utf-8")))
+
+
+# Fernet key for the secret cache from OP_CACHE_KEY, else from the OS keyring
+# (created there on first use), None when neither is available
+def cache_key():
+    if os.environ.get("OP_CACHE_KEY"):
+        return os.environ["OP_CACHE_KEY"].encode("utf-8")
+    try:
+        import keyring
+        from keyring.errors import KeyringError
+    except ImportError:
+        return None
+    try:
+        key = keyring.get_password("ephemeral-labs", "op-cache-key")
+        if key is None:
+            key = Fernet.generate_key().decode("utf-8")
+            keyring.set_password("ephemeral-labs", "op-cache-key", key)
+    except KeyringError:
+        return None
+    return key.encode("utf-8")
+
+
+# Resolve every configured item (str or list) with one CLI call per uncached
+# item. Caching to disk is opt-in (op-cache-ttl > 0) and needs a cache key.
+def resolve_secrets(details, backend=None, cache=None):
+    vault = details.get("vault")
+    items = details.get("item")
+    items = [items] if isinstance(items, str) else list(items)
+    # Fleet clusters' GitHub OAuth apps
+    items += [cluster["item"] for cluster in details.get("clusters") or []
+              if cluster.get("item") and cluster["item"] not in items]
+    backend = backend or OpCli(details.get("op-bin", os.environ.get("OP_BIN", "op")))
+    ttl = int(details.get("op-cache-ttl", 0))
+    if cache is None and ttl > 0:
+        key = cache_key()
+        if key is None:
+            print("op-cache-ttl is set but neither OP_CACHE_KEY nor an OS keyring is available, not caching secrets")
+        else:
+            cache = SecretCache(os.path.join(OP_CACHE_DIR, "op-cache.bin"), ttl, key)
+
+    resolved = {}
+    missing = []
+    for item in items:
+        cached = cache.get(vault, item) if cache else None
+        if cached is None:
+            missing.append(item)
+        else:
+            resolved[item] = cached
+
+    if missing:
+        with span("op.signin"):
+            backend.signin()
+        parent = current_span()
+
+        def fetch(item):
+            with span("op.item_get", parent=parent, item=item):
+                return backend.get_item(vault, item)
+
+        with ThreadPoolExecutor(max_workers=len(missing)) as pool:
+            for item, fields in zip(missing, pool.map(fetch, missing)):
+                resolved[item] = fields
+                if cache:
+                    cache.put(vault, item, fields)
+        if cache:
+            cache.save()
+
+    return resolved
+
+
 # Retrieve secrets in 1password
 try:
-    op_init = run(["op", "signin"], stdout=PIPE, stderr=PIPE, text=True)
-    gh_client_id = json.loads(run(["op", "--vault",
-                        f"{data.get('vault')}",
-                        "item", "get",
-                        f"{data.get('item')}",
-                        "--field", "username",
-                        "--format", "json"],
-                        stdout=PIPE, stderr=PIPE, text=True).stdout)["value"]
-    gh_client_secret = json.loads(run(["op", "--vault",
-                            f"{data.get('vault')}",
-                            "item", "get",
-                            f"{data.get('item')}",
-                            "--field", "password",
-                            "--format", "json"],
-                            stdout=PIPE, stderr=PIPE, text=True).stdout)["value"]
+    with span("secrets.resolve", items=data.get("item")):
+        op_items = resolve_secrets(data)
+    gh_item = op_items[data.get("item") if isinstance(data.get("item"), str) else data.get("item")[0]]
+    gh_client_id = gh_item["username"]
+    gh_client_secret = gh_item["password"]
 except Exception as e:
     print(f"OP CLI failed due to {e}")
     exit(1)
 
 
-# Generate kubeconfig for K8s Provider
-def generate_kube_config(server, cert, token):
+# GitHub OAuth app of a fleet cluster's hub, the stack's own item unless the cluster names one
+def github_credentials(cluster):
+    item = op_items[cluster["item"]] if cluster.get("item") else gh_item
+    return item["username"], item["password"]
+
+
+# Generate kubeconfig for K8s Provider. Without a static token the user runs
+# "aws eks get-token"; client-go caches that credential and execs again when
+# its expirationTimestamp (a minute before the 15-minute token lapses) passes.
+def generate_kube_config(server, cert, token=None, cluster_name=None, region=None):
+
+    if token is not None:
+        user = {
+            "token": f"{token}",
+        }
+    else:
+        user = {
+            "exec": {
+                "apiVersion": "client.authentication.k8s.io/v1beta1",
+                "command": "aws",
+                "args": ["--region", f"{region}", "eks", "get-token", "--cluster-name", f"{cluster_name}", "--output", "json"],
+                "interactiveMode": "Never",
+            },
+        }
 
     kubeconfig = json.dumps({
         "apiVersion": "v1",
@@ -51,129 +205,58 @@ def generate_kube_config(server, cert, token):
         "kind": "Config",
         "users": [{
             "name": "data-group-token-user",
-            "user": {
-                "token": f"{token}",
-            },
+            "user": user,
         }],
     })
 
     return kubeconfig
 
-# Template content for values.yml
-values_tpl ='''
-hub:
-  config:
-    JupyterHub:
-      admin_access: True
-      allow_named_servers: True  
-      cleanup_servers: True
-      cleanup_proxy: True
-      concurrent_spawn_limit: 5
-      shutdown_on_logout: True
-  extraEnv:
-    - name: OAUTH_CALLBACK_URL
-      value: https://{app_name}-{lab_name}.{dns_zone}/hub/oauth_callback
-    - name: GITHUB_CLIENT_ID
-      valueFrom:
-        secretKeyRef:
-          name: {secret_name}
-          key: id
-    - name: GITHUB_CLIENT_SECRET
-      valueFrom:
-        secretKeyRef:
-          name: {secret_name}
-          key: secret
-  extraConfig:
-    extra_config.py: |
-      c.Spawner.start_timeout = 300  
-      c.JupyterHub.authenticator_class = 'github'
-      c.GitHubOAuthenticator.client_id = os.environ['GITHUB_CLIENT_ID']
-      c.GitHubOAuthenticator.client_secret = os.environ['GITHUB_CLIENT_SECRET']
-      c.GitHubOAuthenticator.oauth_callback_url = os.environ['OAUTH_CALLBACK_URL']
-      c.GitHubOAuthenticator.allowed_organizations = ['{git_org}']
-      c.GitHubOAuthenticator.scope = ['read:org']
-      c.Authenticator.admin_users = {{'jpperdon'}}
-      c.KubeSpawner.enable_user_namespaces = True
-      c.KubeSpawner.user_namespace_template = u'lab-{{username}}'
-      c.KubeSpawner.environment = {{
-          'JUPYTERHUB_API_URL': 'http://hub.{hub_ns}.svc.cluster.local:8081/hub/api'
-      }}
-            
-      c.KubeSpawner.profile_list = [
-        {{
-            'display_name': 'A1T-ITN1: Introduction to Networks',
-            'description': 'A list of exercise(s) to understand the basic(s) of Networks through the CLI',
-            'slug': 'a1t-itn1-exercises',
-            'default': True,
-            'profile_options': {{
-                'module': {{
-                    'display_name': 'Module(s)',
-                    'choices': {{
-                        'curl': {{
-                            'display_name': 'API Basic(s) through Curl',
-                            'kubespawner_override': {{'mem_limit': '1G'}},
-                        }},
-                        'openssl': {{
-                            'display_name': 'SSL/TLS/mTLS Basic(s) through OpenSSL',
-                            'kubespawner_override': {{'mem_limit': '2G'}},
-                        }}    
-                    }}    
-                }}
-            }}
-        }},
-        {{
-            'display_name': 'AWS Community 2023: Ephemeral Labs Demo',
-            'description': 'A list of exercise(s) to demo Ephemeral Labs',
-            'slug': 'aws-community-2023-exercises',
-            'profile_options': {{
-                'module': {{
-                    'display_name': 'Module(s)',
-                    'choices': {{
-                        'aws_demo': {{
-                            'display_name': 'Curl/OpenSSL/AWSCLI Exercise(s)',
-                            'kubespawner_override': {{'mem_limit': '2G'}},
-                        }}    
-                    }}    
-                }}
-            }}
-        }}        
-      ]      
-  serviceAccount:
-    create: false
-    name: {svc_account}-svc-account     
-singleuser:
-  image:
-    name: {repo_url}
-    tag: latest
-    pullPolicy: IfNotPresent
-    pullSecrets:
-      - regcred
-  serviceAccountName: {usr_svc_account}-svc-account
-  cloudMetadata:
-    blockWithIptables: false
-  allowPrivilegeEscalation: true
-  # extraEnv:
-  #   - name: K8S_NAMESPACE
-  #     valueFrom:
-  #       fieldRef:
-  #         fieldPath: metadata.namespace
-  lifecycleHooks:
-    postStart:
-      exec:
-        command:
-        - "sh"
-        - "-c"
-        - > 
-           kubectl -n $(cat /var/run/secrets/kubernetes.io/serviceaccount/namespace) apply -f https://raw.githubusercontent.com/opswerks/ephemeral-labs-aws-eks-2023/main/addons/hub-svc.yml;
-           git clone https://github.com/jpperdon/sample-notebooks.git AWS-Community-2023_Ephemeral-Labs-Demo || true     
-prePuller:
-  hook:
-    enabled: false
-proxy:
-  service:
-    type: NodePort
-cull:
-  maxAge: 604800
-debug:
-  enabled: true    
-'''
\ No newline at end of file
+DEFAULT_SPAWN_ADMISSION = {
+    "enabled": True,
+    "min": 5,
+    "max": 40,
+    "target-latency": 90,
+    # Seconds a spawn may wait for a slot, and then for its server to start;
+    # the hub's start timeout is their sum
+    "queue-timeout": 600,
+    "start-timeout": 300,
+}
+
+
+DEFAULT_IDLE_CULLING = {
+    "enabled": True,
+    "default-idle-timeout": 3600,
+    "grace-period": 30,
+    "max-age": 604800,
+    "node-memory": 8 * 1024 ** 3,
+    "profiles": {},
+}
+
+
+# Hub-side extension code from ./hub, loaded through hub.extraConfig
+def hub_extension(name):
+    with open(f"./hub/{name}.py") as extension_file:
+        return extension_file.read()
+
+
+# Spawn admission settings (details.spawn-admission) and the matching hub limit
+def spawn_admission(details):
+    settings = {**DEFAULT_SPAWN_ADMISSION, **(details.get("spawn-admission") or {}),
+                "hub-namespace": details.get("namespace")}
+    # JupyterHub's own limit answers 429s, the admission queue replaces it
+    spawn_limit = 0 if settings["enabled"] else settings["min"]
+    start_timeout = int(settings["start-timeout"]) + (int(settings["queue-timeout"]) if settings["enabled"] else 0)
+    return settings, spawn_limit, start_timeout
+
+
+# Per-profile culling settings (details.culling) and the chart's backstop culler
+def idle_culling(details):
+    settings = {**DEFAULT_IDLE_CULLING, **(details.get("culling") or {})}
+    cull = {
+        "enabled": True,
+        "every": 600,
+        "timeout": max([settings["default-idle-timeout"], *settings["profiles"].values()]),
+        "maxAge": settings["max-age"],
+    }
+    # The hub credits each cull with the time until this culler would have stopped the server
+    return {**settings, "backstop-timeout": cull["timeout"]}, cull